@@ -1,33 +1,177 @@
 import json
+import logging
+import queue
 
-from typing import List, Optional
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 from haystack import Pipeline, component
 from haystack.components.builders import PromptBuilder
+from haystack.dataclasses import StreamingChunk
 
 
-from base_llm import get_base_llm
+from base_llm import DEFAULT_MODEL, get_base_llm
+from instrumentation import count, span
 from prompt import prompt as few_shot
+from reply_cache import ReplyCache, digest
+from schema import ValidationError, validator
+from stream_parse import AlertStreamParser
+
+logger = logging.getLogger(__name__)
 
 
 @component
 class AlertGenerator:
-    def __init__(self, prompt: Optional[str] = few_shot):
+    def __init__(
+        self,
+        prompt: Optional[str] = few_shot,
+        streaming: bool = False,
+        cache: Optional[ReplyCache] = None,
+        model: str = DEFAULT_MODEL,
+    ):
         self.alert_generation_prompt = prompt
         if prompt is None:
             self.alert_generation_prompt = prompt
-        builder = PromptBuilder(
+        self._builder = PromptBuilder(
             self.alert_generation_prompt,  # pyright: ignore
             required_variables=["number"],
         )
-        llm = get_base_llm()
+        llm = get_base_llm(
+            model=model, streaming_callback=self._on_chunk if streaming else None
+        )
+        # replies are cached by the rendered prompt, rendered once per count
+        self._prompts: Dict[int, str] = {}
+        self._model = model
+        self._cache = cache
+        self._parser: Optional[AlertStreamParser] = None
+        self._on_alert: Optional[Callable[[Dict], None]] = None
+        self._streamed: List[Dict] = []
         self.pipeline = Pipeline()
-        self.pipeline.add_component(name="builder", instance=builder)
+        self.pipeline.add_component(name="builder", instance=self._builder)
         self.pipeline.add_component(name="llm", instance=llm)
         self.pipeline.connect("builder", "llm")
 
+    def _prompt(self, number: int) -> str:
+        prompt = self._prompts.get(number)
+        if prompt is None:
+            prompt = self._prompts[number] = self._builder.run(number=number)["prompt"]
+        return prompt
+
+    def _cached(self, key: str) -> Optional[List[Dict]]:
+        if self._cache is None:
+            return None
+        alerts = self._cache.get(key)
+        if alerts is None:
+            return None
+        count("replies_cached")
+        count("alerts_generated", len(alerts))
+        return alerts
+
     @component.output_types(alerts=List[dict])
-    def run(self, number: int):
-        result = self.pipeline.run({"builder": {"number": number}})
-        generated_alerts = json.loads(result["llm"]["replies"][0])
+    def run(self, number: int, admit: Optional[Callable[[], None]] = None):
+        """`admit` is called right before the model is, not for cached replies"""
+        key = digest(self._model, self._prompt(number))
+        cached = self._cached(key)
+        if cached is not None:
+            return {"alerts": {"alerts": cached}}
+        if admit is not None:
+            admit()
+        with span("llm_call", mode="batch"):
+            result = self.pipeline.run({"builder": {"number": number}})
+        with span("json_parse"):
+            generated_alerts = json.loads(result["llm"]["replies"][0])
+        valid, rejected = validator.validate_batch(generated_alerts.get("alerts", []))
+        for rejection in rejected:
+            logger.error("dropping invalid alert: %s", rejection.reason)
+        count("alerts_generated", len(valid))
+        count("alerts_rejected", len(rejected))
+        generated_alerts["alerts"] = [alert.to_dict() for alert in valid]
+        if self._cache is not None:
+            self._cache.put(key, generated_alerts["alerts"])
         return {"alerts": generated_alerts}
+
+    def run_streaming(
+        self,
+        number: int,
+        on_alert: Callable[[Dict], None],
+        admit: Optional[Callable[[], None]] = None,
+    ) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        Hands every alert to `on_alert` as soon as it is complete in the
+        reply stream. Malformed alerts are skipped, and if the call dies
+        mid-reply the alerts received so far are still returned.
+        """
+        key = digest(self._model, self._prompt(number))
+        cached = self._cached(key)
+        if cached is not None:
+            for alert in cached:
+                on_alert(alert)
+            return {"alerts": {"alerts": cached}}
+        if admit is not None:
+            admit()
+        self._parser = AlertStreamParser()
+        self._on_alert = on_alert
+        self._streamed = []
+        try:
+            # parsing happens inside the streaming callback, so it's in this span
+            with span("llm_call", mode="streaming"):
+                result = self.pipeline.run({"builder": {"number": number}})
+            if self._parser.parsed == 0 and self._parser.skipped == 0:
+                # the provider didn't stream: parse the full reply instead
+                for alert in self._parser.feed(result["llm"]["replies"][0]):
+                    self._dispatch(alert)
+            if self._cache is not None:
+                # only complete replies, a cut one would be replayed as cut
+                self._cache.put(key, self._streamed)
+        except Exception as e:
+            if not self._streamed:
+                raise e
+            logger.error(f"reply cut short after {len(self._streamed)} alerts: {e}")
+        finally:
+            self._parser.close()
+            count("alerts_generated", self._parser.parsed)
+            count("alerts_rejected", self._parser.skipped)
+            logger.info(
+                "streamed %d alerts, skipped %d malformed",
+                self._parser.parsed,
+                self._parser.skipped,
+            )
+            self._parser = None
+            self._on_alert = None
+        return {"alerts": {"alerts": self._streamed}}
+
+    def _on_chunk(self, chunk: StreamingChunk) -> None:
+        if self._parser is None:
+            return
+        for alert in self._parser.feed(chunk.content):
+            self._dispatch(alert)
+
+    def _dispatch(self, raw: Dict) -> None:
+        try:
+            alert = validator.normalize(raw).to_dict()
+        except ValidationError as e:
+            logger.error(f"dropping invalid alert: {e}")
+            return
+        self._streamed.append(alert)
+        if self._on_alert is not None:
+            self._on_alert(alert)
+
+
+class AlertGeneratorPool:
+    """
+    Fixed set of AlertGenerators built once and lent out one request at a
+    time, so no pipeline is ever run by two requests at once.
+    """
+
+    def __init__(self, size: int = 2, factory: Callable[[], Any] = AlertGenerator):
+        self._generators: "queue.Queue[Any]" = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._generators.put(factory())
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        generator = self._generators.get(timeout=timeout)
+        try:
+            yield generator
+        finally:
+            self._generators.put(generator)
@@ -1,14 +1,24 @@
 from haystack.components.generators.chat import OpenAIChatGenerator
+from haystack.dataclasses import StreamingChunk
 from haystack.utils import Secret
 
+from typing import Callable, Optional
+
 from haystack_integrations.components.generators.google_ai import (
     GoogleAIGeminiGenerator,
 )
 
+DEFAULT_MODEL = "gemini-2.5-flash"
+
 
-def get_base_llm(model: str = "gemini-2.5-flash") -> GoogleAIGeminiGenerator:
+def get_base_llm(
+    model: str = DEFAULT_MODEL,
+    streaming_callback: Optional[Callable[[StreamingChunk], None]] = None,
+) -> GoogleAIGeminiGenerator:
     return GoogleAIGeminiGenerator(
-        api_key=Secret.from_env_var("GOOGLE_API_KEY"), model=model
+        api_key=Secret.from_env_var("GOOGLE_API_KEY"),
+        model=model,
+        streaming_callback=streaming_callback,
     )
 
 
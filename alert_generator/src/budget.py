@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from prompt import prompt as few_shot
+
+logger = logging.getLogger(__name__)
+
+# rough, provider-independent: ~4 characters per token of english / json
+CHARS_PER_TOKEN = 4
+WINDOW_SECONDS = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class GenerationStats:
+    """
+    Exponentially weighted averages of what the LLM and the publisher are
+    doing: call latency, the share of calls that fail, output tokens per
+    alert and publish ack latency. `weight` is how much the newest
+    observation counts. Updated from worker and pub/sub callback threads.
+    """
+
+    def __init__(self, weight: float = 0.2, tokens_per_alert: float = 90) -> None:
+        self._weight = weight
+        self._lock = threading.Lock()
+        self.call_seconds: Optional[float] = None
+        self.error_rate = 0.0
+        self.tokens_per_alert = tokens_per_alert
+        self.publish_seconds: Optional[float] = None
+        self.prompt_tokens = estimate_tokens(few_shot)
+
+    def _average(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return current + self._weight * (value - current)
+
+    def observe_call(self, seconds: float, alerts: Optional[List[Dict]] = None) -> None:
+        """one llm call; `alerts` is None when it failed"""
+        with self._lock:
+            self.call_seconds = self._average(self.call_seconds, seconds)
+            self.error_rate = self._average(self.error_rate, alerts is None)
+            if alerts:
+                chars = sum(len(json.dumps(alert)) for alert in alerts)
+                self.tokens_per_alert = self._average(
+                    self.tokens_per_alert, chars / CHARS_PER_TOKEN / len(alerts)
+                )
+
+    def observe_publish(self, seconds: float) -> None:
+        with self._lock:
+            self.publish_seconds = self._average(self.publish_seconds, seconds)
+
+    def estimate(self, number: int) -> int:
+        """tokens a call for `number` alerts will spend, prompt included"""
+        return int(self.prompt_tokens + number * self.tokens_per_alert)
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            return {
+                "call_seconds": self.call_seconds,
+                "error_rate": round(self.error_rate, 3),
+                "tokens_per_alert": round(self.tokens_per_alert, 1),
+                "publish_seconds": self.publish_seconds,
+            }
+
+
+class RateBudget:
+    """
+    Requests and tokens per minute over a sliding 60s window, shared by
+    every caller of the model in the process. A call larger than the whole
+    token budget is let through alone on an empty window rather than never.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        clock=time.monotonic,
+    ) -> None:
+        self.requests_per_minute = max(1, requests_per_minute)
+        self.tokens_per_minute = max(1, tokens_per_minute)
+        self._clock = clock
+        # (timestamp, tokens) per admitted request
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._tokens -= self._window.popleft()[1]
+
+    def reserve(self, tokens: int) -> float:
+        """admits one request, or returns how long to wait before trying again"""
+        now = self._clock()
+        with self._lock:
+            self._trim(now)
+            fits = (
+                len(self._window) < self.requests_per_minute
+                and self._tokens + tokens <= self.tokens_per_minute
+            )
+            if fits or not self._window:
+                self._window.append((now, tokens))
+                self._tokens += tokens
+                return 0.0
+            return max(0.01, WINDOW_SECONDS - (now - self._window[0][0]))
+
+    async def acquire(self, tokens: int) -> None:
+        while True:
+            delay = self.reserve(tokens)
+            if not delay:
+                return
+            logger.debug("llm budget spent, waiting %.2fs", delay)
+            await asyncio.sleep(delay)
+
+    def remaining(self) -> Tuple[int, int]:
+        """requests and tokens still available in the current window"""
+        with self._lock:
+            self._trim(self._clock())
+            return (
+                self.requests_per_minute - len(self._window),
+                self.tokens_per_minute - self._tokens,
+            )
@@ -0,0 +1,67 @@
+import random
+import string
+import time
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+SERVICES = ["payments", "auth", "orders", "search", "inventory", "notifications"]
+SEVERITIES = ["critical", "high", "medium", "low"]
+SEVERITY_WEIGHTS = [0.15, 0.25, 0.45, 0.15]
+# probability of an alert still being active, per severity
+ACTIVE_PROBABILITY = {"critical": 0.8, "high": 0.5, "medium": 0.2, "low": 0.0}
+
+
+class FakeAlertGenerator:
+    """
+    Offline stand-in for AlertGenerator with the same run(number) contract,
+    for load tests that must not hit the LLM. `latency` simulates the model
+    round trip.
+    """
+
+    def __init__(self, latency: float = 0.0, seed: Optional[int] = None) -> None:
+        self._latency = latency
+        self._random = random.Random(seed)
+
+    def _alert(self, now: datetime) -> Dict:
+        service = self._random.choice(SERVICES)
+        severity = self._random.choices(SEVERITIES, SEVERITY_WEIGHTS)[0]
+        rank = SEVERITIES[::-1].index(severity) + 1
+        active = self._random.random() < ACTIVE_PROBABILITY[severity]
+        total_requests = self._random.randint(100, 10000)
+        timestamp = now - timedelta(seconds=self._random.randint(0, 3600))
+        suffix = "".join(
+            self._random.choices(string.ascii_uppercase + string.digits, k=6)
+        )
+        return {
+            "alert_id": f"ALT-{service.upper()}-{timestamp:%Y%m%d}-{suffix}",
+            "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "service": service,
+            "severity": severity,
+            "status": "active" if active else "resolved",
+            "response_time_ms": self._random.randint(50, 1250 * rank),
+            "error_count": min(total_requests, self._random.randint(0, 125 * rank)),
+            "total_requests": total_requests,
+            "resolution_minutes": None if active else self._random.randint(5, 300),
+        }
+
+    def run(
+        self, number: int, admit: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Dict[str, List[Dict]]]:
+        if admit is not None:
+            admit()
+        if self._latency:
+            time.sleep(self._latency)
+        now = datetime.now(timezone.utc)
+        return {"alerts": {"alerts": [self._alert(now) for _ in range(number)]}}
+
+    def run_streaming(
+        self,
+        number: int,
+        on_alert: Callable[[Dict], None],
+        admit: Optional[Callable[[], None]] = None,
+    ) -> Dict[str, Dict[str, List[Dict]]]:
+        result = self.run(number, admit)
+        for alert in result["alerts"]["alerts"]:
+            on_alert(alert)
+        return result
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from alert_generator import AlertGeneratorPool
+from budget import GenerationStats, RateBudget
+
+logger = logging.getLogger(__name__)
+
+
+def split(count: int, chunk_size: int) -> List[int]:
+    """10 alerts in chunks of 4 -> [4, 4, 2]"""
+    chunk_size = max(1, chunk_size)
+    return [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+
+def _admit(loop: asyncio.AbstractEventLoop, budget: RateBudget, tokens: int) -> None:
+    """waits for room in the budget, from a chunk's worker thread"""
+    asyncio.run_coroutine_threadsafe(budget.acquire(tokens), loop).result()
+
+
+def _discard(alert: Dict) -> None:
+    pass
+
+
+def _run_chunk(
+    pool: AlertGeneratorPool,
+    number: int,
+    timeout: Optional[float],
+    on_chunk: Optional[Callable[[List[Dict]], None]],
+    stats: Optional[GenerationStats],
+    admit: Optional[Callable[[], None]],
+) -> List[Dict]:
+    # the generator calls back right before the model: a cached reply
+    # spends no quota and says nothing about the model's latency or errors
+    start: Optional[float] = None
+
+    def call() -> None:
+        nonlocal start
+        if admit is not None:
+            admit()
+        start = time.monotonic()
+
+    with pool.checkout(timeout) as generator:
+        try:
+            if on_chunk is not None:
+                # parsed as the reply streams in, handed over once it ends
+                result = generator.run_streaming(number, _discard, call)
+            else:
+                result = generator.run(number, call)
+        except Exception:
+            if stats is not None and start is not None:
+                stats.observe_call(time.monotonic() - start)
+            raise
+    alerts = result["alerts"]["alerts"]
+    if stats is not None and start is not None:
+        stats.observe_call(time.monotonic() - start, alerts)
+    if on_chunk is not None and alerts:
+        on_chunk(alerts)
+    return alerts
+
+
+async def generate_concurrently(
+    pool: AlertGeneratorPool,
+    count: int,
+    chunk_size: int = 5,
+    concurrency: int = 4,
+    checkout_timeout: Optional[float] = None,
+    on_chunk: Optional[Callable[[List[Dict]], None]] = None,
+    budget: Optional[RateBudget] = None,
+    stats: Optional[GenerationStats] = None,
+) -> Dict[str, Dict[str, List[Dict]]]:
+    """
+    Generates `count` alerts as several small prompts run side by side,
+    at most `concurrency` at a time. A chunk that fails is logged and left
+    out of the merged result; if every chunk fails the last error is raised.
+    With `on_chunk`, chunks are streamed and each chunk's alerts are handed
+    over together as soon as its reply ends, from the chunk's worker thread;
+    a reply cut short hands over what it got. With `budget`,
+    each model call first waits for room in the requests / tokens per
+    minute budget, and `stats` records every call's latency and outcome.
+    Chunks served from the reply cache do neither.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    loop = asyncio.get_running_loop()
+
+    async def bounded(number: int) -> List[Dict]:
+        admit = None
+        if budget is not None:
+            tokens = stats.estimate(number) if stats is not None else 0
+            admit = partial(_admit, loop, budget, tokens)
+        async with semaphore:
+            return await asyncio.to_thread(
+                _run_chunk, pool, number, checkout_timeout, on_chunk, stats, admit
+            )
+
+    chunks = split(count, chunk_size)
+    logger.debug("generating %d alerts in %d chunks..", count, len(chunks))
+    results = await asyncio.gather(
+        *(bounded(number) for number in chunks), return_exceptions=True
+    )
+
+    alerts: List[Dict] = []
+    errors: List[BaseException] = []
+    for number, result in zip(chunks, results):
+        if isinstance(result, BaseException):
+            logger.error(f"chunk of {number} alerts failed: {result}")
+            errors.append(result)
+            continue
+        alerts.extend(result)
+
+    if errors and len(errors) == len(chunks):
+        raise errors[-1]
+    logger.info(
+        f"generated {len(alerts)} alerts from {len(chunks) - len(errors)}"
+        f"/{len(chunks)} chunks"
+    )
+    return {"alerts": {"alerts": alerts}}
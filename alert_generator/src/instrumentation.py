@@ -0,0 +1,214 @@
+# kept identical in alert_generator/src, alert_processor/src and
+# alert_metrics_calculator/src: each service is deployed from its own source tree
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# seconds, from sub-millisecond parses up to multi-second llm calls
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+ENABLED = os.environ.get("INSTRUMENTATION", "true").lower() != "false"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _summary_key(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    __slots__ = ("name", "help", "_values", "_lock")
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_render_labels(labels)} {value}")
+        return lines
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                _summary_key(labels) or self.name: total
+                for labels, total in self._values.items()
+            }
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: fixed bucket bounds, one bisect and two
+    additions per observation, no samples kept.
+    """
+
+    __slots__ = ("name", "help", "buckets", "_series", "_lock")
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+inf last), sum, count]
+        self._series: Dict[Labels, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"{self.name}_bucket{_render_labels(labels, ('le', le))} "
+                        f"{cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_render_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_render_labels(labels)} {count}")
+        return lines
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                _summary_key(labels): {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                }
+                for labels, (_, total, count) in self._series.items()
+            }
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(name, lambda: Counter(name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get(name, lambda: Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        """prometheus text exposition format, version 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.summary() for metric in metrics}
+
+    def __str__(self) -> str:
+        # lets `logger.info("%s", registry)` defer the work until it's emitted
+        return json.dumps(self.summary(), sort_keys=True)
+
+
+registry = Registry()
+SPAN_SECONDS = registry.histogram(
+    "span_duration_seconds", "wall time of instrumented operations"
+)
+SPAN_ERRORS = registry.counter(
+    "span_errors_total", "instrumented operations that raised"
+)
+ITEMS = registry.counter("items_total", "items handled by instrumented operations")
+
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[None]:
+    """times the block into span_duration_seconds{span=name, ...}"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(span=name, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, span=name, **labels)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s took %.3fms", name, elapsed * 1000)
+
+
+def count(name: str, amount: float = 1, **labels: Any) -> None:
+    if ENABLED:
+        ITEMS.inc(amount, item=name, **labels)
@@ -1,56 +1,202 @@
-from fastapi import FastAPI
-from alert_generator import AlertGenerator
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from alert_generator import AlertGenerator, AlertGeneratorPool
+from budget import GenerationStats
+from fake_generator import FakeAlertGenerator
+from fanout import generate_concurrently
+from instrumentation import LOG_LEVEL, count, registry, span
+from reply_cache import cache_from_env
+from scheduler import budget_from_env, scheduler_from_env
+from synthetic_generator import SyntheticAlertGenerator
+from wire import encode, encoding_from_env
 from google.cloud import pubsub_v1
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
-from typing import Any
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import asyncio
 import os
-import json
 import logging
+import time
 
-app = FastAPI()
-
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# how long a request waits for a free generator under burst load
+CHECKOUT_TIMEOUT = float(os.environ.get("GENERATOR_CHECKOUT_TIMEOUT", 30))
+# a request for N alerts is split into prompts of at most CHUNK_SIZE alerts
+CHUNK_SIZE = int(os.environ.get("GENERATION_CHUNK_SIZE", 5))
+CONCURRENCY = int(os.environ.get("GENERATION_CONCURRENCY", 4))
+# publish each alert as soon as it is parsed out of the streamed reply
+STREAMING = os.environ.get("GENERATION_STREAMING", "false").lower() == "true"
+# llm | fake | synthetic, can be overridden per request with ?backend=
+BACKEND = os.environ.get("ALERT_GENERATOR_BACKEND", "llm")
+# large synthetic batches are split so each message stays under the size cap
+ALERTS_PER_MESSAGE = int(os.environ.get("PUBLISH_ALERTS_PER_MESSAGE", 500))
+# json (default) | msgpack | msgpack+zstd, sent as the `encoding` attribute
+WIRE_ENCODING = encoding_from_env()
+# shared by /generate and the scheduler: one model quota per instance
+budget = budget_from_env()
+stats = GenerationStats()
+# stored llm replies for dev and benchmark runs, off in production
+reply_cache = cache_from_env()
+
+
+def _batch_settings() -> pubsub_v1.types.BatchSettings:
+    return pubsub_v1.types.BatchSettings(
+        max_messages=int(os.environ.get("PUBLISH_MAX_MESSAGES", 100)),
+        max_bytes=int(os.environ.get("PUBLISH_MAX_BYTES", 1024 * 1024)),
+        max_latency=float(os.environ.get("PUBLISH_MAX_LATENCY", 0.01)),
+    )
+
 
 class Publisher:
-    def __init__(self) -> None:
-        self._publisher = pubsub_v1.PublisherClient()
+    def __init__(
+        self, batch_settings: Optional[pubsub_v1.types.BatchSettings] = None
+    ) -> None:
+        self._publisher = pubsub_v1.PublisherClient(
+            batch_settings=batch_settings or _batch_settings()
+        )
         self._topic_path = self._publisher.topic_path(
             os.environ["PROJECT_ID"], os.environ["TOPIC_NAME"]
         )
 
-    def publish(self, message_data: bytes) -> Any:
+    def publish(
+        self, message_data: bytes, attributes: Optional[Dict[str, str]] = None
+    ) -> Any:
         try:
-            future = self._publisher.publish(self._topic_path, message_data)
-            logger.info(f"Published: {str(future)}")
+            # client-side enqueue only: batching makes the send asynchronous
+            with span("publish"):
+                future = self._publisher.publish(
+                    self._topic_path, message_data, **(attributes or {})
+                )
+            logger.debug("Published: %s", future)
             return future
 
         except Exception as e:
             logger.error(f"Error publishing: {e}")
             raise e
 
+    def shutdown(self) -> None:
+        """flushes pending batches and closes the channel"""
+        try:
+            self._publisher.stop()
+            logger.info("publisher stopped")
+        except Exception as e:
+            logger.error(f"Error stopping publisher: {e}")
+
+
+def _generator_factory(backend: str) -> Callable[[], Any]:
+    if backend == "fake":
+        latency = float(os.environ.get("FAKE_LLM_LATENCY", 0))
+        return lambda: FakeAlertGenerator(latency=latency)
+    return lambda: AlertGenerator(streaming=STREAMING, cache=reply_cache)
+
+
+def _encode(alerts: List[Dict]) -> Tuple[bytes, Dict[str, str]]:
+    with span("encode", encoding=WIRE_ENCODING):
+        return encode(alerts, WIRE_ENCODING)
+
+
+def _log_published(started: float, future: Any) -> None:
+    try:
+        message_id = future.result()
+        stats.observe_publish(time.monotonic() - started)
+        count("messages_published")
+        logger.debug("published message with id:%s with success", message_id)
+    except Exception as e:
+        count("messages_failed")
+        logger.error(f"Error publishing: {e}")
+
+
+def _publish_batches(pub: Publisher, alerts: List[Dict]) -> None:
+    for start in range(0, len(alerts), ALERTS_PER_MESSAGE):
+        batch = alerts[start : start + ALERTS_PER_MESSAGE]
+        future = pub.publish(*_encode(batch))
+        # the outcome is only logged, the response doesn't wait for the ack
+        future.add_done_callback(partial(_log_published, time.monotonic()))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.debug("building alert generators and publisher..")
+    size = int(os.environ.get("GENERATOR_POOL_SIZE", CONCURRENCY))
+    # the fake pool is cheap, the llm one is only built when it is the default
+    app.state.pools = {"fake": AlertGeneratorPool(size, _generator_factory("fake"))}
+    if BACKEND == "llm":
+        app.state.pools["llm"] = AlertGeneratorPool(size, _generator_factory("llm"))
+    app.state.publisher = Publisher()
+    app.state.scheduler = scheduler_from_env(
+        app.state.pools,
+        BACKEND,
+        partial(_publish_batches, app.state.publisher),
+        budget,
+        stats,
+        CONCURRENCY,
+    )
+    task = None
+    if app.state.scheduler is not None:
+        task = asyncio.create_task(app.state.scheduler.run())
+    logger.info("alert generators and publisher ready")
+    yield
+    if task is not None:
+        app.state.scheduler.stop()
+        # it may be waiting on the budget for up to a minute
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    app.state.publisher.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
 
 @app.get("/generate")
-def generate_alerts(count: int):
-    ag = AlertGenerator()
-    pub = Publisher()
+async def generate_alerts(
+    count: int,
+    request: Request,
+    backend: Optional[str] = None,
+    seed: Optional[int] = None,
+    now: Optional[datetime] = None,
+):
+    pub = request.app.state.publisher
+    backend = backend or BACKEND
     try:
-        logger.debug("started alert generation")
-        alerts = ag.run(count)
-        logger.info(f"generated {len(alerts)} alerts")
-        print(f"alerts: {alerts}")
-        message_data = json.dumps(
-            {
-                "alerts": alerts,
-                "timestamp": datetime.now().isoformat(),
-            }
-        ).encode("utf-8")
-        logger.debug("publishing started for messages..")
-        future = pub.publish(message_data)
-        message_id = future.result(timeout=10)
-        logger.info(f"published message with id:{message_id} with success")
+        logger.debug("started alert generation with backend %s", backend)
+        if backend == "synthetic":
+            # sampling is vectorized and reproducible from the seed and
+            # `now`, no pool
+            alerts = await asyncio.to_thread(
+                SyntheticAlertGenerator(seed=seed, now=now).run, count
+            )
+            logger.info("generated %d alerts", len(alerts["alerts"]["alerts"]))
+            # encoding large batches is cpu work, off the event loop
+            await asyncio.to_thread(_publish_batches, pub, alerts["alerts"]["alerts"])
+            return {"status": "success", "count": count, "backend": backend}
+
+        pool = request.app.state.pools.get(backend)
+        if pool is None:
+            raise ValueError(f"unknown or disabled backend: {backend}")
+        # streamed chunks are published one message per chunk as they end,
+        # not one per alert: each message is a processor invocation
+        on_chunk = partial(_publish_batches, pub) if STREAMING else None
+        alerts = await generate_concurrently(
+            pool,
+            count,
+            chunk_size=CHUNK_SIZE,
+            concurrency=CONCURRENCY,
+            checkout_timeout=CHECKOUT_TIMEOUT,
+            on_chunk=on_chunk,
+            # the fake backend uses no quota and says nothing about the llm
+            budget=budget if backend == "llm" else None,
+            stats=stats if backend == "llm" else None,
+        )
+        logger.info("generated %d alerts", len(alerts["alerts"]["alerts"]))
+        logger.debug("alerts: %s", alerts)
+        if not STREAMING:
+            logger.debug("publishing started for messages..")
+            await asyncio.to_thread(_publish_batches, pub, alerts["alerts"]["alerts"])
 
         return {
             "status": "success",
@@ -62,6 +208,23 @@ def generate_alerts(count: int):
         return {"status": "error", "reason": f"{e}"}
 
 
+@app.get("/metrics")
+def metrics():
+    """span timings and counters in the prometheus text format"""
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/scheduler")
+def scheduler_status(request: Request):
+    """budget left, llm / publish health and the scheduler's current pace"""
+    scheduler = request.app.state.scheduler
+    if scheduler is None:
+        return {"status": "disabled", **stats.to_dict()}
+    return {"status": "running", **scheduler.to_dict()}
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -1,8 +1,9 @@
-prompt = """
+# the instructions and examples, then the only variable part: the alert count
+prefix = """
 You are a system monitoring service. Generate infrastructure alerts.
 
 CRITICAL INSTRUCTIONS:
-1. Generate EXACTLY {{ number }} infrastructure alerts
+1. Generate EXACTLY the number of infrastructure alerts asked for at the end
 2. Respond with ONLY valid JSON - NO markdown, NO explanations, NO other text
 3. Use double quotes ("") only, never single quotes ('')
 4. Start response with { and end with }
@@ -68,5 +69,9 @@ VALID EXAMPLE OUTPUT:
   ]
 }
 
-RESPOND WITH ONLY THE JSON OBJECT FOR {{ number }} ALERTS:
 """
+
+suffix = """RESPOND WITH ONLY THE JSON OBJECT FOR {{ number }} ALERTS:
+"""
+
+prompt = prefix + suffix
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+REUSE = "reuse"
+REPLAY = "replay"
+MODES = (OFF, REUSE, REPLAY)
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# where replayed replies end unless GENERATION_CACHE_NOW says otherwise,
+# the same hour seeded synthetic runs fall in
+REPLAY_NOW = datetime(2025, 1, 29, 15, 0, 0, tzinfo=timezone.utc)
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def digest(*parts: str) -> str:
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def restamp(
+    alerts: List[Dict], now: Optional[datetime] = None, seed: Optional[str] = None
+) -> List[Dict]:
+    """
+    copies of cached alerts as if just generated: fresh ids, and timestamps
+    moved so the newest is now. served as stored, every hit would be a
+    duplicate of the first one downstream. ids are random, or derived from
+    `seed` so the same seed gives the same ids
+    """
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is not None:
+        now = now.astimezone(timezone.utc)
+    now = now.replace(microsecond=0, tzinfo=None)
+    stamps = [
+        datetime.strptime(alert["timestamp"], TIMESTAMP_FORMAT) for alert in alerts
+    ]
+    shift = now - max(stamps) if stamps else None
+    restamped = []
+    for index, (alert, stamp) in enumerate(zip(alerts, stamps)):
+        moved = stamp + shift
+        # "ALT-AUTH-20250129-FTZ263" keeps its service part
+        parts = alert["alert_id"].split("-")
+        head = "-".join(parts[:2]) if len(parts) >= 4 else parts[0]
+        if seed is None:
+            token = uuid.uuid4().hex[:10].upper()
+        else:
+            token = digest(seed, str(index))[:10].upper()
+        restamped.append(
+            {
+                **alert,
+                "alert_id": f"{head}-{moved.strftime('%Y%m%d')}-{token}",
+                "timestamp": moved.strftime(TIMESTAMP_FORMAT),
+            }
+        )
+    return restamped
+
+
+class ReplyCache:
+    """
+    Validated LLM replies on disk, for dev and benchmark runs.
+
+    Replies are stored once under the hash of their content
+    (`blobs/<sha256>.json`), and each prompt, keyed by the hash of the model
+    and the rendered prompt, lists the replies it got
+    (`prompts/<sha256>.json`). Up to `variants` replies are kept per prompt
+    and handed out in turn, so repeated calls don't all return the same
+    alerts.
+
+    - reuse: calls the model and stores the reply for the first `variants`
+      calls of a prompt, serves stored replies after that
+    - replay: only serves stored replies, a prompt without any raises
+      CacheMiss. no model calls, and deterministic for a given cache and
+      sequence of calls: ids derive from the reply and how many times it
+      was served, timestamps end at `now` (REPLAY_NOW by default)
+
+    Blobs are evicted least recently used first once they take more than
+    `max_bytes`; prompts that lose all their replies miss again. Served
+    replies get fresh alert ids and timestamps, see restamp(); in reuse
+    mode, random ids and the current time.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        mode: str = REUSE,
+        max_bytes: int = 64 * 1024 * 1024,
+        variants: int = 4,
+        now: Optional[datetime] = None,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown reply cache mode: {mode}")
+        self.mode = mode
+        self._max_bytes = max_bytes
+        self._variants = max(1, variants)
+        self._blobs = os.path.join(root, "blobs")
+        self._prompts = os.path.join(root, "prompts")
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._prompts, exist_ok=True)
+        # prompt key -> index of the next variant to hand out
+        self._turns: Dict[str, int] = {}
+        # replay: reply -> times served, and where its timestamps end
+        self._hits: Dict[str, int] = {}
+        self._now = now or (REPLAY_NOW if mode == REPLAY else None)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self._blobs))
+        self._lock = threading.Lock()
+
+    def _read(self, path: str) -> Optional[Any]:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, data: Any) -> None:
+        # atomic, a concurrent reader never sees half a file
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """
+        a stored reply for the prompt, or None when the model should be
+        called. in replay mode, raises CacheMiss instead of returning None
+        """
+        with self._lock:
+            index = os.path.join(self._prompts, f"{key}.json")
+            # the replies, and how many model calls were stored for the prompt:
+            # a model that repeats itself gives fewer replies than calls
+            entry = self._read(index) or {"replies": [], "calls": 0}
+            blobs = entry["replies"]
+            if self.mode == REUSE and entry["calls"] < self._variants:
+                return None
+            while blobs:
+                turn = self._turns.get(key, 0) % len(blobs)
+                self._turns[key] = turn + 1
+                path = os.path.join(self._blobs, f"{blobs[turn]}.json")
+                alerts = self._read(path)
+                if alerts is not None:
+                    # touched, so eviction sees it as recently used
+                    os.utime(path)
+                    if self.mode != REPLAY:
+                        return restamp(alerts, self._now)
+                    hit = self._hits.get(blobs[turn], 0)
+                    self._hits[blobs[turn]] = hit + 1
+                    return restamp(alerts, self._now, seed=f"{blobs[turn]}:{hit}")
+                # evicted: forget it and try the next one
+                del blobs[turn]
+                entry["calls"] = len(blobs)
+                self._write(index, entry)
+                if self.mode == REUSE:
+                    return None
+        if self.mode == REPLAY:
+            raise CacheMiss(f"no stored reply for prompt {key[:12]}")
+        return None
+
+    def put(self, key: str, alerts: List[Dict]) -> None:
+        if self.mode != REUSE or not alerts:
+            return
+        content = json.dumps(alerts, sort_keys=True)
+        blob = digest(content)
+        with self._lock:
+            path = os.path.join(self._blobs, f"{blob}.json")
+            if not os.path.exists(path):
+                self._write(path, alerts)
+                self._size += os.path.getsize(path)
+            index = os.path.join(self._prompts, f"{key}.json")
+            entry = self._read(index) or {"replies": [], "calls": 0}
+            if entry["calls"] < self._variants:
+                entry["calls"] += 1
+                if blob not in entry["replies"]:
+                    entry["replies"].append(blob)
+                self._write(index, entry)
+            if self._size > self._max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        self._size = 0
+        for entry in os.scandir(self._blobs):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            self._size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= self._max_bytes:
+                break
+            os.remove(path)
+            self._size -= size
+            logger.debug("evicted cached reply %s", os.path.basename(path))
+
+
+def cache_from_env() -> Optional[ReplyCache]:
+    """
+    GENERATION_CACHE=reuse|replay (off by default), GENERATION_CACHE_DIR,
+    GENERATION_CACHE_MAX_BYTES, GENERATION_CACHE_VARIANTS,
+    GENERATION_CACHE_NOW (ISO 8601, pins served timestamps)
+    """
+    mode = os.environ.get("GENERATION_CACHE", OFF).lower()
+    if mode == OFF:
+        return None
+    pinned = os.environ.get("GENERATION_CACHE_NOW")
+    return ReplyCache(
+        os.environ.get("GENERATION_CACHE_DIR", ".generation_cache"),
+        mode=mode,
+        max_bytes=int(os.environ.get("GENERATION_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        variants=int(os.environ.get("GENERATION_CACHE_VARIANTS", 4)),
+        now=datetime.fromisoformat(pinned.replace("Z", "+00:00")) if pinned else None,
+    )
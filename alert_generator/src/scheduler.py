@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+from typing import Any, Callable, Dict, List, Optional
+
+from alert_generator import AlertGeneratorPool
+from budget import GenerationStats, RateBudget
+from fanout import generate_concurrently
+from instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+# the share of the request budget the scheduler plans to use, leaving room
+# for /generate calls and estimate error
+HEADROOM = 0.8
+MIN_FACTOR = 0.05
+
+
+class GenerationScheduler:
+    """
+    Generates alerts continuously at `target_per_minute` instead of in
+    fixed-size bursts from Cloud Scheduler.
+
+    Every `interval` seconds it earns the alerts owed since the last tick
+    and generates them once they fill a prompt, capped at one minute's
+    worth so an outage is not followed by a flood. Alerts that could not be
+    generated stay owed and are retried on the next tick, after a backoff
+    that doubles with each tick that produced nothing.
+
+    - the requests / tokens per minute budget is enforced per llm call
+      (see budget.py)
+    - alerts per prompt is the smallest size that reaches the target within
+      the request budget, halved while the error rate is over
+      `max_error_rate`: long replies are the ones that come back broken
+    - the target itself is scaled down by half whenever errors or publish
+      ack latency (`max_publish_seconds`) run high, and recovers by a tenth
+      of the target per healthy tick
+
+    Without `metered` (the fake backend), calls neither wait on the budget
+    nor feed the llm stats: chunks are still sized from them.
+    """
+
+    def __init__(
+        self,
+        pool: AlertGeneratorPool,
+        publish: Callable[[List[Dict]], None],
+        budget: RateBudget,
+        stats: GenerationStats,
+        target_per_minute: float,
+        min_chunk: int = 1,
+        max_chunk: int = 20,
+        concurrency: int = 4,
+        interval: float = 5.0,
+        max_error_rate: float = 0.2,
+        max_publish_seconds: float = 1.0,
+        max_backoff: float = 120.0,
+        checkout_timeout: Optional[float] = None,
+        metered: bool = True,
+        clock=time.monotonic,
+    ) -> None:
+        self._pool = pool
+        self._publish = publish
+        self._budget = budget
+        self._stats = stats
+        self._target = target_per_minute
+        self._min_chunk = max(1, min_chunk)
+        self._max_chunk = max(self._min_chunk, max_chunk)
+        self._concurrency = max(1, concurrency)
+        self._interval = interval
+        self._max_error_rate = max_error_rate
+        self._max_publish_seconds = max_publish_seconds
+        self._max_backoff = max_backoff
+        self._checkout_timeout = checkout_timeout
+        self._metered = metered
+        self._clock = clock
+        self._factor = 1.0
+        self._owed = 0.0
+        self._failures = 0
+        self._stop = asyncio.Event()
+
+    @property
+    def pressured(self) -> bool:
+        publish_seconds = self._stats.publish_seconds
+        return self._stats.error_rate > self._max_error_rate or (
+            publish_seconds is not None and publish_seconds > self._max_publish_seconds
+        )
+
+    def chunk_size(self) -> int:
+        requests = self._budget.requests_per_minute * HEADROOM
+        size = math.ceil(self._target * self._factor / requests)
+        if self._stats.error_rate > self._max_error_rate:
+            size //= 2
+        # the token budget caps it too: one call must fit in a share of it
+        tokens = self._budget.tokens_per_minute * HEADROOM / self._concurrency
+        by_tokens = (tokens - self._stats.prompt_tokens) / self._stats.tokens_per_alert
+        size = min(size, int(by_tokens))
+        return max(self._min_chunk, min(self._max_chunk, size))
+
+    def adapt(self) -> None:
+        if self.pressured:
+            self._factor = max(MIN_FACTOR, self._factor / 2)
+            logger.info(
+                "backing off to %.0f%% of target: %s",
+                100 * self._factor,
+                self._stats.to_dict(),
+            )
+        else:
+            self._factor = min(1.0, self._factor + 0.1)
+
+    def plan(self, elapsed: float) -> int:
+        """alerts to generate this tick"""
+        rate = self._target * self._factor / 60
+        self._owed = min(self._owed + rate * elapsed, self._target)
+        # whole prompts only, a call for one alert costs the same prompt
+        # tokens and the same request as a full one. at most one round of
+        # concurrent calls
+        chunk = self.chunk_size()
+        return min(int(self._owed) // chunk, self._concurrency) * chunk
+
+    async def tick(self, elapsed: float) -> int:
+        """generates and publishes one tick's alerts, returns how many"""
+        self.adapt()
+        wanted = self.plan(elapsed)
+        if wanted <= 0:
+            return 0
+        chunk = self.chunk_size()
+        try:
+            result = await generate_concurrently(
+                self._pool,
+                wanted,
+                chunk_size=chunk,
+                concurrency=self._concurrency,
+                checkout_timeout=self._checkout_timeout,
+                budget=self._budget if self._metered else None,
+                stats=self._stats if self._metered else None,
+            )
+        except Exception as e:
+            self._failures += 1
+            count("scheduler_failures")
+            logger.error(f"scheduled generation of {wanted} alerts failed: {e}")
+            return 0
+        alerts = result["alerts"]["alerts"]
+        self._failures = 0 if alerts else self._failures + 1
+        self._owed = max(0.0, self._owed - len(alerts))
+        if alerts:
+            # encodes on a worker thread, the loop keeps ticking
+            await asyncio.to_thread(self._publish, alerts)
+        count("scheduler_alerts", len(alerts))
+        logger.debug(
+            "tick: %d/%d alerts in chunks of %d, %.1f owed",
+            len(alerts),
+            wanted,
+            chunk,
+            self._owed,
+        )
+        return len(alerts)
+
+    def backoff(self) -> float:
+        if not self._failures:
+            return self._interval
+        return min(self._interval * 2**self._failures, self._max_backoff)
+
+    async def run(self) -> None:
+        logger.info(
+            "generating %.0f alerts/minute within %d rpm / %d tpm",
+            self._target,
+            self._budget.requests_per_minute,
+            self._budget.tokens_per_minute,
+        )
+        last = self._clock()
+        while not self._stop.is_set():
+            now = self._clock()
+            await self.tick(now - last)
+            last = now
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.backoff())
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        remaining_requests, remaining_tokens = self._budget.remaining()
+        return {
+            "target_per_minute": self._target,
+            "factor": round(self._factor, 3),
+            "chunk_size": self.chunk_size(),
+            "owed": round(self._owed, 1),
+            "consecutive_failures": self._failures,
+            "remaining_requests": remaining_requests,
+            "remaining_tokens": remaining_tokens,
+            **self._stats.to_dict(),
+        }
+
+
+def budget_from_env() -> RateBudget:
+    """GENERATION_RPM / GENERATION_TPM, the model quota"""
+    return RateBudget(
+        requests_per_minute=int(os.environ.get("GENERATION_RPM", 60)),
+        tokens_per_minute=int(os.environ.get("GENERATION_TPM", 250000)),
+    )
+
+
+def scheduler_from_env(
+    pools: Dict[str, AlertGeneratorPool],
+    backend: str,
+    publish: Callable[[List[Dict]], None],
+    budget: RateBudget,
+    stats: GenerationStats,
+    concurrency: int,
+) -> Optional[GenerationScheduler]:
+    """
+    GENERATION_TARGET_PER_MINUTE (0, off by default), GENERATION_MAX_CHUNK,
+    GENERATION_MAX_ERROR_RATE, GENERATION_MAX_PUBLISH_SECONDS,
+    SCHEDULER_INTERVAL. drives the llm or fake backend's pool, raises for
+    any other backend
+    """
+    target = float(os.environ.get("GENERATION_TARGET_PER_MINUTE", 0))
+    if target <= 0:
+        return None
+    pool = pools.get(backend)
+    if pool is None:
+        raise ValueError(f"the scheduler can't drive the {backend} backend")
+    return GenerationScheduler(
+        pool,
+        publish,
+        budget,
+        stats,
+        target,
+        max_chunk=int(os.environ.get("GENERATION_MAX_CHUNK", 20)),
+        concurrency=concurrency,
+        metered=backend == "llm",
+        interval=float(os.environ.get("SCHEDULER_INTERVAL", 5)),
+        max_error_rate=float(os.environ.get("GENERATION_MAX_ERROR_RATE", 0.2)),
+        max_publish_seconds=float(
+            os.environ.get("GENERATION_MAX_PUBLISH_SECONDS", 1.0)
+        ),
+    )
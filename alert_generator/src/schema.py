@@ -0,0 +1,197 @@
+# kept identical in alert_generator/src and alert_processor/src:
+# each service is deployed from its own source tree
+import re
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SERVICES = frozenset(
+    ["payments", "auth", "orders", "search", "inventory", "notifications"]
+)
+SEVERITIES = frozenset(["critical", "high", "medium", "low"])
+STATUSES = frozenset(["active", "resolved"])
+
+FIELDS = (
+    "alert_id",
+    "timestamp",
+    "service",
+    "severity",
+    "status",
+    "response_time_ms",
+    "error_count",
+    "total_requests",
+    "resolution_minutes",
+)
+
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$")
+_NULLS = frozenset(["", "null", "none"])
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class Alert:
+    """a validated alert with every field coerced to its schema type"""
+
+    __slots__ = FIELDS
+
+    def __init__(
+        self,
+        alert_id: str,
+        timestamp: str,
+        service: str,
+        severity: str,
+        status: str,
+        response_time_ms: int,
+        error_count: int,
+        total_requests: int,
+        resolution_minutes: Optional[int],
+    ) -> None:
+        self.alert_id = alert_id
+        self.timestamp = timestamp
+        self.service = service
+        self.severity = severity
+        self.status = status
+        self.response_time_ms = response_time_ms
+        self.error_count = error_count
+        self.total_requests = total_requests
+        self.resolution_minutes = resolution_minutes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "alert_id": self.alert_id,
+            "timestamp": self.timestamp,
+            "service": self.service,
+            "severity": self.severity,
+            "status": self.status,
+            "response_time_ms": self.response_time_ms,
+            "error_count": self.error_count,
+            "total_requests": self.total_requests,
+            "resolution_minutes": self.resolution_minutes,
+        }
+
+
+class Rejection:
+    __slots__ = ("record", "reason")
+
+    def __init__(self, record: Any, reason: str) -> None:
+        self.record = record
+        self.reason = reason
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = self.record if isinstance(self.record, dict) else repr(self.record)
+        return {"record": record, "reason": self.reason}
+
+
+def _number(raw: Dict[str, Any], field: str) -> int:
+    value = raw.get(field)
+    if type(value) is int:
+        number = value
+    elif isinstance(value, (float, str)) and not isinstance(value, bool):
+        # floats and numeric strings are rounded to the nearest integer
+        try:
+            number = round(float(value))
+        except (ValueError, OverflowError):
+            raise ValidationError(f"{field} is not a number: {value!r}")
+    else:
+        raise ValidationError(f"{field} is not a number: {value!r}")
+    if number < 0:
+        raise ValidationError(f"{field} is negative: {number}")
+    return number
+
+
+def _choice(raw: Dict[str, Any], field: str, allowed: frozenset) -> str:
+    value = raw.get(field)
+    if not isinstance(value, str):
+        raise ValidationError(f"{field} is not a string: {value!r}")
+    if value not in allowed:
+        value = value.strip().lower()
+        if value not in allowed:
+            raise ValidationError(f"{field} not in {sorted(allowed)}: {value!r}")
+    return value
+
+
+class AlertValidator:
+    """
+    Checks alerts against the rules in prompt.py and coerces them to their
+    schema types: enum values for service/severity/status, integer metrics
+    (numeric strings are converted), error_count <= total_requests, and
+    resolution_minutes null exactly when the alert is active. Unknown fields
+    are dropped.
+    """
+
+    def normalize(self, raw: Any) -> Alert:
+        if not isinstance(raw, dict):
+            raise ValidationError(f"alert is not an object: {type(raw).__name__}")
+
+        alert_id = raw.get("alert_id")
+        # the id doubles as the firestore document id, which can't hold "/"
+        if not isinstance(alert_id, str) or not alert_id.strip() or "/" in alert_id:
+            raise ValidationError(f"invalid alert_id: {alert_id!r}")
+        timestamp = raw.get("timestamp")
+        if not isinstance(timestamp, str) or _TIMESTAMP.match(timestamp) is None:
+            raise ValidationError(f"invalid timestamp: {timestamp!r}")
+
+        # fast paths for already well-typed values, the helpers coerce the rest
+        service = raw.get("service")
+        if type(service) is not str or service not in SERVICES:
+            service = _choice(raw, "service", SERVICES)
+        severity = raw.get("severity")
+        if type(severity) is not str or severity not in SEVERITIES:
+            severity = _choice(raw, "severity", SEVERITIES)
+        status = raw.get("status")
+        if type(status) is not str or status not in STATUSES:
+            status = _choice(raw, "status", STATUSES)
+        response_time_ms = raw.get("response_time_ms")
+        if type(response_time_ms) is not int or response_time_ms < 0:
+            response_time_ms = _number(raw, "response_time_ms")
+        error_count = raw.get("error_count")
+        if type(error_count) is not int or error_count < 0:
+            error_count = _number(raw, "error_count")
+        total_requests = raw.get("total_requests")
+        if type(total_requests) is not int or total_requests < 0:
+            total_requests = _number(raw, "total_requests")
+        if error_count > total_requests:
+            raise ValidationError(
+                f"error_count {error_count} > total_requests {total_requests}"
+            )
+
+        resolution = raw.get("resolution_minutes")
+        if isinstance(resolution, str) and resolution.strip().lower() in _NULLS:
+            resolution = None
+        if status == "active":
+            if resolution is not None:
+                raise ValidationError("active alert has resolution_minutes")
+            resolution_minutes = None
+        else:
+            if resolution is None:
+                raise ValidationError("resolved alert without resolution_minutes")
+            resolution_minutes = _number(raw, "resolution_minutes")
+
+        return Alert(
+            alert_id.strip(),
+            timestamp,
+            service,
+            severity,
+            status,
+            response_time_ms,
+            error_count,
+            total_requests,
+            resolution_minutes,
+        )
+
+    def validate_batch(
+        self, records: Iterable[Any]
+    ) -> Tuple[List[Alert], List[Rejection]]:
+        valid: List[Alert] = []
+        rejected: List[Rejection] = []
+        normalize = self.normalize
+        for record in records:
+            try:
+                valid.append(normalize(record))
+            except ValidationError as e:
+                rejected.append(Rejection(record, str(e)))
+        return valid, rejected
+
+
+validator = AlertValidator()
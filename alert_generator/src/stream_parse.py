@@ -0,0 +1,104 @@
+import json
+import logging
+import re
+
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+_SEEKING, _IN_ARRAY, _DONE = range(3)
+
+
+class AlertStreamParser:
+    """
+    Pulls each object out of the `alerts` array of a streamed LLM reply as
+    soon as its closing brace arrives, without waiting for the whole reply.
+
+    An object that isn't valid JSON is counted in `skipped` and dropped; it
+    doesn't affect the objects around it. Raw newlines can't appear inside
+    JSON strings, so one ends an unterminated string, which resyncs the
+    parser after a missing quote.
+    """
+
+    def __init__(self, key: str = "alerts") -> None:
+        self._opening = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._state = _SEEKING
+        self._head = ""
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.parsed = 0
+        self.skipped = 0
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def feed(self, text: str) -> List[Dict]:
+        if self._state == _SEEKING:
+            self._head += text
+            match = self._opening.search(self._head)
+            if match is None:
+                return []
+            text = self._head[match.end() :]
+            self._head = ""
+            self._state = _IN_ARRAY
+        if self._state == _DONE:
+            return []
+        return self._scan(text)
+
+    def close(self) -> None:
+        """call once the reply is complete; a dangling object is dropped"""
+        if self._buffer:
+            logger.error(f"dropping truncated alert: {''.join(self._buffer)!r}")
+            self.skipped += 1
+            self._buffer = []
+        self._state = _DONE
+
+    def _scan(self, text: str) -> List[Dict]:
+        alerts: List[Dict] = []
+        for char in text:
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                elif char == "]":
+                    self._state = _DONE
+                    break
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"' or char == "\n":
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    alert = self._emit()
+                    if alert is not None:
+                        alerts.append(alert)
+        return alerts
+
+    def _emit(self):
+        fragment = "".join(self._buffer)
+        self._buffer = []
+        try:
+            alert = json.loads(fragment)
+        except ValueError as e:
+            logger.error(f"skipping malformed alert {fragment!r}: {e}")
+            self.skipped += 1
+            return None
+        if not isinstance(alert, dict):
+            self.skipped += 1
+            return None
+        self.parsed += 1
+        return alert
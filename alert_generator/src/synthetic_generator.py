@@ -0,0 +1,129 @@
+import numpy as np
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from fake_generator import SERVICES, SEVERITIES, SEVERITY_WEIGHTS
+
+# per severity, in SEVERITIES order (critical, high, medium, low), following
+# the distribution and correlations described in prompt.py
+ACTIVE_PROBABILITY = np.array([0.8, 0.5, 0.2, 0.0])
+RESPONSE_TIME_MEDIAN_MS = np.array([3000.0, 1500.0, 700.0, 250.0])
+ERROR_RATE = np.array([0.10, 0.05, 0.015, 0.004])
+RESOLUTION_MEDIAN_MIN = np.array([120.0, 60.0, 25.0, 10.0])
+
+SERVICE_CODES = [service.upper() for service in SERVICES]
+# `now` of a seeded generator that isn't given one
+SEEDED_NOW = datetime(2025, 1, 29, 15, 0, 0, tzinfo=timezone.utc)
+
+
+class SyntheticAlertGenerator:
+    """
+    Vectorized alert sampler with the same run(number) contract as
+    AlertGenerator. The same seed and `now` always produce the same alerts;
+    a seed alone pins `now` to SEEDED_NOW, unseeded runs use the clock.
+    run_columns() skips building dicts and returns numpy columns, with
+    service and severity as indexes into SERVICES / SEVERITIES and
+    timestamps as datetime64, which is the fast path for very large volumes.
+    """
+
+    def __init__(
+        self,
+        seed: Optional[int] = None,
+        now: Optional[datetime] = None,
+        window_seconds: int = 3600,
+    ) -> None:
+        self._rng = np.random.default_rng(seed)
+        # keeps ids from different generator instances apart
+        self._prefix = f"{int(self._rng.integers(0, 2**32)):08X}"
+        self._now = now or (SEEDED_NOW if seed is not None else None)
+        self._window_seconds = window_seconds
+        self._issued = 0
+
+    def run_columns(self, number: int) -> Dict[str, np.ndarray]:
+        rng = self._rng
+        severity = rng.choice(len(SEVERITIES), size=number, p=SEVERITY_WEIGHTS)
+        service = rng.integers(0, len(SERVICES), size=number)
+        active = rng.random(number) < ACTIVE_PROBABILITY[severity]
+
+        response_time_ms = np.clip(
+            rng.lognormal(np.log(RESPONSE_TIME_MEDIAN_MS[severity]), 0.4), 50, 5000
+        ).astype(np.int64)
+        total_requests = rng.integers(100, 10001, size=number)
+        error_count = np.minimum(
+            rng.binomial(total_requests, ERROR_RATE[severity]), 500
+        ).astype(np.int64)
+        resolution_minutes = np.clip(
+            rng.lognormal(np.log(RESOLUTION_MEDIAN_MIN[severity]), 0.5), 5, 300
+        ).astype(np.int64)
+
+        now = self._now or datetime.now(timezone.utc)
+        end = np.datetime64(now.astimezone(timezone.utc).replace(tzinfo=None), "s")
+        offsets = rng.integers(0, self._window_seconds, size=number)
+
+        serial = np.arange(self._issued, self._issued + number)
+        self._issued += number
+
+        return {
+            "serial": serial,
+            "timestamp": end - offsets.astype("timedelta64[s]"),
+            "service": service,
+            "severity": severity,
+            "active": active,
+            "response_time_ms": response_time_ms,
+            "error_count": error_count,
+            "total_requests": total_requests,
+            "resolution_minutes": resolution_minutes,
+        }
+
+    def run(self, number: int) -> Dict[str, Dict[str, List[Dict]]]:
+        columns = self.run_columns(number)
+        stamps = np.datetime_as_string(columns["timestamp"], unit="s").tolist()
+        prefix = self._prefix
+        alerts = []
+        for (
+            serial,
+            stamp,
+            service,
+            severity,
+            active,
+            response_time_ms,
+            error_count,
+            total_requests,
+            resolution_minutes,
+        ) in zip(
+            columns["serial"].tolist(),
+            stamps,
+            columns["service"].tolist(),
+            columns["severity"].tolist(),
+            columns["active"].tolist(),
+            columns["response_time_ms"].tolist(),
+            columns["error_count"].tolist(),
+            columns["total_requests"].tolist(),
+            columns["resolution_minutes"].tolist(),
+        ):
+            date = stamp[:10].replace("-", "")
+            alerts.append(
+                {
+                    "alert_id": (
+                        f"ALT-{SERVICE_CODES[service]}-{date}-{prefix}{serial:08d}"
+                    ),
+                    "timestamp": stamp + "Z",
+                    "service": SERVICES[service],
+                    "severity": SEVERITIES[severity],
+                    "status": "active" if active else "resolved",
+                    "response_time_ms": response_time_ms,
+                    "error_count": error_count,
+                    "total_requests": total_requests,
+                    "resolution_minutes": None if active else resolution_minutes,
+                }
+            )
+        return {"alerts": {"alerts": alerts}}
+
+    def run_streaming(
+        self, number: int, on_alert: Callable[[Dict], None]
+    ) -> Dict[str, Dict[str, List[Dict]]]:
+        result = self.run(number)
+        for alert in result["alerts"]["alerts"]:
+            on_alert(alert)
+        return result
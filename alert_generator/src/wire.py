@@ -0,0 +1,163 @@
+# kept identical in alert_generator/src and alert_processor/src:
+# each service is deployed from its own source tree
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import json
+import logging
+import os
+
+try:
+    import msgpack
+except ImportError:  # json still works without it
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# pub/sub message attributes the encoding is negotiated through. messages
+# without them are the original nested json
+ENCODING_ATTRIBUTE = "encoding"
+VERSION_ATTRIBUTE = "wire_version"
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_ZSTD = "msgpack+zstd"
+ENCODINGS = (JSON, MSGPACK, MSGPACK_ZSTD)
+WIRE_VERSION = 2
+
+# codes are positions: append only, never reorder. values missing from a
+# table travel as plain strings
+ENUMS: Dict[str, Tuple[str, ...]] = {
+    "service": ("payments", "auth", "orders", "search", "inventory", "notifications"),
+    "severity": ("critical", "high", "medium", "low"),
+    "status": ("active", "resolved"),
+}
+_CODES = {
+    field: {value: code for code, value in enumerate(values)}
+    for field, values in ENUMS.items()
+}
+
+# zstd pays off on batches, single streamed alerts go uncompressed
+COMPRESS_MIN_BYTES = 512
+ZSTD_LEVEL = 3
+
+
+class WireError(ValueError):
+    pass
+
+
+def available(encoding: str) -> bool:
+    if encoding == MSGPACK:
+        return msgpack is not None
+    if encoding == MSGPACK_ZSTD:
+        return msgpack is not None and zstandard is not None
+    return encoding == JSON
+
+
+def encoding_from_env() -> str:
+    """WIRE_ENCODING, downgraded to what is installed"""
+    # json until every consumer of the topic decodes the compact formats
+    encoding = os.environ.get("WIRE_ENCODING", JSON)
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown WIRE_ENCODING: {encoding}")
+    # ENCODINGS is ordered, each one falls back to the ones before it
+    for candidate in ENCODINGS[ENCODINGS.index(encoding) :: -1]:
+        if available(candidate):
+            if candidate != encoding:
+                logger.warning("%s not installed, publishing %s", encoding, candidate)
+            return candidate
+    return JSON
+
+
+def _rows(alerts: List[Dict[str, Any]]) -> Tuple[List[str], List[List[Any]]]:
+    fields: Dict[str, None] = {}
+    for alert in alerts:
+        fields.update(dict.fromkeys(alert))
+    names = list(fields)
+    rows = []
+    for alert in alerts:
+        row = []
+        for name in names:
+            value = alert.get(name)
+            codes = _CODES.get(name)
+            if codes is not None:
+                value = codes.get(value, value)
+            row.append(value)
+        rows.append(row)
+    return names, rows
+
+
+def encode(
+    alerts: List[Dict[str, Any]], encoding: str = JSON
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    returns the message body and the attributes to publish it with.
+
+    json is the original nested shape, readable by every processor version.
+    msgpack (wire version 2) is a flat batch: field names once, then one row
+    per alert with service, severity and status as small ints
+    """
+    timestamp = datetime.now().isoformat()
+    if encoding == JSON:
+        payload = json.dumps(
+            {"alerts": {"alerts": {"alerts": alerts}}, "timestamp": timestamp}
+        ).encode("utf-8")
+        return payload, {ENCODING_ATTRIBUTE: JSON}
+    if not available(encoding):
+        raise WireError(f"{encoding} is not installed")
+
+    fields, rows = _rows(alerts)
+    payload = msgpack.packb(
+        {"v": WIRE_VERSION, "ts": timestamp, "fields": fields, "rows": rows}
+    )
+    if encoding == MSGPACK_ZSTD and len(payload) >= COMPRESS_MIN_BYTES:
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    else:
+        encoding = MSGPACK
+    return payload, {
+        ENCODING_ATTRIBUTE: encoding,
+        VERSION_ATTRIBUTE: str(WIRE_VERSION),
+    }
+
+
+def decode(
+    payload: bytes, attributes: Optional[Dict[str, str]] = None
+) -> List[Dict[str, Any]]:
+    """the flat alert list of a message, whatever encoding it was sent in"""
+    encoding = (attributes or {}).get(ENCODING_ATTRIBUTE, JSON)
+    if encoding == JSON:
+        data = json.loads(payload.decode("utf-8"))
+        try:
+            alerts = data["alerts"]["alerts"]["alerts"]
+        except (KeyError, TypeError) as e:
+            raise WireError(f"not an alert batch: missing {e}")
+        if not isinstance(alerts, list):
+            raise WireError("not an alert batch: alerts is not a list")
+        return alerts
+    if encoding not in ENCODINGS:
+        raise WireError(f"unknown encoding: {encoding}")
+    if not available(encoding):
+        raise WireError(f"{encoding} is not installed")
+
+    if encoding == MSGPACK_ZSTD:
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    data = msgpack.unpackb(payload)
+    version = data.get("v")
+    if version != WIRE_VERSION:
+        raise WireError(f"unsupported wire version: {version}")
+    fields = data["fields"]
+    tables = [ENUMS.get(name) for name in fields]
+    alerts = []
+    for row in data["rows"]:
+        alert = {}
+        for name, table, value in zip(fields, tables, row):
+            if table is not None and isinstance(value, int):
+                value = table[value] if 0 <= value < len(table) else value
+            alert[name] = value
+        alerts.append(alert)
+    return alerts
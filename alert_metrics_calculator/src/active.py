@@ -0,0 +1,38 @@
+from typing import Any, Dict, Optional
+
+from fields import AlertField, MetricField
+from storage import AlertStore
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def active_breakdown(store: AlertStore) -> Dict[str, Any]:
+    """
+    currently active alerts per service and severity, read from the index
+    alert_processor keeps with ALERT_LIFECYCLE=true. one read per active
+    alert, however long the history
+    """
+    by_service: Dict[str, int] = {}
+    by_severity: Dict[str, int] = {}
+    oldest: Optional[str] = None
+    total = 0
+    for entry in store.stream_active():
+        service = entry.get(AlertField.SERVICE.value)
+        severity = entry.get(AlertField.SEVERITY.value)
+        by_service[service] = by_service.get(service, 0) + 1
+        by_severity[severity] = by_severity.get(severity, 0) + 1
+        since = entry.get("since")
+        if isinstance(since, str) and (oldest is None or since < oldest):
+            oldest = since
+        total += 1
+    logger.info("read %d active alerts from the lifecycle index", total)
+    return {
+        MetricField.TOTAL_ACTIVE_ALERTS.value: total,
+        "by_service": by_service,
+        "by_severity": by_severity,
+        # activation time of the longest running alert
+        "oldest_since": oldest,
+    }
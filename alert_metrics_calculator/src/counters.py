@@ -0,0 +1,49 @@
+from google.cloud.firestore import Client
+
+from typing import Tuple
+
+from engine import MetricsAccumulator
+from groups import GroupedMetrics
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _prune(accumulator: MetricsAccumulator) -> MetricsAccumulator:
+    # decrements leave zeroed entries behind in the shards
+    accumulator.services = {
+        service: count for service, count in accumulator.services.items() if count > 0
+    }
+    for sketch in (accumulator.response_time_sketch, accumulator.resolution_sketch):
+        sketch.bins = {key: count for key, count in sketch.bins.items() if count > 0}
+    return accumulator
+
+
+def read_counters(
+    db: Client, collection: str = "metrics_counters"
+) -> Tuple[MetricsAccumulator, GroupedMetrics]:
+    """
+    sums the counter shards alert_processor increments in-stream
+    (IN_STREAM_METRICS=true) back into global and grouped aggregates.
+    costs one read per shard, whatever the number of alerts
+    """
+    accumulator = MetricsAccumulator()
+    groups = GroupedMetrics()
+    shards = 0
+    for doc in db.collection(collection).stream():
+        data = doc.to_dict() or {}
+        accumulator.merge(MetricsAccumulator.from_dict(data.get("aggregates", {})))
+        groups.merge(GroupedMetrics.from_dict(data.get("groups", {})))
+        shards += 1
+    _prune(accumulator)
+    for accumulators in groups.groups.values():
+        for key in [
+            key for key, group in accumulators.items() if group.total_alerts <= 0
+        ]:
+            del accumulators[key]
+        for group in accumulators.values():
+            _prune(group)
+    logger.info(f"summed {shards} counter shards: {accumulator.total_alerts} alerts")
+    return accumulator, groups
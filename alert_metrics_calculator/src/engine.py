@@ -0,0 +1,270 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Protocol
+
+from fields import AlertField, MetricField
+from sketch import DDSketch
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# only the fields the metrics depend on are pulled from the store
+PROJECTION: List[str] = [
+    AlertField.SERVICE.value,
+    AlertField.SEVERITY.value,
+    AlertField.STATUS.value,
+    AlertField.RESPONSE_TIME_MS.value,
+    AlertField.ERROR_COUNT.value,
+    AlertField.TOTAL_REQUESTS.value,
+    AlertField.RESOLUTION_MINUTES.value,
+]
+
+
+class DocumentSource(Protocol):
+    def stream(self, fields: List[str]) -> Iterable[Dict[str, Any]]: ...
+
+    def stream_since(
+        self, fields: List[str], field: str, value: Any
+    ) -> Iterable[Dict[str, Any]]: ...
+
+    def get(self, ids: List[str], fields: List[str]) -> Iterable[Dict[str, Any]]: ...
+
+
+class InMemoryDocumentSource:
+    def __init__(self, documents: Iterable[Dict[str, Any]]) -> None:
+        self._documents = list(documents)
+
+    def stream(self, fields: List[str]) -> Iterable[Dict[str, Any]]:
+        for doc in self._documents:
+            yield {field: doc[field] for field in fields if field in doc}
+
+    def stream_since(
+        self, fields: List[str], field: str, value: Any
+    ) -> Iterable[Dict[str, Any]]:
+        hits = [
+            doc
+            for doc in self._documents
+            if field in doc and (value is None or doc[field] >= value)
+        ]
+        for doc in sorted(hits, key=lambda doc: doc[field]):
+            yield self._project(doc, fields)
+
+    def get(self, ids: List[str], fields: List[str]) -> Iterable[Dict[str, Any]]:
+        wanted = set(ids)
+        for doc in self._documents:
+            if doc.get(AlertField.ALERT_ID) in wanted:
+                yield self._project(doc, fields)
+
+    @staticmethod
+    def _project(doc: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+        projected = {field: doc[field] for field in fields if field in doc}
+        projected[AlertField.ALERT_ID.value] = doc.get(AlertField.ALERT_ID)
+        return projected
+
+
+def _number(value: Any) -> Optional[float]:
+    # mirrors firestore sum(): anything that isn't a number is skipped
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class MetricsAccumulator:
+    """
+    Running counters for every MetricField, updated one document at a time.
+
+    Average Response Time = sum(response_time_ms) / count(alerts)
+    Error Rate % = error_count / total_requests * 100
+    Average Resolution Time = sum(resolution_minutes) / count(resolved_alerts)
+    Service Health Score = (1 - critical_alerts/total_alerts) * 100
+
+    response_time_ms and resolution_minutes also go into DDSketches for
+    p50 / p90 / p99 / max, which merge like the counters do
+    """
+
+    __slots__ = (
+        "total_alerts",
+        "active_alerts",
+        "resolved_alerts",
+        "critical_alerts",
+        "response_time_ms",
+        "error_count",
+        "total_requests",
+        "resolution_minutes",
+        "services",
+        "response_time_sketch",
+        "resolution_sketch",
+    )
+
+    def __init__(self) -> None:
+        self.total_alerts: int = 0
+        self.active_alerts: int = 0
+        self.resolved_alerts: int = 0
+        self.critical_alerts: int = 0
+        self.response_time_ms: float = 0
+        self.error_count: float = 0
+        self.total_requests: float = 0
+        self.resolution_minutes: float = 0
+        self.services: Dict[str, int] = {}
+        self.response_time_sketch = DDSketch()
+        self.resolution_sketch = DDSketch()
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        self._apply(doc, 1)
+
+    def remove(self, doc: Dict[str, Any]) -> None:
+        """takes back a contribution previously made with add()"""
+        self._apply(doc, -1)
+
+    def _apply(self, doc: Dict[str, Any], sign: int) -> None:
+        self.total_alerts += sign
+        status = doc.get(AlertField.STATUS)
+        if status == "active":
+            self.active_alerts += sign
+        elif status == "resolved":
+            self.resolved_alerts += sign
+        if doc.get(AlertField.SEVERITY) == "critical":
+            self.critical_alerts += sign
+
+        response_time_ms = _number(doc.get(AlertField.RESPONSE_TIME_MS))
+        if response_time_ms is not None:
+            self.response_time_ms += sign * response_time_ms
+            self._track(self.response_time_sketch, response_time_ms, sign)
+        error_count = _number(doc.get(AlertField.ERROR_COUNT))
+        if error_count is not None:
+            self.error_count += sign * error_count
+        total_requests = _number(doc.get(AlertField.TOTAL_REQUESTS))
+        if total_requests is not None:
+            self.total_requests += sign * total_requests
+        resolution_minutes = _number(doc.get(AlertField.RESOLUTION_MINUTES))
+        if resolution_minutes is not None:
+            self.resolution_minutes += sign * resolution_minutes
+            self._track(self.resolution_sketch, resolution_minutes, sign)
+
+        service = doc.get(AlertField.SERVICE)
+        if service:
+            count = self.services.get(service, 0) + sign
+            if count > 0:
+                self.services[service] = count
+            else:
+                self.services.pop(service, None)
+
+    @staticmethod
+    def _track(sketch: DDSketch, value: float, sign: int) -> None:
+        if sign > 0:
+            sketch.add(value)
+        else:
+            sketch.remove(value)
+
+    def merge(self, other: "MetricsAccumulator") -> None:
+        self.total_alerts += other.total_alerts
+        self.active_alerts += other.active_alerts
+        self.resolved_alerts += other.resolved_alerts
+        self.critical_alerts += other.critical_alerts
+        self.response_time_ms += other.response_time_ms
+        self.error_count += other.error_count
+        self.total_requests += other.total_requests
+        self.resolution_minutes += other.resolution_minutes
+        for service, count in other.services.items():
+            self.services[service] = self.services.get(service, 0) + count
+        self.response_time_sketch.merge(other.response_time_sketch)
+        self.resolution_sketch.merge(other.resolution_sketch)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_alerts": self.total_alerts,
+            "active_alerts": self.active_alerts,
+            "resolved_alerts": self.resolved_alerts,
+            "critical_alerts": self.critical_alerts,
+            "response_time_ms": self.response_time_ms,
+            "error_count": self.error_count,
+            "total_requests": self.total_requests,
+            "resolution_minutes": self.resolution_minutes,
+            "services": dict(self.services),
+            "response_time_sketch": self.response_time_sketch.to_dict(),
+            "resolution_sketch": self.resolution_sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricsAccumulator":
+        accumulator = cls()
+        accumulator.total_alerts = data.get("total_alerts", 0)
+        accumulator.active_alerts = data.get("active_alerts", 0)
+        accumulator.resolved_alerts = data.get("resolved_alerts", 0)
+        accumulator.critical_alerts = data.get("critical_alerts", 0)
+        accumulator.response_time_ms = data.get("response_time_ms", 0)
+        accumulator.error_count = data.get("error_count", 0)
+        accumulator.total_requests = data.get("total_requests", 0)
+        accumulator.resolution_minutes = data.get("resolution_minutes", 0)
+        accumulator.services = dict(data.get("services", {}))
+        accumulator.response_time_sketch = DDSketch.from_dict(
+            data.get("response_time_sketch")
+        )
+        accumulator.resolution_sketch = DDSketch.from_dict(
+            data.get("resolution_sketch")
+        )
+        return accumulator
+
+    def to_metrics(self, window_hours: Optional[float] = None) -> Dict[str, float]:
+        """Alerts Per Hour = count(alerts) / time_window_hours, when windowed"""
+        if self.total_alerts > 0:
+            average_response_time = round(self.response_time_ms / self.total_alerts, 2)
+            health_score = round(
+                (1 - (self.critical_alerts / self.total_alerts)) * 100, 2
+            )
+        else:
+            average_response_time = 0.0
+            health_score = 100.0
+
+        if self.total_requests > 0:
+            error_rate = round((self.error_count / self.total_requests) * 100, 2)
+        else:
+            error_rate = 0.0
+
+        if self.resolved_alerts > 0:
+            average_resolution_time = round(
+                self.resolution_minutes / self.resolved_alerts, 2
+            )
+        else:
+            average_resolution_time = 0.0
+
+        metrics = {
+            MetricField.TOTAL_ACTIVE_ALERTS.value: self.active_alerts,
+            MetricField.CRITICAL_ALERTS.value: self.critical_alerts,
+            MetricField.SERVICES_AFFECTED.value: len(self.services),
+            MetricField.AVERAGE_RESPONSE_TIME_MS.value: average_response_time,
+            MetricField.ERROR_RATE_PERCENT.value: error_rate,
+            MetricField.AVERAGE_RESOLUTION_TIME_MIN.value: average_resolution_time,
+            MetricField.SERVICE_HEALTH_SCORE.value: health_score,
+            MetricField.RESPONSE_TIME_PERCENTILES_MS.value: (
+                self.response_time_sketch.summary()
+            ),
+            MetricField.RESOLUTION_TIME_PERCENTILES_MIN.value: (
+                self.resolution_sketch.summary()
+            ),
+        }
+        if window_hours:
+            metrics[MetricField.ALERTS_PER_HOUR.value] = round(
+                self.total_alerts / window_hours, 2
+            )
+        return metrics
+
+
+def compute(
+    source: DocumentSource,
+    fields: List[str] = PROJECTION,
+    sinks: Iterable[Callable[[Dict[str, Any]], None]] = (),
+) -> MetricsAccumulator:
+    """
+    folds every document from the source into one accumulator, handing each
+    one to `sinks` as well so other aggregations can share the same pass
+    """
+    accumulator = MetricsAccumulator()
+    sinks = list(sinks)
+    for doc in source.stream(fields):
+        accumulator.add(doc)
+        for sink in sinks:
+            sink(doc)
+    logger.info("folded %d documents in a single pass", accumulator.total_alerts)
+    return accumulator
@@ -0,0 +1,298 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from clients import firestore_pool
+from fields import AlertField, MetricField
+from storage import AlertStore, FirestoreAlertStore, store_from_env
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+ALERT_SCHEMA = pa.schema(
+    [
+        (AlertField.ALERT_ID.value, pa.string()),
+        (AlertField.TIMESTAMP.value, pa.string()),
+        (AlertField.SERVICE.value, pa.string()),
+        (AlertField.SEVERITY.value, pa.string()),
+        (AlertField.STATUS.value, pa.string()),
+        (AlertField.RESPONSE_TIME_MS.value, pa.int64()),
+        (AlertField.ERROR_COUNT.value, pa.int64()),
+        (AlertField.TOTAL_REQUESTS.value, pa.int64()),
+        (AlertField.RESOLUTION_MINUTES.value, pa.int64()),
+        ("date", pa.string()),
+    ]
+)
+ALERT_FIELDS: List[str] = [field.value for field in AlertField]
+
+# flat numbers become columns, nested maps (windows, breakdowns,
+# percentiles) are kept as a json column so the schema never drifts
+METRIC_COLUMNS: List[str] = [
+    MetricField.TOTAL_ACTIVE_ALERTS.value,
+    MetricField.CRITICAL_ALERTS.value,
+    MetricField.SERVICES_AFFECTED.value,
+    MetricField.AVERAGE_RESPONSE_TIME_MS.value,
+    MetricField.ERROR_RATE_PERCENT.value,
+    MetricField.ALERTS_PER_HOUR.value,
+    MetricField.AVERAGE_RESOLUTION_TIME_MIN.value,
+    MetricField.SERVICE_HEALTH_SCORE.value,
+]
+METRICS_SCHEMA = pa.schema(
+    [("id", pa.string())]
+    + [(column, pa.float64()) for column in METRIC_COLUMNS]
+    + [("details", pa.string()), ("date", pa.string())]
+)
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _number(value: Any) -> Optional[float]:
+    # mirrors firestore sum(): anything that isn't a number is skipped
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class ParquetExporter:
+    """
+    Appends new alerts and metrics documents to hive-partitioned Parquet
+    datasets under `root` (alerts/date=YYYY-MM-DD/, metrics/date=...).
+
+    Alerts are read once, in timestamp order, from a cursor kept in the
+    store (highest timestamp exported plus the ids exported at it), and
+    written as Arrow record batches of `batch_rows`. The cursor only moves
+    after its batch is on disk, and batch files are named after the cursor
+    they start from, so a run that dies halfway is simply redone. Alerts are
+    exported as they were at export time: a later resolve isn't re-exported,
+    and like incremental metrics, an alert stamped before the cursor when it
+    lands is never picked up.
+    """
+
+    def __init__(
+        self,
+        store: AlertStore,
+        root: str,
+        metrics_collection: str = "metrics",
+        cursor_collection: str = "export_state",
+        batch_rows: int = 50_000,
+    ) -> None:
+        self._store = store
+        self._root = root
+        self._metrics_collection = metrics_collection
+        self._cursor_collection = cursor_collection
+        self._batch_rows = max(1, batch_rows)
+
+    def _write(
+        self, name: str, rows: Dict[str, List[Any]], schema: pa.Schema, tag: str
+    ) -> None:
+        batch = pa.RecordBatch.from_pydict(rows, schema=schema)
+        ds.write_dataset(
+            batch,
+            os.path.join(self._root, name),
+            format="parquet",
+            partitioning=ds.partitioning(
+                pa.schema([("date", pa.string())]), flavor="hive"
+            ),
+            basename_template=f"part-{tag}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    @staticmethod
+    def _tag(cursor: Dict[str, Any]) -> str:
+        canonical = json.dumps(cursor, sort_keys=True, default=str)
+        return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+    def alerts_exported_through(self) -> Optional[str]:
+        """every alert stamped before this timestamp is exported"""
+        cursor = self._store.read_document(self._cursor_collection, "alerts") or {}
+        return cursor.get("timestamp")
+
+    def metrics_exported_through(self) -> Optional[str]:
+        """id of the last metrics document exported"""
+        cursor = self._store.read_document(self._cursor_collection, "metrics") or {}
+        return cursor.get("id")
+
+    def export_alerts(self) -> int:
+        cursor = self._store.read_document(self._cursor_collection, "alerts") or {}
+        since: Optional[str] = cursor.get("timestamp")
+        done = set(cursor.get("ids", []))
+        logger.debug(f"exporting alerts since {since}..")
+
+        exported = 0
+        rows: Dict[str, List[Any]] = {name: [] for name in ALERT_SCHEMA.names}
+        tag = self._tag(cursor)
+        docs = self._store.stream_since(ALERT_FIELDS, AlertField.TIMESTAMP.value, since)
+        for doc in docs:
+            alert_id = doc[AlertField.ALERT_ID]
+            timestamp = doc.get(AlertField.TIMESTAMP)
+            if not isinstance(timestamp, str):
+                continue
+            if timestamp == since and alert_id in done:
+                continue
+            for field in ALERT_FIELDS:
+                value = doc.get(field)
+                if ALERT_SCHEMA.field(field).type == pa.int64():
+                    value = _number(value)
+                    value = None if value is None else int(value)
+                rows[field].append(value)
+            rows["date"].append(timestamp[:10])
+            if timestamp != since:
+                since, done = timestamp, set()
+            done.add(alert_id)
+
+            if len(rows["date"]) >= self._batch_rows:
+                exported += self._flush_alerts(rows, tag, since, done)
+                rows = {name: [] for name in ALERT_SCHEMA.names}
+                tag = self._tag({"timestamp": since, "ids": sorted(done)})
+        exported += self._flush_alerts(rows, tag, since, done)
+        logger.info(f"exported {exported} alerts to {self._root}")
+        return exported
+
+    def _flush_alerts(
+        self, rows: Dict[str, List[Any]], tag: str, since: Optional[str], done: set
+    ) -> int:
+        count = len(rows["date"])
+        if count == 0:
+            return 0
+        self._write("alerts", rows, ALERT_SCHEMA, tag)
+        self._store.write_documents(
+            self._cursor_collection,
+            {"alerts": {"timestamp": since, "ids": sorted(done)}},
+        )
+        return count
+
+    def export_metrics(self) -> int:
+        cursor = self._store.read_document(self._cursor_collection, "metrics") or {}
+        after: Optional[str] = cursor.get("id")
+        rows: Dict[str, List[Any]] = {name: [] for name in METRICS_SCHEMA.names}
+        for doc_id, data in self._store.stream_documents(
+            self._metrics_collection, after
+        ):
+            rows["id"].append(doc_id)
+            for column in METRIC_COLUMNS:
+                rows[column].append(_number(data.get(column)))
+            details = {k: v for k, v in data.items() if k not in METRIC_COLUMNS}
+            rows["details"].append(json.dumps(details, default=str))
+            # metrics ids start with the date, see retention.snapshot_id
+            rows["date"].append(doc_id[:10])
+            after = doc_id
+        count = len(rows["id"])
+        if count:
+            self._write("metrics", rows, METRICS_SCHEMA, self._tag(cursor))
+            self._store.write_documents(
+                self._cursor_collection, {"metrics": {"id": after}}
+            )
+        logger.info(f"exported {count} metrics documents to {self._root}")
+        return count
+
+
+def _round(value: Any) -> float:
+    return round(float(value), 2) if value is not None else 0.0
+
+
+def metrics_from_parquet(
+    root: str, start: Optional[str] = None, end: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    recomputes every MetricField from the exported alerts with Arrow
+    compute kernels, over alerts with start <= timestamp < end. the range
+    also prunes date partitions. alerts_per_hour needs both bounds
+    """
+    dataset = ds.dataset(
+        os.path.join(root, "alerts"), format="parquet", partitioning="hive"
+    )
+    expression = None
+    timestamp = ds.field(AlertField.TIMESTAMP.value)
+    for bound in (
+        (
+            None
+            if start is None
+            else (timestamp >= start) & (ds.field("date") >= start[:10])
+        ),
+        None if end is None else (timestamp < end) & (ds.field("date") <= end[:10]),
+    ):
+        if bound is not None:
+            expression = bound if expression is None else expression & bound
+    table = dataset.to_table(
+        columns=[field for field in ALERT_FIELDS if field != AlertField.ALERT_ID],
+        filter=expression,
+    )
+
+    total = table.num_rows
+    status = table[AlertField.STATUS.value]
+    severity = table[AlertField.SEVERITY.value]
+    response_time = table[AlertField.RESPONSE_TIME_MS.value]
+    resolution = table[AlertField.RESOLUTION_MINUTES.value]
+    active = pc.sum(pc.equal(status, "active")).as_py() or 0
+    resolved = pc.sum(pc.equal(status, "resolved")).as_py() or 0
+    critical = pc.sum(pc.equal(severity, "critical")).as_py() or 0
+    total_requests = pc.sum(table[AlertField.TOTAL_REQUESTS.value]).as_py() or 0
+    error_count = pc.sum(table[AlertField.ERROR_COUNT.value]).as_py() or 0
+
+    metrics: Dict[str, Any] = {
+        MetricField.TOTAL_ACTIVE_ALERTS.value: active,
+        MetricField.CRITICAL_ALERTS.value: critical,
+        MetricField.SERVICES_AFFECTED.value: pc.count_distinct(
+            table[AlertField.SERVICE.value]
+        ).as_py(),
+        MetricField.AVERAGE_RESPONSE_TIME_MS.value: (
+            _round(pc.sum(response_time).as_py() / total) if total else 0.0
+        ),
+        MetricField.ERROR_RATE_PERCENT.value: (
+            _round(error_count / total_requests * 100) if total_requests else 0.0
+        ),
+        MetricField.AVERAGE_RESOLUTION_TIME_MIN.value: (
+            _round(pc.sum(resolution).as_py() / resolved) if resolved else 0.0
+        ),
+        MetricField.SERVICE_HEALTH_SCORE.value: (
+            _round((1 - critical / total) * 100) if total else 100.0
+        ),
+        MetricField.RESPONSE_TIME_PERCENTILES_MS.value: _percentiles(response_time),
+        MetricField.RESOLUTION_TIME_PERCENTILES_MIN.value: _percentiles(resolution),
+    }
+    if start is not None and end is not None:
+        window = datetime.strptime(end, TIMESTAMP_FORMAT) - datetime.strptime(
+            start, TIMESTAMP_FORMAT
+        )
+        window_hours = window.total_seconds() / 3600
+        if window_hours > 0:
+            metrics[MetricField.ALERTS_PER_HOUR.value] = _round(total / window_hours)
+    return metrics
+
+
+def _percentiles(column: pa.ChunkedArray) -> Dict[str, float]:
+    """exact p50 / p90 / p99 / max, nulls skipped"""
+    values = pc.quantile(column, q=[0.5, 0.9, 0.99], interpolation="lower")
+    p50, p90, p99 = (_round(value) for value in values.to_pylist())
+    return {"p50": p50, "p90": p90, "p99": p99, "max": _round(pc.max(column).as_py())}
+
+
+def export_all(
+    store: AlertStore, root: str, batch_rows: int = 50_000
+) -> Dict[str, int]:
+    exporter = ParquetExporter(store, root, batch_rows=batch_rows)
+    return {"alerts": exporter.export_alerts(), "metrics": exporter.export_metrics()}
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="export alerts and metrics to parquet")
+    parser.add_argument("--root", default=os.environ.get("EXPORT_ROOT", "export"))
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    args = parser.parse_args(argv)
+    store = store_from_env() or FirestoreAlertStore(firestore_pool.get())
+    print(export_all(store, args.root, batch_rows=args.batch_rows))
+
+
+if __name__ == "__main__":
+    main()
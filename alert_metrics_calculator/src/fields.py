@@ -0,0 +1,47 @@
+from enum import Enum
+
+
+class Operator(str, Enum):
+    EQUAL = "=="
+    LT = "<="
+    BT = ">="
+    LESS = "<"
+
+
+class AlertField(str, Enum):
+    ALERT_ID = "alert_id"
+    TIMESTAMP = "timestamp"
+    SERVICE = "service"
+    SEVERITY = "severity"
+    STATUS = "status"
+    RESPONSE_TIME_MS = "response_time_ms"
+    ERROR_COUNT = "error_count"
+    TOTAL_REQUESTS = "total_requests"
+    RESOLUTION_MINUTES = "resolution_minutes"
+
+
+class MetricField(str, Enum):
+    TOTAL_ACTIVE_ALERTS = "total_active_alerts"
+    CRITICAL_ALERTS = "critical_alerts"
+    SERVICES_AFFECTED = "services_affected"
+    AVERAGE_RESPONSE_TIME_MS = "average_response_time_ms"
+    ERROR_RATE_PERCENT = "error_rate_percent"
+    ALERTS_PER_HOUR = "alerts_per_hour"
+    AVERAGE_RESOLUTION_TIME_MIN = "average_resolution_time_min"
+    SERVICE_HEALTH_SCORE = "service_health_score"
+    RESPONSE_TIME_PERCENTILES_MS = "response_time_percentiles_ms"
+    RESOLUTION_TIME_PERCENTILES_MIN = "resolution_time_percentiles_min"
+
+
+METRICS = {
+    "total_active_alerts": 0,
+    "critical_alerts": 0,
+    "services_affected": 0,
+    "average_response_time_ms": 0.0,
+    "error_rate_percent": 0.0,
+    "alerts_per_hour": 0.0,
+    "average_resolution_time_min": 0.0,
+    "service_health_score": 0.0,
+    "response_time_percentiles_ms": {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0},
+    "resolution_time_percentiles_min": {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0},
+}
@@ -0,0 +1,98 @@
+from typing import Any, Dict, Iterable
+
+from engine import MetricsAccumulator
+from fields import AlertField, MetricField
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+GROUP_FIELDS = (AlertField.SERVICE.value, AlertField.SEVERITY.value)
+
+# the subset of MetricField that is meaningful inside a single group
+GROUP_METRICS = (
+    MetricField.TOTAL_ACTIVE_ALERTS.value,
+    MetricField.AVERAGE_RESPONSE_TIME_MS.value,
+    MetricField.ERROR_RATE_PERCENT.value,
+    MetricField.AVERAGE_RESOLUTION_TIME_MIN.value,
+    MetricField.SERVICE_HEALTH_SCORE.value,
+    MetricField.RESPONSE_TIME_PERCENTILES_MS.value,
+    MetricField.RESOLUTION_TIME_PERCENTILES_MIN.value,
+)
+
+
+class GroupedMetrics:
+    """
+    One MetricsAccumulator per value of every grouping field, so a single
+    pass yields per-service and per-severity numbers alongside the global
+    ones. Alerts without a value for a field are left out of that grouping.
+    """
+
+    __slots__ = ("groups",)
+
+    def __init__(self, fields: Iterable[str] = GROUP_FIELDS) -> None:
+        self.groups: Dict[str, Dict[str, MetricsAccumulator]] = {
+            field: {} for field in fields
+        }
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        for field, accumulators in self.groups.items():
+            key = doc.get(field)
+            if not isinstance(key, str) or not key:
+                continue
+            accumulator = accumulators.get(key)
+            if accumulator is None:
+                accumulator = accumulators[key] = MetricsAccumulator()
+            accumulator.add(doc)
+
+    def remove(self, doc: Dict[str, Any]) -> None:
+        """takes back a contribution previously made with add()"""
+        for field, accumulators in self.groups.items():
+            key = doc.get(field)
+            if not isinstance(key, str) or key not in accumulators:
+                continue
+            accumulator = accumulators[key]
+            accumulator.remove(doc)
+            if accumulator.total_alerts <= 0:
+                del accumulators[key]
+
+    def merge(self, other: "GroupedMetrics") -> None:
+        for field, accumulators in other.groups.items():
+            mine = self.groups.setdefault(field, {})
+            for key, accumulator in accumulators.items():
+                mine.setdefault(key, MetricsAccumulator()).merge(accumulator)
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        return {
+            field: {
+                key: accumulator.to_dict() for key, accumulator in accumulators.items()
+            }
+            for field, accumulators in self.groups.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, Dict[str, Any]]]) -> "GroupedMetrics":
+        grouped = cls()
+        for field, accumulators in data.items():
+            grouped.groups[field] = {
+                key: MetricsAccumulator.from_dict(aggregates)
+                for key, aggregates in accumulators.items()
+            }
+        return grouped
+
+    def to_metrics(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        {"by_service": {"payments": {...}}, "by_severity": {"critical": {...}}}
+        each group carrying total_alerts plus GROUP_METRICS
+        """
+        breakdowns: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for field, accumulators in self.groups.items():
+            breakdown = breakdowns[f"by_{field}"] = {}
+            for key in sorted(accumulators):
+                accumulator = accumulators[key]
+                metrics = accumulator.to_metrics()
+                breakdown[key] = {"total_alerts": accumulator.total_alerts}
+                breakdown[key].update((name, metrics[name]) for name in GROUP_METRICS)
+        return breakdowns
@@ -0,0 +1,394 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Protocol
+
+from engine import PROJECTION, DocumentSource, MetricsAccumulator
+from fields import AlertField
+from groups import GroupedMetrics
+from storage import INGESTED_AT, INGESTED_FORMAT, AlertStore
+
+import logging
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+INCREMENTAL_FIELDS: List[str] = PROJECTION + [AlertField.TIMESTAMP.value]
+TRACKED_COLLECTION = "metrics_state_active"
+# bumped whenever the stored aggregates gain something old state lacks
+STATE_VERSION = 5
+
+
+class MetricsState:
+    """
+    Running aggregates, globally and per group, plus the bookkeeping needed
+    to extend them. The contributions of alerts folded while still active
+    are kept out of it, one document each in the state store's tracked
+    collection, so the state stays a few KB however many alerts are active.
+
+    lineage: identifies the state across runs, a new one whenever it is
+        rebuilt from scratch
+    generation: number of runs saved so far
+    watermark: highest ingestion time folded so far
+    recent: ingestion time of every alert folded at or after the watermark
+        less the lookback, the ones the next run sees again
+    tracked: contribution of every alert this run looked up, None when it
+        isn't tracked
+    changed: what `tracked` held for the alerts this run changed
+    """
+
+    __slots__ = (
+        "accumulator",
+        "groups",
+        "lineage",
+        "generation",
+        "watermark",
+        "recent",
+        "tracked",
+        "changed",
+    )
+
+    def __init__(
+        self,
+        accumulator: Optional[MetricsAccumulator] = None,
+        groups: Optional[GroupedMetrics] = None,
+        lineage: Optional[str] = None,
+        generation: int = 0,
+        watermark: Optional[str] = None,
+        recent: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.accumulator = accumulator or MetricsAccumulator()
+        self.groups = groups or GroupedMetrics()
+        self.lineage = lineage or uuid.uuid4().hex
+        self.generation = generation
+        self.watermark = watermark
+        self.recent: Dict[str, str] = dict(recent or {})
+        self.tracked: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.changed: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": STATE_VERSION,
+            "aggregates": self.accumulator.to_dict(),
+            "groups": self.groups.to_dict(),
+            "lineage": self.lineage,
+            "generation": self.generation,
+            "watermark": self.watermark,
+            "recent": self.recent,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetricsState":
+        return cls(
+            accumulator=MetricsAccumulator.from_dict(data.get("aggregates", {})),
+            groups=GroupedMetrics.from_dict(data.get("groups", {})),
+            lineage=data.get("lineage"),
+            generation=data.get("generation", 0),
+            watermark=data.get("watermark"),
+            recent=data.get("recent"),
+        )
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        self.accumulator.add(doc)
+        self.groups.add(doc)
+
+    def remove(self, doc: Dict[str, Any]) -> None:
+        self.accumulator.remove(doc)
+        self.groups.remove(doc)
+
+    def track(self, alert_id: str, contribution: Optional[Dict[str, Any]]) -> None:
+        if alert_id not in self.changed:
+            self.changed[alert_id] = self.tracked.get(alert_id)
+        self.tracked[alert_id] = contribution
+
+
+class StateStore(Protocol):
+    """
+    The state document, plus one tracked entry per active alert:
+    {"generation", "contribution", "previous"}, see IncrementalMetrics
+    """
+
+    def load(self) -> Optional[Dict[str, Any]]: ...
+
+    def save(self, state: Dict[str, Any]) -> None: ...
+
+    def tracked(self, ids: List[str]) -> Dict[str, Dict[str, Any]]: ...
+
+    def stream_tracked(self) -> Iterable[str]: ...
+
+    def track(self, entries: Dict[str, Optional[Dict[str, Any]]]) -> None: ...
+
+
+class DocumentStateStore:
+    """keeps the state as plain documents of any AlertStore"""
+
+    def __init__(
+        self,
+        store: AlertStore,
+        collection: str = "metrics_state",
+        document: str = "incremental",
+        tracked_collection: str = TRACKED_COLLECTION,
+    ) -> None:
+        self._store = store
+        self._collection = collection
+        self._document = document
+        self._tracked_collection = tracked_collection
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        return self._store.read_document(self._collection, self._document)
+
+    def save(self, state: Dict[str, Any]) -> None:
+        self._store.write_documents(self._collection, {self._document: state})
+
+    def tracked(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return self._store.read_documents(self._tracked_collection, ids)
+
+    def stream_tracked(self) -> Iterable[str]:
+        for alert_id, _ in self._store.stream_documents(self._tracked_collection):
+            yield alert_id
+
+    def track(self, entries: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """writes the entries, deletes those that are None"""
+        self._store.write_documents(
+            self._tracked_collection,
+            {alert_id: entry for alert_id, entry in entries.items() if entry},
+        )
+        self._store.delete_documents(
+            self._tracked_collection,
+            [alert_id for alert_id, entry in entries.items() if entry is None],
+        )
+
+
+class InMemoryStateStore:
+    def __init__(self) -> None:
+        self._state: Optional[Dict[str, Any]] = None
+        self._tracked: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        return self._state
+
+    def save(self, state: Dict[str, Any]) -> None:
+        self._state = state
+
+    def tracked(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {
+            alert_id: self._tracked[alert_id]
+            for alert_id in ids
+            if alert_id in self._tracked
+        }
+
+    def stream_tracked(self) -> Iterable[str]:
+        yield from list(self._tracked)
+
+    def track(self, entries: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        for alert_id, entry in entries.items():
+            if entry is None:
+                self._tracked.pop(alert_id, None)
+            else:
+                self._tracked[alert_id] = entry
+
+
+def _contribution(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: doc.get(field) for field in INCREMENTAL_FIELDS}
+
+
+class IncrementalMetrics:
+    """
+    Folds only the alerts that changed since the last run into the stored
+    aggregates, so each run costs O(changed alerts), however many alerts
+    are active or stored.
+
+    Changed alerts are the ones the processor stored since the watermark,
+    by `ingested_at`: new alerts, rewrites and merged resolves alike,
+    whatever their `timestamp` says. Stamps come from the processors'
+    clocks before the commit, so one can land after a later one has been
+    folded. Each run starts `lookback` before the watermark to catch
+    those, and skips the alerts it finds at the ingestion time they were
+    folded at. Only the tracked entries of changed alerts are read, to
+    swap the contribution of an alert folded while active for its new one.
+    An alert folded resolved isn't tracked, so a rewrite of it with new
+    content is counted again.
+
+    Tracked entries are written before the state document, tagged with the
+    generation that saves it. An entry of a later generation than the
+    saved state comes from a run that died before saving, and stands for
+    its `previous` contribution. The run after it folds the same alerts
+    again, so it rewrites every such entry.
+    """
+
+    def __init__(
+        self,
+        source: DocumentSource,
+        state_store: StateStore,
+        watermark_field: str = INGESTED_AT,
+        lookback: timedelta = timedelta(minutes=2),
+        batch_size: int = 400,
+    ) -> None:
+        self._source = source
+        self._state_store = state_store
+        self._watermark_field = watermark_field
+        self._lookback = lookback
+        self._batch_size = max(1, batch_size)
+
+    def load(self) -> MetricsState:
+        data = self._state_store.load()
+        if data is None:
+            logger.debug("no incremental state found. starting from scratch..")
+            return MetricsState()
+        if data.get("version") != STATE_VERSION:
+            # written before groups / sketches existed, which can't be derived
+            # from the stored aggregates, so everything is rebuilt once
+            logger.warning(
+                f"incremental state version {data.get('version')} is outdated. "
+                "starting from scratch.."
+            )
+            return MetricsState()
+        return MetricsState.from_dict(data)
+
+    def update(
+        self,
+        now: Optional[datetime] = None,
+        on_change: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+        before_save: Optional[Callable[[MetricsState], None]] = None,
+    ) -> MetricsState:
+        """
+        folds the changed alerts in and saves the state. `on_change` sees
+        every contribution added (1) or taken back (-1), `before_save` the
+        state about to be saved, for derived aggregates to follow along
+        """
+        state = self.load()
+        started = (now or datetime.now(timezone.utc)).strftime(INGESTED_FORMAT)
+        logger.debug(f"folding alerts since watermark {state.watermark}")
+        if not state.generation:
+            # left by a run that died before its first save, or an older state
+            self._state_store.track(
+                {alert_id: None for alert_id in self._state_store.stream_tracked()}
+            )
+        try:
+            folded = self._fold(state, started, on_change)
+        except Exception as e:
+            logger.error(f"error folding new alerts: {e}")
+            raise e
+        logger.info(
+            f"folded {folded} changed alerts, "
+            f"{len(state.changed)} tracked alerts changed. "
+            f"watermark: {state.watermark}"
+        )
+        state.generation += 1
+        self._state_store.track(
+            {
+                alert_id: {
+                    "generation": state.generation,
+                    "contribution": state.tracked[alert_id],
+                    "previous": previous,
+                }
+                for alert_id, previous in state.changed.items()
+            }
+        )
+        if before_save is not None:
+            before_save(state)
+        self._state_store.save(state.to_dict())
+        # untracked for good now the state is saved
+        self._state_store.track(
+            {
+                alert_id: None
+                for alert_id in state.changed
+                if state.tracked[alert_id] is None
+            }
+        )
+        return state
+
+    def _lookup(self, state: MetricsState, ids: List[str]) -> None:
+        """reads the tracked entries of the alerts this run hasn't seen yet"""
+        missing = [alert_id for alert_id in ids if alert_id not in state.tracked]
+        if not missing:
+            return
+        # nothing saved, nothing tracked
+        entries = self._state_store.tracked(missing) if state.generation else {}
+        for alert_id in missing:
+            entry = entries.get(alert_id)
+            if entry is None:
+                state.tracked[alert_id] = None
+            elif entry["generation"] > state.generation:
+                state.tracked[alert_id] = entry["previous"]
+            else:
+                state.tracked[alert_id] = entry["contribution"]
+
+    def _apply(
+        self,
+        state: MetricsState,
+        doc: Dict[str, Any],
+        on_change: Optional[Callable[[int, Dict[str, Any]], None]],
+    ) -> bool:
+        """folds one alert in, returns False if it was folded as it is"""
+        alert_id = doc[AlertField.ALERT_ID]
+        previous = state.tracked[alert_id]
+        contribution = _contribution(doc)
+        if previous == contribution:
+            return False
+        if previous is not None:
+            state.remove(previous)
+        state.add(doc)
+        if on_change is not None:
+            if previous is not None:
+                on_change(-1, previous)
+            on_change(1, contribution)
+        active = doc.get(AlertField.STATUS) == "active"
+        if active or previous is not None:
+            state.track(alert_id, contribution if active else None)
+        return True
+
+    def _batches(
+        self, docs: Iterable[Dict[str, Any]]
+    ) -> Iterable[List[Dict[str, Any]]]:
+        batch: List[Dict[str, Any]] = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= self._batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _since(self, watermark: str) -> str:
+        moment = datetime.strptime(watermark, INGESTED_FORMAT) - self._lookback
+        return moment.strftime(INGESTED_FORMAT)
+
+    def _fold(
+        self,
+        state: MetricsState,
+        started: str,
+        on_change: Optional[Callable[[int, Dict[str, Any]], None]],
+    ) -> int:
+        folded = 0
+        fields = INCREMENTAL_FIELDS + [self._watermark_field]
+        fresh = state.watermark is None
+        if fresh:
+            # everything, alerts stored before ingestion stamps existed too
+            docs = self._source.stream_since(fields, AlertField.TIMESTAMP.value, None)
+        else:
+            docs = self._source.stream_since(
+                fields, self._watermark_field, self._since(state.watermark)
+            )
+        for batch in self._batches(docs):
+            self._lookup(state, [doc[AlertField.ALERT_ID] for doc in batch])
+            for doc in batch:
+                alert_id = doc[AlertField.ALERT_ID]
+                mark = doc.get(self._watermark_field)
+                if mark is not None and state.recent.get(alert_id) == mark:
+                    continue
+                folded += self._apply(state, doc, on_change)
+                if mark is None:
+                    continue
+                state.recent[alert_id] = mark
+                if state.watermark is None or mark > state.watermark:
+                    state.watermark = mark
+        if state.watermark is None:
+            # nothing stamped yet, the next alerts will be
+            state.watermark = started
+        # the next run starts at `since`, older entries can't match
+        since = self._since(state.watermark)
+        state.recent = {
+            alert_id: mark for alert_id, mark in state.recent.items() if mark >= since
+        }
+        return folded
@@ -1,302 +1,178 @@
-from google.cloud.firestore import Client, FieldFilter
+from google.cloud.firestore import Client
 
-from datetime import datetime
+from datetime import timedelta
 
-import firebase_admin
+from typing import Any, Dict, Optional, Tuple
 
-from enum import Enum
-
-from typing import Dict
+from active import active_breakdown
+from clients import DEFAULT_DATABASE, firestore_pool
+from counters import read_counters
+from engine import DocumentSource, MetricsAccumulator, compute
+from groups import GroupedMetrics
+from incremental import DocumentStateStore, IncrementalMetrics, MetricsState
+from instrumentation import LOG_LEVEL, registry, span
+from retention import retention_from_env, snapshot_id
+from storage import AlertStore, FirestoreAlertStore, store_from_env
+from windows import WINDOW_FIELDS, WindowedMetrics, write_rollups
+from fields import METRICS, AlertField, MetricField, Operator  # noqa: F401
 
 import logging
+import os
 
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 
-class Operator(str, Enum):
-    EQUAL = "=="
-    LT = "<="
-    BT = ">="
-
-
-class AlertField(str, Enum):
-    ALERT_ID = "alert_id"
-    TIMESTAMP = "timestamp"
-    SERVICE = "service"
-    SEVERITY = "severity"
-    STATUS = "status"
-    RESPONSE_TIME_MS = "response_time_ms"
-    ERROR_COUNT = "error_count"
-    TOTAL_REQUESTS = "total_requests"
-    RESOLUTION_MINUTES = "resolution_minutes"
-
-
-class MetricField(str, Enum):
-    TOTAL_ACTIVE_ALERTS = "total_active_alerts"
-    CRITICAL_ALERTS = "critical_alerts"
-    SERVICES_AFFECTED = "services_affected"
-    AVERAGE_RESPONSE_TIME_MS = "average_response_time_ms"
-    ERROR_RATE_PERCENT = "error_rate_percent"
-    ALERTS_PER_HOUR = "alerts_per_hour"
-    AVERAGE_RESOLUTION_TIME_MIN = "average_resolution_time_min"
-    SERVICE_HEALTH_SCORE = "service_health_score"
-
-
-METRICS = {
-    "total_active_alerts": 0,
-    "critical_alerts": 0,
-    "services_affected": 0,
-    "average_response_time_ms": 0.0,
-    "error_rate_percent": 0.0,
-    "average_resolution_time_min": 0.0,
-    "service_health_score": 0.0,
-}
-
-
 class FireStoreMetricsAggregator:
     def __init__(
         self,
-        database: str = "alerts-store",
+        database: str = DEFAULT_DATABASE,
         from_collection: str = "alerts_collection",
         to_collection: str = "metrics",
         metrics: Dict[str, float] = METRICS,
+        source: Optional[DocumentSource] = None,
+        incremental: bool = False,
+        state_collection: str = "metrics_state",
+        reconcile: bool = False,
+        counter_collection: str = "metrics_counters",
+        windowed: bool = True,
+        rollup_collection: str = "metrics_rollups",
+        rollup_lookback: timedelta = timedelta(minutes=15),
+        store: Optional[AlertStore] = None,
+        lifecycle: bool = False,
     ) -> None:
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app()
-            logger.debug("firebase app not found. setting up..")
         self._from_collection: str = from_collection
         self._to_collection: str = to_collection
         self._database: str = database
-        self._db: Client = self._get_client()
-        self._metrics: Dict[str, float] = metrics
+        self._metrics: Dict[str, Any] = dict(metrics)
+        # firestore unless another store is handed in (see storage.py)
+        self._db: Optional[Client] = None
+        if store is None:
+            self._db = self._get_client()
+            store = FirestoreAlertStore(self._db, self._from_collection)
+        elif reconcile:
+            raise ValueError("reconcile mode reads counters only firestore keeps")
+        self._store: AlertStore = store
+        self._source: DocumentSource = source or store
+        self._incremental: Optional[IncrementalMetrics] = None
+        if incremental:
+            self._incremental = IncrementalMetrics(
+                self._source,
+                DocumentStateStore(store, state_collection),
+            )
+        self._reconcile = reconcile
+        self._counter_collection = counter_collection
+        self._windowed = windowed
+        self._rollup_collection = rollup_collection
+        self._rollup_lookback = rollup_lookback
+        self._rollups: Dict[Tuple[str, str], MetricsAccumulator] = {}
+        self._lifecycle = lifecycle
 
     @property
     def metrics(self):
         return self._metrics
 
+    @property
+    def database(self) -> str:
+        return self._database
+
     def _get_client(self) -> Client:
         logger.debug("setting up connection...")
         try:
-            db = Client(database=self._database)
+            db = firestore_pool.get(self._database)
             logger.info("retrieved db with success")
             return db
         except Exception as e:
             logger.error(f"error retrieving database: {e}")
             raise e
 
-    def _calculate_single_metric(
-        self, metric: MetricField, field: AlertField, operator: Operator, condition: str
-    ) -> None:
-        logger.debug(
-            f"started calculation for metric {metric} with filters: {field + operator + condition}"
-        )
-        try:
-            hits = (
-                self._db.collection(self._from_collection)
-                .where(filter=FieldFilter(field, operator, condition))
-                .stream()
-            )
-            len_hits = len(list(hits))
-            logger.info(f"found {len_hits} documents for {metric}..")
-            self._metrics[metric] = len_hits
-        except Exception as e:
-            logger.error(
-                f"error retrieving documents for metric {metric} with: {field + operator + condition}. Error {e} "
-            )
-            raise e
-
-    def _calculate_average_response_time(self) -> None:
-        """total response time / total alerts"""
-        logger.debug("ealculating average_response_time_ms...")
-        try:
-            logger.debug("calculating the total reponse time..")
-            total_response_time_ms = (
-                self._db.collection(self._from_collection)  # pyright: ignore
-                .sum(AlertField.RESPONSE_TIME_MS)
-                .get()[0][0]
-                .value
-            )
-            logger.info(
-                f"total response time calculated with success: {total_response_time_ms}"
-            )
-            logger.debug("calculating total alerts..")
-            total_alerts = (
-                self._db.collection(self._from_collection).count().get()[0][0].value  # pyright: ignore
-            )
-            logger.info(f"total alerts calculated with success: {total_alerts}")
-            res = round(total_response_time_ms / total_alerts, 2)
-            logger.info(f"average_response_time_ms: {res}")
-            self._metrics[MetricField.AVERAGE_RESPONSE_TIME_MS] = res
-            logger.info("metrics table updated with success")
-        except Exception as e:
-            logger.error(f"error calculating average_response_time_ms: {e}")
-            raise e
-
-    def _calculate_error_rate_percent(self) -> None:
-        """error_count / total_requests * 100"""
-        logger.debug("calculating error_rate_percent...")
-        try:
-            logger.debug("calculating total error count...")
-            total_error_count = (
-                self._db.collection(self._from_collection)  # pyright: ignore
-                .sum(AlertField.ERROR_COUNT)
-                .get()[0][0]
-                .value
-            )
-            logger.info(
-                f"total error count calculated with success: {total_error_count}"
-            )
-
-            logger.debug("calculating total requests...")
-            total_requests = (
-                self._db.collection(self._from_collection)  # pyright: ignore
-                .sum(AlertField.TOTAL_REQUESTS)
-                .get()[0][0]
-                .value
-            )
-            logger.info(f"total requests calculated with success: {total_requests}")
-
-            if total_requests > 0:
-                res = round((total_error_count / total_requests) * 100, 2)
-            else:
-                res = 0.0
-
-            logger.info(f"error_rate_percent: {res}")
-            self._metrics[MetricField.ERROR_RATE_PERCENT] = res
-            logger.info("metrics table updated with success")
-        except Exception as e:
-            logger.error(f"error calculating error_rate_percent: {e}")
-            raise e
-
-    def _calculate_average_resolution_time(self) -> None:
-        """sum(resolution_minutes) / count(resolved_alerts)"""
-        logger.debug("calculating average_resolution_time_min...")
-        try:
-            logger.debug("calculating total resolution time...")
-            total_resolution_time = (
-                self._db.collection(self._from_collection)  # pyright: ignore
-                .sum(AlertField.RESOLUTION_MINUTES)
-                .get()[0][0]
-                .value
-            )
-            logger.info(
-                f"total resolution time calculated with success: {total_resolution_time}"
-            )
-
-            logger.debug("calculating resolved alerts count...")
-            resolved_alerts = (
-                self._db.collection(self._from_collection)
-                .where(
-                    filter=FieldFilter(AlertField.STATUS, Operator.EQUAL, "resolved")
-                )
-                .count()
-                .get()[0][0]
-                .value
-            )
-            logger.info(f"resolved alerts calculated with success: {resolved_alerts}")
-
-            if resolved_alerts > 0:
-                res = round(total_resolution_time / resolved_alerts, 2)
-            else:
-                res = 0.0
-
-            logger.info(f"average_resolution_time_min: {res}")
-            self._metrics[MetricField.AVERAGE_RESOLUTION_TIME_MIN] = res
-            logger.info("metrics table updated with success")
-        except Exception as e:
-            logger.error(f"error calculating average_resolution_time_min: {e}")
-            raise e
-
-    def _calculate_services_affected(self) -> None:
-        """count unique services"""
-        logger.debug("calculating services_affected...")
-        try:
-            docs = self._db.collection(self._from_collection).stream()
-            unique_services = set()
-            for doc in docs:
-                service = doc.to_dict().get(AlertField.SERVICE)
-                if service:
-                    unique_services.add(service)
-            services_count = len(unique_services)
-            logger.info(f"services_affected: {services_count}")
-            self._metrics[MetricField.SERVICES_AFFECTED] = services_count
-            logger.info("metrics table updated with success")
-        except Exception as e:
-            logger.error(f"error calculating services_affected: {e}")
-            raise e
-
-    def _calculate_service_health_score(self) -> None:
-        """(1 - critical_alerts/total_alerts) * 100"""
-        logger.debug("calculating service_health_score...")
-        try:
-            logger.debug("calculating critical alerts count...")
-            critical_alerts = (
-                self._db.collection(self._from_collection)
-                .where(
-                    filter=FieldFilter(AlertField.SEVERITY, Operator.EQUAL, "critical")
-                )
-                .count()
-                .get()[0][0]
-                .value
-            )
-            logger.info(f"critical alerts calculated with success: {critical_alerts}")
-
-            logger.debug("calculating total alerts count...")
-            total_alerts = (
-                self._db.collection(self._from_collection).count().get()[0][0].value  # pyright: ignore
-            )
-            logger.info(f"total alerts calculated with success: {total_alerts}")
-
-            if total_alerts > 0:
-                res = round((1 - (critical_alerts / total_alerts)) * 100, 2)
-            else:
-                res = 100.0
-
-            logger.info(f"service_health_score: {res}")
-            self._metrics[MetricField.SERVICE_HEALTH_SCORE] = res
-            logger.info("metrics table updated with success")
-        except Exception as e:
-            logger.error(f"error calculating service_health_score: {e}")
-            raise e
-
-    def _calculate_metrics(self, limit: int = 5) -> None:
+    def _calculate_metrics(self) -> None:
         """
         Error Rate % = error_count / total_requests * 100
-        Alerts Per Hour = count(alerts) / time_window_hours
         Average Resolution Time = sum(resolution_minutes) / count(resolved_alerts)
         Service Health Score = (1 - critical_alerts/total_alerts) * 100
-        """
-        logger.debug(f"trying to retrieve {limit} documents...")
-
-        # total active alerts
-        total_active_alerts_metric = MetricField.TOTAL_ACTIVE_ALERTS
-        self._calculate_single_metric(
-            metric=total_active_alerts_metric,
-            field=AlertField.STATUS,
-            operator=Operator.EQUAL,
-            condition="active",
-        )
 
-        # critical alerts
-        critical_alerts_metric = MetricField.CRITICAL_ALERTS
-        self._calculate_single_metric(
-            metric=critical_alerts_metric,
-            field=AlertField.SEVERITY,
-            operator=Operator.EQUAL,
-            condition="critical",
-        )
-        # services affected
-        self._calculate_services_affected()
-        # average response time
-        self._calculate_average_response_time()
-        # error rate percent
-        self._calculate_error_rate_percent()
-        # average resolution time
-        self._calculate_average_resolution_time()
-        # service health score
-        self._calculate_service_health_score()
+        every metric is folded from a single projected stream of the collection,
+        or in incremental mode from the stored aggregates plus new alerts only,
+        or in reconcile mode from the counter shards the processor maintains.
+        per-service and per-severity breakdowns ride along in the same pass.
+        windowed metrics share the full pass, or otherwise are merged from the
+        rollup buckets, which incremental mode updates from the alerts it folds
+        and reconcile mode rebuilds from the last few minutes of alerts.
+        with the lifecycle on, active counts come from the active index
+        """
+        logger.debug("calculating metrics over %s...", self._from_collection)
+        try:
+            windowed = None
+            if self._windowed:
+                windowed = WindowedMetrics(rollup_lookback=self._rollup_lookback)
+            if self._reconcile:
+                with span("metric_query", mode="reconcile"):
+                    accumulator, groups = read_counters(
+                        self._db, self._counter_collection
+                    )
+                if windowed is not None:
+                    with span("metric_query", mode="windows"):
+                        windowed.rebuild(self._source)
+                        windowed.from_rollups(self._store, self._rollup_collection)
+            elif self._incremental is not None:
+                on_change, before_save = None, None
+                if windowed is not None:
+                    on_change = windowed.change
+
+                    def before_save(state: MetricsState) -> None:
+                        # rollups first, a run that dies in between redoes them
+                        with span("store_write", collection="rollups"):
+                            windowed.fold(
+                                self._store,
+                                self._rollup_collection,
+                                state.lineage,
+                                state.generation,
+                            )
+
+                with span("metric_query", mode="incremental"):
+                    state = self._incremental.update(
+                        on_change=on_change, before_save=before_save
+                    )
+                accumulator, groups = state.accumulator, state.groups
+                if windowed is not None:
+                    with span("metric_query", mode="windows"):
+                        windowed.from_rollups(self._store, self._rollup_collection)
+            else:
+                groups = GroupedMetrics()
+                with span("metric_query", mode="full"):
+                    if windowed is not None:
+                        accumulator = compute(
+                            self._source,
+                            fields=WINDOW_FIELDS,
+                            sinks=[groups.add, windowed.add],
+                        )
+                    else:
+                        accumulator = compute(self._source, sinks=[groups.add])
+            self._metrics.update(accumulator.to_metrics())
+            self._metrics.update(groups.to_metrics())
+            if windowed is not None:
+                windows = windowed.window_metrics()
+                self._metrics["windows"] = windows
+                self._metrics[MetricField.ALERTS_PER_HOUR.value] = windows["1h"][
+                    MetricField.ALERTS_PER_HOUR.value
+                ]
+                # incremental mode has written the buckets it changed already
+                if self._incremental is None:
+                    self._rollups = windowed.buckets
+            if self._lifecycle:
+                # the index sees resolves as they happen, and costs o(active)
+                with span("metric_query", mode="active_index"):
+                    active = active_breakdown(self._store)
+                self._metrics["active"] = active
+                self._metrics[MetricField.TOTAL_ACTIVE_ALERTS.value] = active[
+                    MetricField.TOTAL_ACTIVE_ALERTS.value
+                ]
+            logger.debug("metrics table updated with success: %s", self._metrics)
+        except Exception as e:
+            logger.error(f"error calculating metrics: {e}")
+            raise e
 
     def write_to_db(self) -> None:
         logger.debug("writing to db initiated...")
@@ -308,24 +184,59 @@ class FireStoreMetricsAggregator:
             logger.error(f"error calculating metrics: {e}")
             raise e
 
-        timestamp = datetime.now()
-        ref = self._db.collection(self._to_collection).document(
-            document_id=str(timestamp)
-        )
+        doc_id = snapshot_id()
         try:
-            ref.set(self._metrics)
-            logger.info(f"successfully wrote metrics to collection. id : {ref.id}")
+            with span("store_write", collection="metrics"):
+                self._store.write_documents(
+                    self._to_collection, {doc_id: self._metrics}
+                )
+            logger.info("successfully wrote metrics to collection. id : %s", doc_id)
         except Exception as e:
             logger.error(f"error writing to db: {e}")
             raise e
 
+        if self._rollups:
+            try:
+                with span("store_write", collection="rollups"):
+                    write_rollups(self._store, self._rollup_collection, self._rollups)
+            except Exception as e:
+                logger.error(f"error writing rollups: {e}")
+                raise e
+
+
+# built once per instance, like the firestore clients in clients.py
+local_store = store_from_env()
+
 
 def compute_metrics(event, context):
     logger.info("starting metrics calculation function...")
     try:
-        r = FireStoreMetricsAggregator()
+        mode = os.environ.get("METRICS_MODE", "full")
+        r = FireStoreMetricsAggregator(
+            store=local_store,
+            incremental=mode == "incremental",
+            reconcile=mode == "reconcile",
+            counter_collection=os.environ.get("COUNTER_COLLECTION", "metrics_counters"),
+            lifecycle=os.environ.get("ALERT_LIFECYCLE", "false").lower() == "true",
+        )
         r.write_to_db()
+        # totals since the instance started, not this invocation's: a warm
+        # instance serves many invocations
+        logger.debug("instrumentation since instance start: %s", registry)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"error in compute_metrics: {e}")
+        firestore_pool.report(e)
+        return {"status": "failed", "error": str(e)}
+
+
+def apply_retention(request):
+    logger.info("starting retention function...")
+    try:
+        store = local_store or FirestoreAlertStore(firestore_pool.get())
+        report = retention_from_env(store).run()
+        return {"status": "success", **report}
+    except Exception as e:
+        logger.error(f"error in apply_retention: {e}")
+        firestore_pool.report(e)
         return {"status": "failed", "error": str(e)}
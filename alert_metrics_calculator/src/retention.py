@@ -0,0 +1,295 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from fields import AlertField
+from incremental import TRACKED_COLLECTION
+from storage import AlertStore
+
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# bucket keys are prefixes of sortable ids: "2025-01-29T14" / "2025-01-29"
+HOUR = 13
+DAY = 10
+
+
+def snapshot_id(moment: Optional[datetime] = None) -> str:
+    """
+    id of a metrics snapshot, "2025-01-29T14:23:05.123456Z": sorts in time
+    order and starts with its hour and day buckets
+    """
+    moment = (moment or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _bucket(doc_id: str, width: int) -> str:
+    # ids written before snapshot_id were str(datetime.now()),
+    # "2025-01-29 14:23:05.123456", same layout with a space
+    return f"{doc_id[:10]}T{doc_id[11:13]}"[:width]
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def _summarize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """a raw snapshot as a one-snapshot summary; maps and strings are dropped"""
+    if "snapshots" in data and "metrics" in data:
+        return data
+    metrics = {}
+    for field, value in data.items():
+        number = _number(value)
+        if number is not None:
+            metrics[field] = {
+                "count": 1,
+                "sum": number,
+                "min": number,
+                "max": number,
+                "avg": number,
+            }
+    return {"snapshots": 1, "metrics": metrics}
+
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+    into["snapshots"] += other["snapshots"]
+    for field, stats in other["metrics"].items():
+        current = into["metrics"].get(field)
+        if current is None:
+            into["metrics"][field] = dict(stats)
+            continue
+        current["count"] += stats["count"]
+        current["sum"] += stats["sum"]
+        current["min"] = min(current["min"], stats["min"])
+        current["max"] = max(current["max"], stats["max"])
+        current["avg"] = round(current["sum"] / current["count"], 2)
+
+
+class Retention:
+    """
+    Keeps the working set flat as history grows:
+
+    - raw metrics snapshots older than `raw_metrics_max_age` are folded into
+      hourly summaries (count / sum / min / max / avg of every numeric
+      metric), and hourly summaries older than `hourly_metrics_max_age` into
+      daily ones, which are kept
+    - alerts whose timestamp is older than `alert_max_age` are deleted in
+      batches, active index entries included. with an `archive` exporter,
+      they are exported to parquet first and only exported alerts go
+      (see export.py). alerts incremental metrics still track as active
+      stay: their resolve is yet to be swapped into the aggregates
+    - per-minute rollups older than `minute_rollup_max_age` are deleted,
+      hourly ones are kept for dashboards
+
+    Summaries record the last snapshot id folded into them, so a run that
+    dies between writing a summary and deleting its sources is redone
+    without counting anything twice. A zero max age disables that step.
+    Full-mode metrics then cover the retained alerts; incremental and
+    reconcile aggregates keep counting expired alerts.
+    """
+
+    def __init__(
+        self,
+        store: AlertStore,
+        metrics_collection: str = "metrics",
+        hourly_collection: str = "metrics_hourly",
+        daily_collection: str = "metrics_daily",
+        rollup_collection: str = "metrics_rollups",
+        alert_max_age: timedelta = timedelta(days=30),
+        raw_metrics_max_age: timedelta = timedelta(days=2),
+        hourly_metrics_max_age: timedelta = timedelta(days=90),
+        minute_rollup_max_age: timedelta = timedelta(days=2),
+        archive: Optional[Any] = None,
+        batch_size: int = 400,
+        tracked_collection: Optional[str] = TRACKED_COLLECTION,
+    ) -> None:
+        self._store = store
+        self._metrics_collection = metrics_collection
+        self._hourly_collection = hourly_collection
+        self._daily_collection = daily_collection
+        self._rollup_collection = rollup_collection
+        self._alert_max_age = alert_max_age
+        self._raw_metrics_max_age = raw_metrics_max_age
+        self._hourly_metrics_max_age = hourly_metrics_max_age
+        self._minute_rollup_max_age = minute_rollup_max_age
+        # a ParquetExporter, kept untyped so pyarrow is only loaded if used
+        self._archive = archive
+        self._batch_size = max(1, batch_size)
+        self._tracked_collection = tracked_collection
+
+    def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        now = now or datetime.now(timezone.utc)
+        if self._archive is not None:
+            self._archive.export_alerts()
+            self._archive.export_metrics()
+        report = {
+            "hourly": self.downsample(
+                self._metrics_collection,
+                self._hourly_collection,
+                HOUR,
+                self._raw_metrics_max_age,
+                now,
+            ),
+            "daily": self.downsample(
+                self._hourly_collection,
+                self._daily_collection,
+                DAY,
+                self._hourly_metrics_max_age,
+                now,
+            ),
+            "alerts": self.expire_alerts(now),
+            "rollups": self.prune_rollups(now),
+        }
+        logger.info("retention: %s", report)
+        return report
+
+    def downsample(
+        self,
+        source: str,
+        target: str,
+        width: int,
+        max_age: timedelta,
+        now: datetime,
+    ) -> int:
+        """
+        folds the documents of `source` in buckets that ended more than
+        `max_age` ago into one summary per bucket in `target`, then deletes
+        them. returns the number of documents folded
+        """
+        if not max_age:
+            return 0
+        cutoff = snapshot_id(now - max_age)[:width]
+        through = None
+        if self._archive is not None and source == self._metrics_collection:
+            through = self._archive.metrics_exported_through()
+            if through is None:
+                return 0
+        folded = 0
+        key: Optional[str] = None
+        summary: Dict[str, Any] = {}
+        ids: List[str] = []
+        for doc_id, data in self._store.stream_documents(source):
+            bucket = _bucket(doc_id, width)
+            if bucket >= cutoff and doc_id[10:11] == " ":
+                # legacy ids sort before new ones of the same day, skip past
+                continue
+            if bucket >= cutoff or (through is not None and doc_id > through):
+                break
+            if bucket != key:
+                folded += self._flush(source, target, key, summary, ids)
+                key, ids = bucket, []
+                summary = self._store.read_document(target, bucket) or {
+                    "bucket": bucket,
+                    "snapshots": 0,
+                    "metrics": {},
+                    "through": None,
+                }
+            ids.append(doc_id)
+            if summary["through"] is not None and doc_id <= summary["through"]:
+                # folded by a run that died before deleting it
+                continue
+            _merge(summary, _summarize(data))
+            summary["through"] = doc_id
+        folded += self._flush(source, target, key, summary, ids)
+        return folded
+
+    def _flush(
+        self,
+        source: str,
+        target: str,
+        key: Optional[str],
+        summary: Dict[str, Any],
+        ids: List[str],
+    ) -> int:
+        if key is None or not ids:
+            return 0
+        self._store.write_documents(target, {key: summary})
+        self._store.delete_documents(source, ids)
+        logger.debug("folded %d documents into %s/%s", len(ids), target, key)
+        return len(ids)
+
+    def expire_alerts(self, now: datetime) -> int:
+        if not self._alert_max_age:
+            return 0
+        cutoff = (now - self._alert_max_age).strftime(TIMESTAMP_FORMAT)
+        if self._archive is not None:
+            exported = self._archive.alerts_exported_through()
+            if exported is None:
+                return 0
+            # alerts at the cursor timestamp may not all be exported yet
+            cutoff = min(cutoff, exported)
+        # o(active), read once per run
+        tracked = set()
+        if self._tracked_collection:
+            tracked = {
+                alert_id
+                for alert_id, _ in self._store.stream_documents(
+                    self._tracked_collection
+                )
+            }
+        expired = 0
+        ids: List[str] = []
+        for doc in self._store.query(
+            [AlertField.TIMESTAMP.value],
+            [(AlertField.TIMESTAMP.value, "<", cutoff)],
+        ):
+            if doc[AlertField.ALERT_ID] in tracked:
+                continue
+            ids.append(doc[AlertField.ALERT_ID])
+            if len(ids) >= self._batch_size:
+                self._store.delete_alerts(ids)
+                expired += len(ids)
+                ids = []
+        if ids:
+            self._store.delete_alerts(ids)
+            expired += len(ids)
+        logger.info("expired %d alerts older than %s", expired, cutoff)
+        return expired
+
+    def prune_rollups(self, now: datetime) -> int:
+        if not self._minute_rollup_max_age:
+            return 0
+        # rollup ids are "<resolution>_<bucket>", so minute ones sort together
+        cutoff = f"minute_{snapshot_id(now - self._minute_rollup_max_age)[:16]}"
+        ids = []
+        for doc_id, _ in self._store.stream_documents(
+            self._rollup_collection, "minute_"
+        ):
+            if doc_id >= cutoff:
+                break
+            ids.append(doc_id)
+        self._store.delete_documents(self._rollup_collection, ids)
+        return len(ids)
+
+
+def _age(name: str, default: float, unit: str) -> timedelta:
+    return timedelta(**{unit: float(os.environ.get(name, default))})
+
+
+def retention_from_env(store: AlertStore) -> Retention:
+    """
+    RETENTION_ALERT_DAYS, RETENTION_RAW_METRICS_HOURS,
+    RETENTION_HOURLY_METRICS_DAYS, RETENTION_MINUTE_ROLLUP_HOURS (0 keeps
+    forever), ARCHIVE_ROOT to export to parquet before deleting
+    """
+    archive = None
+    root = os.environ.get("ARCHIVE_ROOT")
+    if root:
+        # pulls in pyarrow, only archiving pays for it
+        from export import ParquetExporter
+
+        archive = ParquetExporter(store, root)
+    return Retention(
+        store,
+        alert_max_age=_age("RETENTION_ALERT_DAYS", 30, "days"),
+        raw_metrics_max_age=_age("RETENTION_RAW_METRICS_HOURS", 48, "hours"),
+        hourly_metrics_max_age=_age("RETENTION_HOURLY_METRICS_DAYS", 90, "days"),
+        minute_rollup_max_age=_age("RETENTION_MINUTE_ROLLUP_HOURS", 48, "hours"),
+        archive=archive,
+    )
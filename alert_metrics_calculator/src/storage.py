@@ -0,0 +1,510 @@
+# kept identical in alert_processor/src and alert_metrics_calculator/src:
+# each function is deployed from its own source archive
+from google.cloud.firestore import Client, FieldFilter
+
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Set, Tuple
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# (field, operator, value), operator one of "==", "<", "<=", ">", ">="
+Filter = Tuple[str, str, Any]
+
+ALERT_COLUMNS = (
+    "alert_id",
+    "timestamp",
+    "service",
+    "severity",
+    "status",
+    "response_time_ms",
+    "error_count",
+    "total_requests",
+    "resolution_minutes",
+    "content_hash",
+    "resolved_at",
+    "ingested_at",
+)
+INDEXED_COLUMNS = ("timestamp", "service", "severity", "status", "ingested_at")
+OPERATORS = frozenset(["==", "<", "<=", ">", ">="])
+# stamped by the processor on every write of an alert, full or merged.
+# `timestamp` comes from whoever generated the alert and can be anything,
+# this orders alerts by when they were stored (see incremental.py)
+INGESTED_AT = "ingested_at"
+INGESTED_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+# entries of the active index: one per currently active alert
+ACTIVE_FIELDS = ("service", "severity", "since")
+
+
+class AlertStore(Protocol):
+    """
+    Everything the pipeline needs from a database: alerts keyed by
+    alert_id, the index of currently active alerts (see lifecycle.py in
+    alert_processor), plus plain documents (metrics, rollups, state,
+    quarantine) keyed by collection and id. Reads return dicts carrying
+    alert_id.
+    """
+
+    def write_alerts(
+        self,
+        alerts: Dict[str, Dict[str, Any]],
+        creates: Set[str] = ...,
+        updates: Optional[Dict[str, Dict[str, Any]]] = ...,
+        active: Optional[Dict[str, Optional[Dict[str, Any]]]] = ...,
+    ) -> None: ...
+
+    def delete_alerts(self, ids: List[str]) -> None: ...
+
+    def get_active(self, ids: List[str]) -> Iterable[Dict[str, Any]]: ...
+
+    def stream_active(self) -> Iterable[Dict[str, Any]]: ...
+
+    def get(self, ids: List[str], fields: List[str]) -> Iterable[Dict[str, Any]]: ...
+
+    def stream(self, fields: List[str]) -> Iterable[Dict[str, Any]]: ...
+
+    def stream_since(
+        self, fields: List[str], field: str, value: Any
+    ) -> Iterable[Dict[str, Any]]: ...
+
+    def query(
+        self, fields: List[str], filters: List[Filter]
+    ) -> Iterable[Dict[str, Any]]: ...
+
+    def write_documents(
+        self, collection: str, documents: Dict[str, Dict[str, Any]]
+    ) -> None: ...
+
+    def delete_documents(self, collection: str, ids: List[str]) -> None: ...
+
+    def read_document(
+        self, collection: str, doc_id: str
+    ) -> Optional[Dict[str, Any]]: ...
+
+    def read_documents(
+        self, collection: str, ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]: ...
+
+    def stream_documents(
+        self, collection: str, after: Optional[str] = None
+    ) -> Iterable[Tuple[str, Dict[str, Any]]]: ...
+
+
+class FirestoreAlertStore:
+    def __init__(
+        self,
+        db: Client,
+        collection: str = "alerts_collection",
+        batch_size: int = 400,
+        active_collection: str = "alerts_active",
+    ) -> None:
+        self._db = db
+        self._collection = collection
+        self._batch_size = batch_size
+        self._active_collection = active_collection
+
+    def _query(self, filters: List[Filter]):
+        query = self._db.collection(self._collection)
+        for field, operator, value in filters:
+            query = query.where(filter=FieldFilter(field, operator, value))
+        return query
+
+    def stage_alerts(
+        self,
+        batch,
+        alerts: Dict[str, Dict[str, Any]],
+        creates: Set[str] = frozenset(),
+        updates: Optional[Dict[str, Dict[str, Any]]] = None,
+        active: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+    ) -> None:
+        """adds the writes of write_alerts to a batch the caller commits"""
+        collection = self._db.collection(self._collection)
+        for alert_id, alert in alerts.items():
+            ref = collection.document(document_id=alert_id)
+            if alert_id in creates:
+                batch.create(ref, alert)
+            else:
+                batch.set(ref, alert)
+        for alert_id, fields in (updates or {}).items():
+            # fails the batch if the alert doesn't exist
+            batch.update(collection.document(document_id=alert_id), fields)
+        index = self._db.collection(self._active_collection)
+        for alert_id, entry in (active or {}).items():
+            ref = index.document(document_id=alert_id)
+            if entry is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, entry)
+
+    def write_alerts(
+        self,
+        alerts: Dict[str, Dict[str, Any]],
+        creates: Set[str] = frozenset(),
+        updates: Optional[Dict[str, Dict[str, Any]]] = None,
+        active: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+    ) -> None:
+        """
+        one atomic batch: full writes, ids in `creates` failing it if they
+        already exist, merge `updates` of existing alerts, and `active`
+        index entries to set, or to drop when None
+        """
+        batch = self._db.batch()
+        self.stage_alerts(batch, alerts, creates, updates, active)
+        batch.commit()
+
+    def delete_alerts(self, ids: List[str]) -> None:
+        """deletes alerts and their active index entries, in batches"""
+        collection = self._db.collection(self._collection)
+        index = self._db.collection(self._active_collection)
+        # two deletes per alert
+        step = max(1, self._batch_size // 2)
+        for start in range(0, len(ids), step):
+            batch = self._db.batch()
+            for alert_id in ids[start : start + step]:
+                batch.delete(collection.document(document_id=alert_id))
+                batch.delete(index.document(document_id=alert_id))
+            batch.commit()
+
+    def get(self, ids: List[str], fields: List[str]) -> Iterable[Dict[str, Any]]:
+        collection = self._db.collection(self._collection)
+        refs = [collection.document(document_id=doc_id) for doc_id in ids]
+        if not refs:
+            return
+        for doc in self._db.get_all(refs, field_paths=fields):
+            if doc.exists:
+                yield {**(doc.to_dict() or {}), "alert_id": doc.id}
+
+    def get_active(self, ids: List[str]) -> Iterable[Dict[str, Any]]:
+        index = self._db.collection(self._active_collection)
+        refs = [index.document(document_id=doc_id) for doc_id in ids]
+        if not refs:
+            return
+        for doc in self._db.get_all(refs):
+            if doc.exists:
+                yield {**(doc.to_dict() or {}), "alert_id": doc.id}
+
+    def stream_active(self) -> Iterable[Dict[str, Any]]:
+        for doc in self._db.collection(self._active_collection).stream():
+            yield {**(doc.to_dict() or {}), "alert_id": doc.id}
+
+    def stream(self, fields: List[str]) -> Iterable[Dict[str, Any]]:
+        docs = self._db.collection(self._collection).select(fields).stream()
+        for doc in docs:
+            yield doc.to_dict() or {}
+
+    def stream_since(
+        self, fields: List[str], field: str, value: Any
+    ) -> Iterable[Dict[str, Any]]:
+        filters = [] if value is None else [(field, ">=", value)]
+        docs = self._query(filters).order_by(field).select(fields).stream()
+        for doc in docs:
+            yield {**(doc.to_dict() or {}), "alert_id": doc.id}
+
+    def query(
+        self, fields: List[str], filters: List[Filter]
+    ) -> Iterable[Dict[str, Any]]:
+        for doc in self._query(filters).select(fields).stream():
+            yield {**(doc.to_dict() or {}), "alert_id": doc.id}
+
+    def write_documents(
+        self, collection: str, documents: Dict[str, Dict[str, Any]]
+    ) -> None:
+        items = list(documents.items())
+        for start in range(0, len(items), self._batch_size):
+            batch = self._db.batch()
+            for doc_id, data in items[start : start + self._batch_size]:
+                batch.set(self._db.collection(collection).document(doc_id), data)
+            batch.commit()
+
+    def delete_documents(self, collection: str, ids: List[str]) -> None:
+        for start in range(0, len(ids), self._batch_size):
+            batch = self._db.batch()
+            for doc_id in ids[start : start + self._batch_size]:
+                batch.delete(self._db.collection(collection).document(doc_id))
+            batch.commit()
+
+    def read_document(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self._db.collection(collection).document(doc_id).get()
+        if not snapshot.exists:
+            return None
+        return snapshot.to_dict()
+
+    def read_documents(
+        self, collection: str, ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """batched point reads, missing documents are left out"""
+        ref = self._db.collection(collection)
+        refs = [ref.document(doc_id) for doc_id in ids]
+        if not refs:
+            return {}
+        return {
+            doc.id: doc.to_dict() or {} for doc in self._db.get_all(refs) if doc.exists
+        }
+
+    def stream_documents(
+        self, collection: str, after: Optional[str] = None
+    ) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """(id, data) in id order, starting after the given id"""
+        ref = self._db.collection(collection)
+        query = ref.order_by("__name__")
+        if after is not None:
+            query = query.start_after({"__name__": ref.document(after)})
+        for doc in query.stream():
+            yield doc.id, doc.to_dict() or {}
+
+
+class SQLiteAlertStore:
+    """
+    Embedded store for running the pipeline and its benchmarks without GCP.
+    Alerts get a typed table indexed on timestamp, service, severity and
+    status, so dashboards can query it with plain SQL; other documents are
+    kept as JSON. ":memory:" gives a throwaway in-memory database.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        # FSWriter commits from a thread pool, the lock serializes access
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS alerts ("
+                "alert_id TEXT PRIMARY KEY, timestamp TEXT, service TEXT, "
+                "severity TEXT, status TEXT, response_time_ms INTEGER, "
+                "error_count INTEGER, total_requests INTEGER, "
+                "resolution_minutes INTEGER, content_hash TEXT, resolved_at TEXT, "
+                "ingested_at TEXT)"
+            )
+            columns = {
+                row["name"] for row in self._conn.execute("PRAGMA table_info(alerts)")
+            }
+            # databases created before a column was added
+            for column in ALERT_COLUMNS:
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE alerts ADD COLUMN {column}")
+            for column in INDEXED_COLUMNS:
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS alerts_{column} ON alerts({column})"
+                )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS active_alerts ("
+                "alert_id TEXT PRIMARY KEY, service TEXT, severity TEXT, since TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "collection TEXT, id TEXT, data TEXT, PRIMARY KEY (collection, id))"
+            )
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @staticmethod
+    def _column(field: str) -> str:
+        if field not in ALERT_COLUMNS:
+            raise ValueError(f"unknown alert field: {field}")
+        return field
+
+    @staticmethod
+    def _columns(fields: Iterable[str]) -> List[str]:
+        # field names end up in SQL, only known columns are accepted
+        columns = [field for field in fields if field in ALERT_COLUMNS]
+        if "alert_id" not in columns:
+            columns.append("alert_id")
+        return columns
+
+    @staticmethod
+    def _where(filters: List[Filter]) -> Tuple[str, List[Any]]:
+        clauses = []
+        params = []
+        for field, operator, value in filters:
+            if operator not in OPERATORS:
+                raise ValueError(f"unsupported operator: {operator}")
+            column = SQLiteAlertStore._column(field)
+            clauses.append(f"{column} {'=' if operator == '==' else operator} ?")
+            params.append(value)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _select(self, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(sql, list(params)).fetchall()
+        return [dict(row) for row in rows]
+
+    def write_alerts(
+        self,
+        alerts: Dict[str, Dict[str, Any]],
+        creates: Set[str] = frozenset(),
+        updates: Optional[Dict[str, Dict[str, Any]]] = None,
+        active: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+    ) -> None:
+        rows = [
+            tuple(
+                alert_id if column == "alert_id" else alert.get(column)
+                for column in ALERT_COLUMNS
+            )
+            for alert_id, alert in alerts.items()
+        ]
+        placeholders = ", ".join("?" for _ in ALERT_COLUMNS)
+        with self._lock, self._conn:
+            # same contract as firestore create(): the whole write fails
+            for alert_id in creates.intersection(alerts):
+                exists = self._conn.execute(
+                    "SELECT 1 FROM alerts WHERE alert_id = ?", (alert_id,)
+                ).fetchone()
+                if exists is not None:
+                    raise ValueError(f"alert {alert_id} already exists")
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO alerts ({', '.join(ALERT_COLUMNS)}) "
+                f"VALUES ({placeholders})",
+                rows,
+            )
+            for alert_id, fields in (updates or {}).items():
+                assignments = ", ".join(
+                    f"{self._column(field)} = ?" for field in fields
+                )
+                cursor = self._conn.execute(
+                    f"UPDATE alerts SET {assignments} WHERE alert_id = ?",
+                    [*fields.values(), alert_id],
+                )
+                if cursor.rowcount == 0:
+                    raise ValueError(f"alert {alert_id} does not exist")
+            drops = [
+                (alert_id,) for alert_id, entry in (active or {}).items() if not entry
+            ]
+            self._conn.executemany(
+                "DELETE FROM active_alerts WHERE alert_id = ?", drops
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO active_alerts (alert_id, service, severity, "
+                "since) VALUES (?, ?, ?, ?)",
+                [
+                    (alert_id, *(entry.get(field) for field in ACTIVE_FIELDS))
+                    for alert_id, entry in (active or {}).items()
+                    if entry
+                ],
+            )
+
+    def get(self, ids: List[str], fields: List[str]) -> Iterable[Dict[str, Any]]:
+        ids = list(ids)
+        columns = ", ".join(self._columns(fields))
+        # stays below sqlite's default limit of 999 bound parameters
+        for start in range(0, len(ids), 900):
+            chunk = ids[start : start + 900]
+            marks = ", ".join("?" for _ in chunk)
+            yield from self._select(
+                f"SELECT {columns} FROM alerts WHERE alert_id IN ({marks})", chunk
+            )
+
+    def delete_alerts(self, ids: List[str]) -> None:
+        rows = [(alert_id,) for alert_id in ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM alerts WHERE alert_id = ?", rows)
+            self._conn.executemany("DELETE FROM active_alerts WHERE alert_id = ?", rows)
+
+    def get_active(self, ids: List[str]) -> Iterable[Dict[str, Any]]:
+        ids = list(ids)
+        for start in range(0, len(ids), 900):
+            chunk = ids[start : start + 900]
+            marks = ", ".join("?" for _ in chunk)
+            yield from self._select(
+                f"SELECT * FROM active_alerts WHERE alert_id IN ({marks})", chunk
+            )
+
+    def stream_active(self) -> Iterable[Dict[str, Any]]:
+        yield from self._select("SELECT * FROM active_alerts")
+
+    def stream(self, fields: List[str]) -> Iterable[Dict[str, Any]]:
+        columns = ", ".join(self._columns(fields))
+        yield from self._select(f"SELECT {columns} FROM alerts")
+
+    def stream_since(
+        self, fields: List[str], field: str, value: Any
+    ) -> Iterable[Dict[str, Any]]:
+        columns = ", ".join(self._columns(fields))
+        where, params = self._where([] if value is None else [(field, ">=", value)])
+        yield from self._select(
+            f"SELECT {columns} FROM alerts{where} ORDER BY {self._column(field)}",
+            params,
+        )
+
+    def query(
+        self, fields: List[str], filters: List[Filter]
+    ) -> Iterable[Dict[str, Any]]:
+        columns = ", ".join(self._columns(fields))
+        where, params = self._where(filters)
+        yield from self._select(f"SELECT {columns} FROM alerts{where}", params)
+
+    def write_documents(
+        self, collection: str, documents: Dict[str, Dict[str, Any]]
+    ) -> None:
+        rows = [
+            (collection, doc_id, json.dumps(data, default=str))
+            for doc_id, data in documents.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (collection, id, data) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def delete_documents(self, collection: str, ids: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM documents WHERE collection = ? AND id = ?",
+                [(collection, doc_id) for doc_id in ids],
+            )
+
+    def read_document(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND id = ?",
+                (collection, doc_id),
+            ).fetchone()
+        return None if row is None else json.loads(row["data"])
+
+    def read_documents(
+        self, collection: str, ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        ids = list(ids)
+        documents: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(ids), 900):
+            chunk = ids[start : start + 900]
+            marks = ", ".join("?" for _ in chunk)
+            for row in self._select(
+                "SELECT id, data FROM documents "
+                f"WHERE collection = ? AND id IN ({marks})",
+                [collection, *chunk],
+            ):
+                documents[row["id"]] = json.loads(row["data"])
+        return documents
+
+    def stream_documents(
+        self, collection: str, after: Optional[str] = None
+    ) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        sql = "SELECT id, data FROM documents WHERE collection = ?"
+        params: List[Any] = [collection]
+        if after is not None:
+            sql += " AND id > ?"
+            params.append(after)
+        for row in self._select(sql + " ORDER BY id", params):
+            yield row["id"], json.loads(row["data"])
+
+
+def store_from_env() -> Optional[SQLiteAlertStore]:
+    """ALERT_STORE=sqlite swaps firestore for a local database at SQLITE_PATH"""
+    if os.environ.get("ALERT_STORE", "firestore") != "sqlite":
+        return None
+    path = os.environ.get("SQLITE_PATH", "alerts.db")
+    logger.info(f"using local sqlite store at {path}")
+    return SQLiteAlertStore(path)
@@ -0,0 +1,316 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from engine import PROJECTION, DocumentSource, MetricsAccumulator
+from fields import AlertField
+from storage import AlertStore
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+WINDOW_FIELDS: List[str] = PROJECTION + [AlertField.TIMESTAMP.value]
+
+WINDOWS: Dict[str, timedelta] = {
+    "5m": timedelta(minutes=5),
+    "1h": timedelta(hours=1),
+    "24h": timedelta(hours=24),
+}
+
+# bucket key = prefix of the ISO timestamp, "2025-01-29T14:23" / "2025-01-29T14"
+RESOLUTIONS: Dict[str, int] = {"minute": 16, "hour": 13}
+RESOLUTION_HOURS: Dict[str, float] = {"minute": 1 / 60, "hour": 1.0}
+RESOLUTION_FORMATS: Dict[str, str] = {"minute": "%Y-%m-%dT%H:%M", "hour": "%Y-%m-%dT%H"}
+
+
+def _iso(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _next(resolution: str, key: str) -> str:
+    """the key of the bucket after `key`, where its alerts stop"""
+    start = datetime.strptime(key, RESOLUTION_FORMATS[resolution])
+    span = timedelta(hours=RESOLUTION_HOURS[resolution])
+    return (start + span).strftime(RESOLUTION_FORMATS[resolution])
+
+
+class WindowedMetrics:
+    """
+    Metrics over the last 5 minutes, hour and day, plus per-minute and
+    per-hour rollup buckets.
+
+    - full mode feeds every alert of the last 24 hours through add(), and
+      the windows are exact
+    - reconcile mode rebuilds the recent buckets from a short scan
+      (rebuild()), incremental mode applies the changes it folded to the
+      buckets they touch (change() / fold()). the windows are then merged
+      from the buckets (from_rollups())
+
+    Only buckets starting after now - rollup_lookback are rebuilt, which
+    covers a few scheduler intervals worth of late arrivals; older buckets
+    keep the content they were last written with.
+    """
+
+    def __init__(
+        self,
+        now: Optional[datetime] = None,
+        rollup_lookback: timedelta = timedelta(minutes=15),
+    ) -> None:
+        now = now or datetime.now(timezone.utc)
+        self._starts: Dict[str, str] = {
+            name: _iso(now - span) for name, span in WINDOWS.items()
+        }
+        self.since: str = min(self._starts.values())
+        # the current minute is a bucket too
+        self._end = _iso(now + timedelta(minutes=1))[: RESOLUTIONS["minute"]]
+        lookback = _iso(now - rollup_lookback)
+        # buckets are rebuilt whole, from the start of the first touched one
+        self._rollup_starts: Dict[str, str] = {
+            resolution: lookback[:width] for resolution, width in RESOLUTIONS.items()
+        }
+        self.windows: Dict[str, MetricsAccumulator] = {
+            name: MetricsAccumulator() for name in WINDOWS
+        }
+        self.buckets: Dict[Tuple[str, str], MetricsAccumulator] = {}
+        # incremental changes per bucket, see change()
+        self._changes: Dict[Tuple[str, str], List[Tuple[int, Dict[str, Any]]]] = {}
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        timestamp = doc.get(AlertField.TIMESTAMP)
+        if not isinstance(timestamp, str) or timestamp < self.since:
+            return
+        for name, start in self._starts.items():
+            if timestamp >= start:
+                self.windows[name].add(doc)
+        self._bucket(timestamp, doc)
+
+    def _bucket(self, timestamp: str, doc: Dict[str, Any]) -> None:
+        for resolution, width in RESOLUTIONS.items():
+            key = timestamp[:width]
+            if key >= self._rollup_starts[resolution]:
+                bucket = self.buckets.get((resolution, key))
+                if bucket is None:
+                    bucket = self.buckets[(resolution, key)] = MetricsAccumulator()
+                bucket.add(doc)
+
+    def rebuild(self, source: DocumentSource) -> None:
+        """rebuilds the recent buckets, from alerts since the first one starts"""
+        since = min(self._rollup_starts.values())
+        logger.debug("scanning alerts since %s for rollup buckets..", since)
+        for doc in source.stream_since(
+            WINDOW_FIELDS, AlertField.TIMESTAMP.value, since
+        ):
+            timestamp = doc.get(AlertField.TIMESTAMP)
+            if isinstance(timestamp, str):
+                self._bucket(timestamp, doc)
+
+    def change(self, sign: int, doc: Dict[str, Any]) -> None:
+        """
+        a contribution incremental metrics added (1) or took back (-1),
+        kept until fold() if it falls in a bucket the windows read
+        """
+        timestamp = doc.get(AlertField.TIMESTAMP)
+        # from the start of the hour the 24h window starts in
+        if not isinstance(timestamp, str) or timestamp < self.since[:13]:
+            return
+        for resolution, width in RESOLUTIONS.items():
+            self._changes.setdefault((resolution, timestamp[:width]), []).append(
+                (sign, doc)
+            )
+
+    def fold(
+        self, store: AlertStore, collection: str, lineage: str, generation: int
+    ) -> None:
+        """
+        applies the changes to their stored buckets and writes them back.
+        like tracked alerts, a bucket remembers the incremental state
+        (`lineage`) and the run (`generation`) that last wrote it, and what
+        it held before. one written by a run of this generation that died
+        before saving starts from what it held before that run. a bucket
+        this state never wrote (missing, written by full or reconcile mode,
+        or by an older state) is read back from its alerts instead, which
+        already include the changes
+        """
+        stored = store.read_documents(
+            collection, [f"{resolution}_{key}" for resolution, key in self._changes]
+        )
+        previous: Dict[Tuple[str, str], Optional[MetricsAccumulator]] = {}
+        rebuilt = 0
+        for (resolution, key), changes in self._changes.items():
+            data = stored.get(f"{resolution}_{key}")
+            start = None
+            if data is not None and data.get("lineage") == lineage:
+                if data.get("generation", 0) < generation:
+                    start = MetricsAccumulator.from_dict(data["aggregates"])
+                elif data.get("previous") is not None:
+                    start = MetricsAccumulator.from_dict(data["previous"])
+            previous[(resolution, key)] = start
+            if start is None:
+                self.buckets[(resolution, key)] = self._read_bucket(
+                    store, resolution, key
+                )
+                rebuilt += 1
+                continue
+            bucket = MetricsAccumulator()
+            bucket.merge(start)
+            for sign, doc in changes:
+                if sign > 0:
+                    bucket.add(doc)
+                else:
+                    bucket.remove(doc)
+            self.buckets[(resolution, key)] = bucket
+        updated_at = datetime.now(timezone.utc)
+        store.write_documents(
+            collection,
+            {
+                f"{resolution}_{key}": {
+                    **_rollup(resolution, key, self.buckets[(resolution, key)]),
+                    "lineage": lineage,
+                    "generation": generation,
+                    # None: read back from the alerts again
+                    "previous": None if start is None else start.to_dict(),
+                    "updated_at": updated_at,
+                }
+                for (resolution, key), start in previous.items()
+            },
+        )
+        logger.info(
+            f"applied incremental changes to {len(previous)} rollup buckets "
+            f"in {collection}, {rebuilt} read back from their alerts"
+        )
+        self._changes = {}
+
+    @staticmethod
+    def _read_bucket(
+        store: AlertStore, resolution: str, key: str
+    ) -> MetricsAccumulator:
+        bucket = MetricsAccumulator()
+        timestamp = AlertField.TIMESTAMP.value
+        for doc in store.query(
+            WINDOW_FIELDS,
+            [(timestamp, ">=", key), (timestamp, "<", _next(resolution, key))],
+        ):
+            bucket.add(doc)
+        return bucket
+
+    def from_rollups(self, store: AlertStore, collection: str) -> None:
+        """
+        merges every window from the buckets it covers: this run's, stored
+        ones otherwise. minute buckets at the edges, hour buckets between.
+        the alerts of the minute a window starts in are read as they are,
+        so the windows stay exact
+        """
+        timestamp = AlertField.TIMESTAMP.value
+        for name, start in self._starts.items():
+            merged = MetricsAccumulator()
+            first = _next("minute", start[: RESOLUTIONS["minute"]])
+            for doc in store.query(
+                WINDOW_FIELDS, [(timestamp, ">=", start), (timestamp, "<", first)]
+            ):
+                merged.add(doc)
+            for resolution, low, high in self._spans(first):
+                for _, bucket in self._rollups(
+                    store, collection, resolution, low, high
+                ):
+                    merged.merge(bucket)
+            self.windows[name] = merged
+
+    def _spans(self, start: str) -> List[Tuple[str, str, str]]:
+        """id ranges covering the minute `start` to the end"""
+        first_hour = start[: RESOLUTIONS["hour"]]
+        if not start.endswith(":00"):
+            first_hour = _next("hour", first_hour)
+        last_hour = self._end[: RESOLUTIONS["hour"]]
+        if first_hour >= last_hour:
+            return [("minute", start, self._end)]
+        return [
+            ("minute", start, f"{first_hour}:00"),
+            ("hour", first_hour, last_hour),
+            ("minute", f"{last_hour}:00", self._end),
+        ]
+
+    def _rollups(
+        self, store: AlertStore, collection: str, resolution: str, start: str, end: str
+    ) -> Iterable[Tuple[str, MetricsAccumulator]]:
+        seen = set()
+        for key, bucket in stream_rollups(store, collection, resolution, start, end):
+            seen.add(key)
+            yield key, self.buckets.get((resolution, key), bucket)
+        for (other, key), bucket in self.buckets.items():
+            if other == resolution and start <= key < end and key not in seen:
+                yield key, bucket
+
+    def window_metrics(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: accumulator.to_metrics(
+                window_hours=WINDOWS[name].total_seconds() / 3600
+            )
+            for name, accumulator in self.windows.items()
+        }
+
+
+def _rollup(
+    resolution: str, key: str, accumulator: MetricsAccumulator
+) -> Dict[str, Any]:
+    return {
+        "resolution": resolution,
+        "bucket": key,
+        "aggregates": accumulator.to_dict(),
+        "metrics": accumulator.to_metrics(window_hours=RESOLUTION_HOURS[resolution]),
+    }
+
+
+def write_rollups(
+    store: AlertStore,
+    collection: str,
+    buckets: Dict[Tuple[str, str], MetricsAccumulator],
+) -> None:
+    """one document per bucket, id `<resolution>_<bucket>`"""
+    updated_at = datetime.now(timezone.utc)
+    store.write_documents(
+        collection,
+        {
+            f"{resolution}_{key}": {
+                **_rollup(resolution, key, accumulator),
+                "updated_at": updated_at,
+            }
+            for (resolution, key), accumulator in buckets.items()
+        },
+    )
+    logger.info(f"wrote {len(buckets)} rollup buckets to {collection}")
+
+
+def stream_rollups(
+    store: AlertStore, collection: str, resolution: str, start: str, end: str
+) -> Iterable[Tuple[str, MetricsAccumulator]]:
+    """
+    (bucket, aggregates) of the stored buckets in [start, end), with one id
+    range scan: ids are `<resolution>_<bucket>` and sort by bucket
+    """
+    if start >= end:
+        return
+    first = f"{resolution}_{start}"
+    last = f"{resolution}_{end}"
+    data = store.read_document(collection, first)
+    if data is not None:
+        yield start, MetricsAccumulator.from_dict(data["aggregates"])
+    for doc_id, data in store.stream_documents(collection, first):
+        if doc_id >= last:
+            break
+        yield data["bucket"], MetricsAccumulator.from_dict(data["aggregates"])
+
+
+def read_rollups(
+    store: AlertStore, collection: str, resolution: str, start: str, end: str
+) -> MetricsAccumulator:
+    """
+    merges the pre-aggregated buckets in [start, end), e.g.
+    read_rollups(store, "metrics_rollups", "hour", "2025-01-29T00", "2025-01-30T00")
+    """
+    merged = MetricsAccumulator()
+    for _, bucket in stream_rollups(store, collection, resolution, start, end):
+        merged.merge(bucket)
+    return merged
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from clients import FirestorePool  # noqa: E402
+
+
+class Probe:
+    def __init__(self, client: "Client") -> None:
+        self._client = client
+
+    def limit(self, count: int) -> "Probe":
+        return self
+
+    def get(self) -> list:
+        if self._client.broken:
+            raise ValueError("Cannot invoke RPC on closed channel!")
+        return []
+
+
+class Client:
+    def __init__(self) -> None:
+        self.broken = False
+        self.closed = False
+
+    def collection(self, name: str) -> Probe:
+        return Probe(self)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FirestorePoolTest(unittest.TestCase):
+    def test_fresh_client_is_not_probed(self):
+        pool = FirestorePool(lambda database: Client(), health_ttl=60)
+        client = pool.get("alerts")
+        client.broken = True
+        self.assertIs(pool.get("alerts"), client)
+
+    def test_stale_client_is_rebuilt_when_the_probe_fails(self):
+        pool = FirestorePool(lambda database: Client(), health_ttl=0.01)
+        client = pool.get("alerts")
+        client.broken = True
+        time.sleep(0.02)
+        rebuilt = pool.get("alerts")
+        self.assertIsNot(rebuilt, client)
+        self.assertTrue(client.closed)
+
+    def test_stale_client_is_kept_when_the_probe_passes(self):
+        pool = FirestorePool(lambda database: Client(), health_ttl=0.01)
+        client = pool.get("alerts")
+        time.sleep(0.02)
+        self.assertIs(pool.get("alerts"), client)
+
+
+if __name__ == "__main__":
+    unittest.main()
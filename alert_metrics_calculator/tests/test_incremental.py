@@ -0,0 +1,157 @@
+import os
+import sys
+import unittest
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from engine import InMemoryDocumentSource, compute  # noqa: E402
+from groups import GroupedMetrics  # noqa: E402
+from incremental import IncrementalMetrics, InMemoryStateStore  # noqa: E402
+from storage import INGESTED_AT, INGESTED_FORMAT  # noqa: E402
+
+START = datetime(2025, 1, 29, 15, 0, 0, tzinfo=timezone.utc)
+SERVICES = ("auth", "payments", "search")
+SEVERITIES = ("critical", "high", "medium", "low")
+
+
+def alert(number: int, minutes_ago: int, status: str = "active") -> Dict[str, Any]:
+    timestamp = START - timedelta(minutes=minutes_ago)
+    return {
+        "alert_id": f"ALT-{number:06d}",
+        "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "service": SERVICES[number % len(SERVICES)],
+        "severity": SEVERITIES[number % len(SEVERITIES)],
+        "status": status,
+        "response_time_ms": 100 + number % 900,
+        "error_count": number % 7,
+        "total_requests": 100,
+        "resolution_minutes": 5 + number % 30 if status == "resolved" else None,
+    }
+
+
+def close(actual: Any, expected: Any) -> bool:
+    """equal, numbers within the 1% the sketches guarantee"""
+    if isinstance(expected, dict):
+        return actual.keys() == expected.keys() and all(
+            close(actual[key], expected[key]) for key in expected
+        )
+    if isinstance(expected, float):
+        return abs(actual - expected) <= 0.011 * abs(expected) + 1e-9
+    return actual == expected
+
+
+class Collection:
+    """alerts keyed by id, stamped with an ingestion time like the processor"""
+
+    def __init__(self) -> None:
+        self.alerts: Dict[str, Dict[str, Any]] = {}
+        self.clock = START
+
+    def ingest(self, *alerts: Dict[str, Any], at: datetime = None) -> None:
+        if at is None:
+            self.clock += timedelta(seconds=1)
+            at = self.clock
+        for alert in alerts:
+            self.alerts[alert["alert_id"]] = {
+                **alert,
+                INGESTED_AT: at.strftime(INGESTED_FORMAT),
+            }
+
+    def resolve(self, alert_id: str, minutes: int) -> None:
+        # what the lifecycle merges in, the timestamp stays
+        self.ingest(
+            {
+                **self.alerts[alert_id],
+                "status": "resolved",
+                "resolution_minutes": minutes,
+            }
+        )
+
+    def source(self) -> InMemoryDocumentSource:
+        return InMemoryDocumentSource(list(self.alerts.values()))
+
+    def full(self):
+        groups = GroupedMetrics()
+        accumulator = compute(self.source(), sinks=[groups.add])
+        return accumulator.to_metrics(), groups.to_metrics()
+
+
+class IncrementalMetricsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.collection = Collection()
+        self.states = InMemoryStateStore()
+
+    def update(self):
+        incremental = IncrementalMetrics(self.collection.source(), self.states)
+        return incremental.update(now=self.collection.clock)
+
+    def assertMatchesFull(self, state) -> None:
+        accumulator, groups = self.collection.full()
+        self.assertTrue(close(state.accumulator.to_metrics(), accumulator))
+        self.assertTrue(close(state.groups.to_metrics(), groups))
+
+    def test_matches_full_pass(self) -> None:
+        self.collection.ingest(*(alert(n, n % 60) for n in range(200)))
+        self.assertMatchesFull(self.update())
+        self.assertMatchesFull(self.update())
+
+    def test_folds_alerts_with_older_timestamps(self) -> None:
+        # generators make timestamps up: the second batch is older
+        self.collection.ingest(*(alert(n, 0) for n in range(100)))
+        self.update()
+        self.collection.ingest(*(alert(n, 120 + n % 60) for n in range(100, 300)))
+        state = self.update()
+        self.assertEqual(state.accumulator.total_alerts, 300)
+        self.assertMatchesFull(state)
+
+    def test_folds_late_commits_once(self) -> None:
+        self.collection.ingest(*(alert(n, 5) for n in range(50)))
+        self.update()
+        # stamped before the watermark, committed after the last run
+        late = self.collection.clock - timedelta(seconds=30)
+        self.collection.ingest(*(alert(n, 5) for n in range(50, 60)), at=late)
+        self.assertMatchesFull(self.update())
+        # seen again within the lookback, not folded twice
+        state = self.update()
+        self.assertEqual(state.accumulator.total_alerts, 60)
+        self.assertMatchesFull(state)
+
+    def test_resolves_replace_active_contributions(self) -> None:
+        self.collection.ingest(*(alert(n, 10) for n in range(40)))
+        self.collection.ingest(*(alert(n, 10, "resolved") for n in range(40, 60)))
+        self.update()
+        self.assertEqual(len(list(self.states.stream_tracked())), 40)
+        for n in range(0, 40, 2):
+            self.collection.resolve(f"ALT-{n:06d}", minutes=n)
+        state = self.update()
+        self.assertEqual(state.accumulator.total_alerts, 60)
+        self.assertEqual(len(list(self.states.stream_tracked())), 20)
+        self.assertMatchesFull(state)
+
+    def test_recovers_from_a_run_that_died_before_saving(self) -> None:
+        self.collection.ingest(*(alert(n, 10) for n in range(40)))
+        self.update()
+        for n in range(0, 20):
+            self.collection.resolve(f"ALT-{n:06d}", minutes=3)
+        self.collection.ingest(*(alert(n, 80) for n in range(40, 50)))
+        save = self.states.save
+
+        def die(state: Dict[str, Any]) -> None:
+            raise RuntimeError("instance stopped")
+
+        self.states.save = die
+        with self.assertRaises(RuntimeError):
+            self.update()
+        self.states.save = save
+        self.collection.resolve("ALT-000030", minutes=7)
+        state = self.update()
+        self.assertEqual(state.accumulator.total_alerts, 50)
+        self.assertEqual(len(list(self.states.stream_tracked())), 29)
+        self.assertMatchesFull(state)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import random
+import sys
+import unittest
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from engine import compute  # noqa: E402
+from incremental import DocumentStateStore, IncrementalMetrics  # noqa: E402
+from storage import INGESTED_AT, INGESTED_FORMAT, SQLiteAlertStore  # noqa: E402
+from windows import WINDOW_FIELDS, WindowedMetrics, write_rollups  # noqa: E402
+
+from test_incremental import close  # noqa: E402
+
+ROLLUPS = "metrics_rollups"
+NOW = datetime(2025, 1, 29, 15, 0, 0, tzinfo=timezone.utc)
+
+
+class WindowedMetricsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.random = random.Random(7)
+        self.store = SQLiteAlertStore()
+        self.now = NOW
+        self.count = 0
+
+    def ingest(self, number: int, spread: timedelta) -> None:
+        alerts: Dict[str, Dict[str, Any]] = {}
+        for _ in range(number):
+            self.count += 1
+            seconds = self.random.randint(0, int(spread.total_seconds()))
+            timestamp = self.now - timedelta(seconds=seconds)
+            alerts[f"ALT-{self.count:06d}"] = {
+                "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "service": self.random.choice(["auth", "payments", "search"]),
+                "severity": self.random.choice(["critical", "high", "low"]),
+                "status": "active",
+                "response_time_ms": self.random.randint(50, 5000),
+                "error_count": self.random.randint(0, 10),
+                "total_requests": 100,
+                INGESTED_AT: self.now.strftime(INGESTED_FORMAT),
+            }
+        self.store.write_alerts(alerts)
+
+    def full(self) -> Dict[str, Dict[str, Any]]:
+        windowed = WindowedMetrics(self.now)
+        compute(self.store, fields=WINDOW_FIELDS, sinks=[windowed.add])
+        return windowed.window_metrics()
+
+    def incremental(self, die: bool = False) -> Dict[str, Dict[str, Any]]:
+        windowed = WindowedMetrics(self.now)
+
+        def before_save(state) -> None:
+            windowed.fold(self.store, ROLLUPS, state.lineage, state.generation)
+            if die:
+                raise RuntimeError("instance stopped")
+
+        IncrementalMetrics(self.store, DocumentStateStore(self.store)).update(
+            now=self.now, on_change=windowed.change, before_save=before_save
+        )
+        windowed.from_rollups(self.store, ROLLUPS)
+        return windowed.window_metrics()
+
+    def advance(self, minutes: int) -> None:
+        self.now += timedelta(minutes=minutes)
+
+    def test_incremental_matches_full(self) -> None:
+        self.ingest(300, timedelta(hours=30))
+        self.assertTrue(close(self.incremental(), self.full()))
+        for _ in range(4):
+            self.advance(7)
+            # made-up timestamps, spread over the past hour
+            self.ingest(40, timedelta(hours=1))
+            self.assertTrue(close(self.incremental(), self.full()))
+
+    def test_reconcile_matches_full(self) -> None:
+        self.ingest(300, timedelta(hours=30))
+        write_rollups(self.store, ROLLUPS, self._full_buckets(timedelta(hours=25)))
+        self.advance(7)
+        self.ingest(40, timedelta(minutes=5))
+        windowed = WindowedMetrics(self.now)
+        windowed.rebuild(self.store)
+        windowed.from_rollups(self.store, ROLLUPS)
+        self.assertTrue(close(windowed.window_metrics(), self.full()))
+
+    def test_keeps_buckets_written_by_full_mode(self) -> None:
+        self.ingest(200, timedelta(hours=2))
+        self.incremental()
+        self.advance(5)
+        self.ingest(30, timedelta(minutes=3))
+        # a full run in between rewrites the recent buckets without lineage
+        write_rollups(self.store, ROLLUPS, self._full_buckets(timedelta(minutes=15)))
+        self.advance(5)
+        self.ingest(30, timedelta(minutes=3))
+        self.assertTrue(close(self.incremental(), self.full()))
+
+    def test_recovers_from_a_run_that_died_before_saving(self) -> None:
+        self.ingest(200, timedelta(hours=2))
+        self.incremental()
+        self.advance(5)
+        self.ingest(30, timedelta(minutes=20))
+        with self.assertRaises(RuntimeError):
+            self.incremental(die=True)
+        self.ingest(10, timedelta(minutes=2))
+        self.assertTrue(close(self.incremental(), self.full()))
+
+    def _full_buckets(self, lookback: timedelta):
+        windowed = WindowedMetrics(self.now, rollup_lookback=lookback)
+        compute(self.store, fields=WINDOW_FIELDS, sinks=[windowed.add])
+        return windowed.buckets
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+# kept identical in alert_processor/src and alert_metrics_calculator/src:
+# each function is deployed from its own source archive
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from google.cloud.firestore import Client
+
+import firebase_admin
+
+from typing import Callable, Dict, Optional
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DATABASE = os.environ.get("FIRESTORE_DATABASE", "alerts-store")
+PROJECT_ID = os.environ.get("FIRESTORE_PROJECT") or None
+HEALTH_COLLECTION = os.environ.get("FIRESTORE_HEALTH_COLLECTION", "_health")
+# seconds a warm client is trusted before get() probes it again, 0 disables
+HEALTH_TTL = float(os.environ.get("FIRESTORE_HEALTH_TTL", "300"))
+
+# errors after which the cached channel can't be trusted anymore
+FATAL_ERRORS = (
+    api_exceptions.Unauthenticated,
+    api_exceptions.PermissionDenied,
+    auth_exceptions.RefreshError,
+    auth_exceptions.TransportError,
+)
+
+
+def is_fatal(error: BaseException) -> bool:
+    if isinstance(error, FATAL_ERRORS):
+        return True
+    # grpc raises a bare ValueError once a channel has been closed
+    return isinstance(error, ValueError) and "closed channel" in str(error)
+
+
+def _default_factory(database: str) -> Client:
+    return Client(project=PROJECT_ID, database=database)
+
+
+class FirestorePool:
+    """
+    One lazily created Firestore client per database, shared by every
+    invocation that lands on a warm instance. a client older than
+    health_ttl is probed on get() and rebuilt if the probe fails.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Client] = _default_factory,
+        health_ttl: float = HEALTH_TTL,
+    ) -> None:
+        self._factory = factory
+        self._health_ttl = health_ttl
+        self._clients: Dict[str, Client] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, database: Optional[str] = None) -> Client:
+        database = database or DEFAULT_DATABASE
+        client = self._clients.get(database)
+        if client is not None:
+            if self._fresh(database) or self.healthy(database):
+                return client
+            # the failed probe already reported the error, drop what is left
+            self.invalidate(database)
+        with self._lock:
+            client = self._clients.get(database)
+            if client is None:
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app()
+                    logger.debug("firebase app not found. setting up..")
+                logger.debug(f"creating firestore client for {database}..")
+                client = self._factory(database)
+                self._clients[database] = client
+                self._checked[database] = time.monotonic()
+                logger.info(f"firestore client for {database} ready")
+            return client
+
+    def invalidate(self, database: Optional[str] = None) -> None:
+        database = database or DEFAULT_DATABASE
+        with self._lock:
+            client = self._clients.pop(database, None)
+            self._checked.pop(database, None)
+        if client is None:
+            return
+        logger.info(f"dropped firestore client for {database}")
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"error closing firestore client for {database}: {e}")
+
+    def report(self, error: BaseException, database: Optional[str] = None) -> None:
+        """rebuilds the client on next use if the error poisoned its channel"""
+        if is_fatal(error):
+            logger.error(f"fatal firestore error, rebuilding client: {error}")
+            self.invalidate(database)
+
+    def _fresh(self, database: str) -> bool:
+        if self._health_ttl <= 0:
+            return True
+        checked = self._checked.get(database)
+        return checked is not None and time.monotonic() - checked < self._health_ttl
+
+    def healthy(self, database: Optional[str] = None) -> bool:
+        """probes the cached client, without creating one"""
+        database = database or DEFAULT_DATABASE
+        client = self._clients.get(database)
+        if client is None:
+            return False
+        try:
+            client.collection(HEALTH_COLLECTION).limit(1).get()
+            self._checked[database] = time.monotonic()
+            return True
+        except Exception as e:
+            logger.error(f"firestore health check failed for {database}: {e}")
+            self.report(e, database)
+            return False
+
+
+firestore_pool = FirestorePool()
@@ -0,0 +1,204 @@
+from google.cloud.firestore import (
+    Client,
+    Increment,
+    Maximum,
+    Transaction,
+    WriteBatch,
+)
+
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import logging
+import math
+import os
+import random
+
+logger = logging.getLogger(__name__)
+
+# same layout as MetricsAccumulator / GroupedMetrics in
+# alert_metrics_calculator, which sums the shards back up in reconcile mode
+GROUP_FIELDS = ("service", "severity")
+PROJECTION = [
+    "service",
+    "severity",
+    "status",
+    "response_time_ms",
+    "error_count",
+    "total_requests",
+    "resolution_minutes",
+]
+# DDSketch bucket mapping, must match sketch.py in alert_metrics_calculator
+RELATIVE_ACCURACY = 0.01
+_MULTIPLIER = 1 / math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))
+# firestore rejects a single write with more field transforms than this
+MAX_TRANSFORMS = 500
+
+
+NUMERIC_FIELDS = (
+    "response_time_ms",
+    "error_count",
+    "total_requests",
+    "resolution_minutes",
+)
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def _sketch_key(value: float) -> str:
+    return str(math.ceil(math.log(value) * _MULTIPLIER))
+
+
+class CounterDelta:
+    """
+    Net change a set of alert writes makes to the counters, as flat
+    "aggregates.total_alerts" style paths. Updates of existing alerts are
+    recorded as their new contribution minus the stored one.
+    """
+
+    __slots__ = ("increments", "maximums")
+
+    def __init__(self) -> None:
+        self.increments: Dict[str, float] = {}
+        self.maximums: Dict[str, float] = {}
+
+    def _inc(self, path: str, value: float) -> None:
+        self.increments[path] = self.increments.get(path, 0) + value
+
+    def _sketch(self, prefix: str, value: Any, sign: int) -> None:
+        if value > 0:
+            self._inc(f"{prefix}.bins.{_sketch_key(value)}", sign)
+        else:
+            self._inc(f"{prefix}.zeros", sign)
+        # firestore can't take a max back, it only ever grows
+        if sign > 0 and value > self.maximums.get(f"{prefix}.max", -1):
+            self.maximums[f"{prefix}.max"] = value
+
+    def add(self, alert: Dict[str, Any], sign: int = 1) -> None:
+        # stored alerts may predate validation, non-numbers are skipped the
+        # way the calculator skips them
+        numbers = {field: _number(alert.get(field)) for field in NUMERIC_FIELDS}
+        prefixes = ["aggregates"] + [
+            f"groups.{field}.{alert[field]}"
+            for field in GROUP_FIELDS
+            if isinstance(alert.get(field), str) and alert[field]
+        ]
+        for prefix in prefixes:
+            self._inc(f"{prefix}.total_alerts", sign)
+            status = alert.get("status")
+            if status in ("active", "resolved"):
+                self._inc(f"{prefix}.{status}_alerts", sign)
+            if alert.get("severity") == "critical":
+                self._inc(f"{prefix}.critical_alerts", sign)
+            for field, value in numbers.items():
+                if value is not None:
+                    self._inc(f"{prefix}.{field}", sign * value)
+            if numbers["response_time_ms"] is not None:
+                self._sketch(
+                    f"{prefix}.response_time_sketch", numbers["response_time_ms"], sign
+                )
+            if numbers["resolution_minutes"] is not None:
+                self._sketch(
+                    f"{prefix}.resolution_sketch", numbers["resolution_minutes"], sign
+                )
+            if isinstance(alert.get("service"), str) and alert["service"]:
+                self._inc(f"{prefix}.services.{alert['service']}", sign)
+
+    def remove(self, alert: Dict[str, Any]) -> None:
+        self.add(alert, -1)
+
+    def transforms(self) -> List[Dict[str, Any]]:
+        """nested Increment / Maximum payloads, at most MAX_TRANSFORMS each"""
+        paths = [
+            (path, Increment(value))
+            for path, value in self.increments.items()
+            if value != 0
+        ]
+        paths += [(path, Maximum(value)) for path, value in self.maximums.items()]
+        payloads = []
+        for start in range(0, len(paths), MAX_TRANSFORMS):
+            payload: Dict[str, Any] = {}
+            for path, transform in paths[start : start + MAX_TRANSFORMS]:
+                node = payload
+                *parents, leaf = path.split(".")
+                for parent in parents:
+                    node = node.setdefault(parent, {})
+                node[leaf] = transform
+            payloads.append(payload)
+        return payloads
+
+
+class ShardedCounters:
+    """
+    In-stream metrics: every alert batch also increments counter documents
+    picked among `shards`, in the same transaction as the alert writes.
+    That transaction also reads the stored versions of the alerts it
+    overwrites, so a failed, retried or concurrent write never double
+    counts. Spreading the increments over shards keeps each document well
+    under firestore's sustained write rate for a single document.
+    """
+
+    def __init__(self, collection: str = "metrics_counters", shards: int = 10) -> None:
+        self._collection = collection
+        self._shards = max(1, shards)
+
+    @property
+    def collection(self) -> str:
+        return self._collection
+
+    def previous(
+        self,
+        db: Client,
+        collection: str,
+        ids: Iterable[str],
+        transaction: Optional[Transaction] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        stored contributions of alerts about to be overwritten. read in the
+        transaction that writes them, so they can't change in between
+        """
+        refs = [
+            db.collection(collection).document(document_id=alert_id) for alert_id in ids
+        ]
+        if not refs:
+            return {}
+        stored: Dict[str, Dict[str, Any]] = {}
+        for snapshot in db.get_all(
+            refs, field_paths=PROJECTION, transaction=transaction
+        ):
+            if snapshot.exists:
+                stored[snapshot.id] = snapshot.to_dict() or {}
+        return stored
+
+    def stage(
+        self, db: Client, batch: Union[WriteBatch, Transaction], delta: CounterDelta
+    ) -> int:
+        """adds the delta to the batch, returns the number of writes staged"""
+        payloads = delta.transforms()
+        if len(payloads) > self._shards:
+            # two payloads on one document would break the per-document
+            # transform limit of a commit
+            raise ValueError(
+                f"{len(payloads)} counter payloads for {self._shards} shards, "
+                "raise COUNTER_SHARDS"
+            )
+        collection = db.collection(self._collection)
+        # distinct shards: one payload per document
+        shards = random.sample(range(self._shards), len(payloads))
+        for shard, payload in zip(shards, payloads):
+            batch.set(
+                collection.document(document_id=f"shard_{shard}"), payload, merge=True
+            )
+        return len(payloads)
+
+
+def counters_from_env() -> Optional[ShardedCounters]:
+    if os.environ.get("IN_STREAM_METRICS", "false").lower() != "true":
+        return None
+    return ShardedCounters(
+        collection=os.environ.get("COUNTER_COLLECTION", "metrics_counters"),
+        shards=int(os.environ.get("COUNTER_SHARDS", 10)),
+    )
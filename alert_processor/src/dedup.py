@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+from storage import AlertStore
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+HASH_FIELD = "content_hash"
+
+
+def content_hash(alert: Dict[str, Any]) -> str:
+    payload = {key: value for key, value in alert.items() if key != HASH_FIELD}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Deduplicator:
+    """
+    Drops redelivered alerts before they turn into writes.
+
+    Hot duplicates are caught by a bounded in-process LRU of
+    alert_id -> content hash, which survives across warm invocations.
+    Everything else is checked against the hash stored on the document,
+    with one batched read per message.
+    """
+
+    def __init__(self, capacity: int = 10_000) -> None:
+        self._capacity = capacity
+        self._seen: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, alert_id: str, digest: str) -> None:
+        with self._lock:
+            self._seen[alert_id] = digest
+            self._seen.move_to_end(alert_id)
+            while len(self._seen) > self._capacity:
+                self._seen.popitem(last=False)
+
+    def drop_hot(
+        self, alerts: Dict[str, Dict[str, Any]]
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """splits off alerts whose exact content was written recently"""
+        fresh: Dict[str, Dict[str, Any]] = {}
+        duplicates: List[str] = []
+        with self._lock:
+            for alert_id, alert in alerts.items():
+                if self._seen.get(alert_id) == alert[HASH_FIELD]:
+                    self._seen.move_to_end(alert_id)
+                    duplicates.append(alert_id)
+                else:
+                    fresh[alert_id] = alert
+        return fresh, duplicates
+
+    def drop_cold(
+        self, store: AlertStore, alerts: Dict[str, Dict[str, Any]]
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str], Set[str]]:
+        """
+        reads the stored hash of every alert in one batched get and returns
+        the alerts that still need writing, the unchanged ones, and the ids
+        that don't exist yet (to be written with create())
+        """
+        if not alerts:
+            return alerts, [], set()
+        missing = set(alerts)
+        changed = dict(alerts)
+        unchanged: List[str] = []
+        for doc in store.get(list(alerts), [HASH_FIELD]):
+            alert_id = doc["alert_id"]
+            missing.discard(alert_id)
+            stored = doc.get(HASH_FIELD)
+            if stored == alerts[alert_id][HASH_FIELD]:
+                unchanged.append(alert_id)
+                del changed[alert_id]
+                self.remember(alert_id, stored)
+        logger.debug(
+            "%d unchanged, %d new, %d changed alerts",
+            len(unchanged),
+            len(missing),
+            len(changed) - len(missing),
+        )
+        return changed, unchanged, missing
+
+
+deduplicator = Deduplicator(capacity=int(os.environ.get("DEDUP_CACHE_SIZE", 10_000)))
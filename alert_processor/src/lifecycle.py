@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from clients import firestore_pool
+from dedup import HASH_FIELD
+from storage import AlertStore, FirestoreAlertStore, store_from_env
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = "active"
+RESOLVED = "resolved"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def resolution_minutes(since: Any, resolved_at: Any) -> Optional[int]:
+    """whole minutes between activation and resolve, None if unknown"""
+    try:
+        start = datetime.strptime(since, TIMESTAMP_FORMAT)
+        end = datetime.strptime(resolved_at, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    if end < start:
+        return None
+    return int((end - start).total_seconds() // 60)
+
+
+class Transitions:
+    """
+    What one batch of alerts does to the stored alerts and the active
+    index: alerts to write in full, resolve events to merge into alerts
+    that are active, index entries to set (or drop, as None), and stale
+    alerts not to write at all.
+    """
+
+    __slots__ = ("writes", "updates", "active", "stale")
+
+    def __init__(self) -> None:
+        self.writes: Dict[str, Dict[str, Any]] = {}
+        self.updates: Dict[str, Dict[str, Any]] = {}
+        self.active: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.stale: Set[str] = set()
+
+
+def plan(
+    store: AlertStore,
+    alerts: Dict[str, Dict[str, Any]],
+    creates: Set[str] = frozenset(),
+) -> Transitions:
+    """
+    one batched read of the active index for the incoming ids, then:
+
+    - active alert, not indexed: written in full and indexed from its
+      timestamp. unless it is stored resolved at or after this event's
+      timestamp: a redelivered activation, left out as stale
+    - active alert, indexed: written in full, the index keeps its
+      original activation time
+    - resolved alert, indexed: active -> resolved. only status,
+      resolution_minutes (from the activation time to this event's
+      timestamp), resolved_at and the content hash are merged in, and the
+      index entry is dropped
+    - resolved alert, not indexed: written in full, as sent
+
+    index entries of alerts in `creates`, known not to be stored, are stale
+    and ignored. active alerts neither indexed nor in `creates` cost a
+    second batched read, of their stored status
+    """
+    indexed = {entry["alert_id"]: entry for entry in store.get_active(list(alerts))}
+    unindexed = [
+        alert_id
+        for alert_id, alert in alerts.items()
+        if alert.get("status") == ACTIVE
+        and alert_id not in indexed
+        and alert_id not in creates
+    ]
+    # when it was resolved. written in full as resolved, its own timestamp
+    resolved = {
+        doc["alert_id"]: doc.get("resolved_at") or doc.get("timestamp")
+        for doc in store.get(unindexed, ["status", "resolved_at", "timestamp"])
+        if doc.get("status") == RESOLVED
+    }
+    transitions = Transitions()
+    for alert_id, alert in alerts.items():
+        entry = indexed.get(alert_id)
+        if entry is not None and alert_id in creates:
+            entry = None
+            transitions.active[alert_id] = None
+        resolved_at = resolved.get(alert_id)
+        if resolved_at is not None and str(alert.get("timestamp")) <= resolved_at:
+            transitions.stale.add(alert_id)
+        elif alert.get("status") == ACTIVE:
+            transitions.writes[alert_id] = alert
+            transitions.active[alert_id] = {
+                "service": alert.get("service"),
+                "severity": alert.get("severity"),
+                "since": alert.get("timestamp") if entry is None else entry["since"],
+            }
+        elif alert.get("status") == RESOLVED and entry is not None:
+            minutes = resolution_minutes(entry["since"], alert.get("timestamp"))
+            transitions.updates[alert_id] = {
+                "status": RESOLVED,
+                "resolution_minutes": (
+                    alert.get("resolution_minutes") if minutes is None else minutes
+                ),
+                "resolved_at": alert.get("timestamp"),
+                HASH_FIELD: alert[HASH_FIELD],
+            }
+            transitions.active[alert_id] = None
+        else:
+            transitions.writes[alert_id] = alert
+    logger.debug(
+        "%d full writes, %d resolves, %d index changes, %d stale",
+        len(transitions.writes),
+        len(transitions.updates),
+        len(transitions.active),
+        len(transitions.stale),
+    )
+    return transitions
+
+
+def rebuild_index(store: AlertStore, batch_size: int = 200) -> int:
+    """
+    indexes every stored active alert, for collections written before the
+    lifecycle was turned on. the one o(history) scan, run it once
+    """
+    indexed = 0
+    entries: Dict[str, Optional[Dict[str, Any]]] = {}
+    for doc in store.query(
+        ["service", "severity", "timestamp"], [("status", "==", ACTIVE)]
+    ):
+        entries[doc["alert_id"]] = {
+            "service": doc.get("service"),
+            "severity": doc.get("severity"),
+            "since": doc.get("timestamp"),
+        }
+        if len(entries) >= batch_size:
+            store.write_alerts({}, active=entries)
+            indexed += len(entries)
+            entries = {}
+    if entries:
+        store.write_alerts({}, active=entries)
+        indexed += len(entries)
+    logger.info("indexed %d active alerts", indexed)
+    return indexed
+
+
+def lifecycle_from_env() -> bool:
+    """ALERT_LIFECYCLE=true turns on the active index and merged resolves"""
+    return os.environ.get("ALERT_LIFECYCLE", "false").lower() == "true"
+
+
+if __name__ == "__main__":
+    rebuild_index(store_from_env() or FirestoreAlertStore(firestore_pool.get()))
@@ -1,80 +1,434 @@
-import json
 import base64
-import firebase_admin
-from google.cloud.firestore import Client
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from google.cloud.firestore import Client, Transaction, transactional
+
+from clients import DEFAULT_DATABASE, firestore_pool
+from counters import CounterDelta, ShardedCounters, counters_from_env
+from dedup import HASH_FIELD, Deduplicator, content_hash, deduplicator
+from instrumentation import LOG_LEVEL, count, registry, span
+from lifecycle import Transitions, lifecycle_from_env, plan
+from notify import notifier_from_env
+from schema import Rejection, validator
+from storage import (
+    INGESTED_AT,
+    INGESTED_FORMAT,
+    AlertStore,
+    FirestoreAlertStore,
+    store_from_env,
+)
+from wire import decode
 
 import logging
 
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 
+class WriteReport:
+    """per-alert outcome of a bulk write"""
+
+    __slots__ = ("written", "failed", "rejected", "skipped")
+
+    def __init__(self) -> None:
+        self.written: List[str] = []
+        self.failed: Dict[str, str] = {}
+        # alerts that failed validation and went to quarantine
+        self.rejected: List[str] = []
+        # redelivered alerts whose stored content was already identical
+        self.skipped: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
 class FSWriter:
     def __init__(
-        self, database: str = "alerts-store", collection: str = "alerts_collection"
+        self,
+        database: str = DEFAULT_DATABASE,
+        collection: str = "alerts_collection",
+        quarantine_collection: str = "alerts_quarantine",
+        batch_size: int = 100,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.2,
+        dedup: Optional[Deduplicator] = deduplicator,
+        counters: Optional[ShardedCounters] = None,
+        store: Optional[AlertStore] = None,
+        lifecycle: bool = False,
     ) -> None:
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app()
-            logger.debug("firebase app not found. setting up")
-        logger.debug("firebase app found")
         self._collection = collection
+        self._quarantine_collection = quarantine_collection
         self._database = database
-        self._db = Client(database=self._database)
+        # firestore unless another store is handed in (see storage.py)
+        self._local = store is not None
+        if self._local and counters is not None:
+            raise ValueError("in-stream counters need the firestore store")
+        self._db: Optional[Client] = None
+        if store is None:
+            self._db = firestore_pool.get(self._database)
+            store = FirestoreAlertStore(self._db, self._collection)
+        self._store: AlertStore = store
+        # firestore caps a single batch at 500 writes, counter shards included,
+        # and the lifecycle adds up to one index write per alert
+        cap = 500 if counters is None else 400
+        if lifecycle:
+            cap //= 2
+        self._batch_size = max(1, min(batch_size, cap))
+        self._lifecycle = lifecycle
+        self._concurrency = max(1, concurrency)
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._dedup = dedup
+        self._counters = counters
 
-    def write(self, data: Dict[str, List[Dict[str, str]]]) -> List[str] | None:
+    @property
+    def database(self) -> str:
+        return self._database
+
+    def write(self, data: Dict[str, List[Dict[str, str]]]) -> WriteReport:
         logger.debug("starting to write data to db..")
+        return self.write_alerts(unwrap_alerts(data))
+
+    def write_alerts(self, alerts: List[Dict[str, Any]]) -> WriteReport:
+        """
+        validates alerts, then writes them in batches committed concurrently.
+        a failed batch only fails its own alerts, which are retried with
+        exponential backoff. invalid alerts are quarantined, not written, and
+        alerts whose content is already stored are skipped
+        """
+        report = WriteReport()
+        with span("validate"):
+            valid, rejected = validator.validate_batch(alerts)
+        count("alerts_received", len(alerts))
+        if rejected:
+            self._quarantine(rejected)
+            report.rejected = [rejection.reason for rejection in rejected]
+        pending: Dict[str, Dict[str, Any]] = {}
+        for alert in valid:
+            data = alert.to_dict()
+            data[HASH_FIELD] = content_hash(data)
+            pending[alert.alert_id] = data
+        if self._dedup is not None:
+            pending, duplicates = self._dedup.drop_hot(pending)
+            report.skipped.extend(duplicates)
+
+        attempt = 0
+        while pending:
+            if attempt > 0:
+                delay = self._backoff_seconds * (2 ** (attempt - 1))
+                logger.debug("retrying %d alerts in %ss..", len(pending), delay)
+                time.sleep(delay)
+                if not self._local:
+                    # picks up a rebuilt client if the last attempt poisoned it
+                    self._db = firestore_pool.get(self._database)
+                    self._store = FirestoreAlertStore(self._db, self._collection)
+            pending, creates = self._drop_unchanged(pending, report)
+            if not pending:
+                break
+            try:
+                transitions = self._transitions(pending, creates)
+            except Exception as e:
+                logger.error(f"error reading stored alerts: {e}")
+                firestore_pool.report(e, self._database)
+                errors = {alert_id: str(e) for alert_id in pending}
+            else:
+                for alert_id in transitions.stale:
+                    # older than the resolve already stored
+                    del pending[alert_id]
+                    report.skipped.append(alert_id)
+                    report.failed.pop(alert_id, None)
+                errors = self._commit(pending, creates, transitions) if pending else {}
+            for alert_id in pending:
+                if alert_id not in errors:
+                    report.written.append(alert_id)
+                    report.failed.pop(alert_id, None)
+                    if self._dedup is not None:
+                        self._dedup.remember(alert_id, pending[alert_id][HASH_FIELD])
+            report.failed.update(errors)
+            pending = {alert_id: pending[alert_id] for alert_id in errors}
+            attempt += 1
+            if attempt > self._max_retries:
+                break
+
+        count("alerts_written", len(report.written))
+        count("alerts_skipped", len(report.skipped))
+        logger.info(
+            "wrote %d alerts, skipped %d duplicates, %d failed after %d attempt(s)",
+            len(report.written),
+            len(report.skipped),
+            len(report.failed),
+            attempt,
+        )
+        return report
+
+    def _drop_unchanged(
+        self, pending: Dict[str, Dict[str, Any]], report: WriteReport
+    ) -> Tuple[Dict[str, Dict[str, Any]], Set[str]]:
+        """
+        returns the alerts that still need writing and the ids that don't
+        exist yet, which are written with create() so a concurrent writer
+        makes the batch fail and get re-checked instead of overwriting
+        """
+        if self._dedup is None:
+            return pending, set()
         try:
-            alerts_container = data["alerts"]["alerts"]  # pyright: ignore
+            with span("dedup_lookup"):
+                changed, unchanged, creates = self._dedup.drop_cold(
+                    self._store, pending
+                )
         except Exception as e:
-            logger.error(f"error trying to make container. got : {data}. Error: {e}")
-            raise e
+            logger.error(f"error checking stored alerts, writing all: {e}")
+            return pending, set()
+        for alert_id in unchanged:
+            report.skipped.append(alert_id)
+            report.failed.pop(alert_id, None)
+        return changed, creates
+
+    def _transitions(
+        self, pending: Dict[str, Dict[str, Any]], creates: Set[str]
+    ) -> Transitions:
+        """active index changes and resolve merges, see lifecycle.py"""
+        if not self._lifecycle:
+            transitions = Transitions()
+            transitions.writes = pending
+            return transitions
+        with span("lifecycle_lookup"):
+            return plan(self._store, pending, creates)
+
+    def _quarantine(self, rejected: List[Rejection]) -> None:
+        logger.error(f"quarantining {len(rejected)} invalid alerts")
+        quarantined_at = datetime.now(timezone.utc)
+        records = {}
+        for rejection in rejected:
+            logger.debug("rejected alert: %s", rejection.reason)
+            records[uuid.uuid4().hex] = {
+                **rejection.to_dict(),
+                "quarantined_at": quarantined_at,
+            }
         try:
-            alerts_list = alerts_container["alerts"]  # pyright: ignore
+            with span("quarantine_write"):
+                self._store.write_documents(self._quarantine_collection, records)
         except Exception as e:
-            logger.error(
-                f"error trying to make alerts_list. got: {alerts_container} Error: {e}"
-            )
-            raise e
-        refs = []
-        for alert in alerts_list:
-            try:
-                logger.debug(f"trying to insert alert: {alert['alert_id']}")
-                ref = self._db.collection(self._collection).document(
-                    document_id=alert["alert_id"]
+            # losing a quarantine record must not fail the valid alerts
+            logger.error(f"error quarantining alerts: {e}")
+
+    def _commit(
+        self,
+        alerts: Dict[str, Dict[str, Any]],
+        creates: Set[str],
+        transitions: Transitions,
+    ) -> Dict[str, str]:
+        """commits every chunk of alerts, returns the errors keyed by alert_id"""
+        ids = list(alerts)
+        chunks = [
+            ids[i : i + self._batch_size] for i in range(0, len(ids), self._batch_size)
+        ]
+        errors: Dict[str, str] = {}
+        workers = min(self._concurrency, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._commit_chunk, chunk, creates, transitions): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    future.result()
+                    logger.debug("committed batch of %d alerts", len(chunk))
+                except Exception as e:
+                    logger.error(f"error committing batch of {len(chunk)} alerts: {e}")
+                    firestore_pool.report(e, self._database)
+                    for alert_id in chunk:
+                        errors[alert_id] = str(e)
+        return errors
+
+    def _commit_chunk(
+        self,
+        chunk: List[str],
+        creates: Set[str],
+        transitions: Transitions,
+    ) -> None:
+        with span("store_write"):
+            self._write_chunk(chunk, creates, transitions)
+
+    def _write_chunk(
+        self,
+        chunk: List[str],
+        creates: Set[str],
+        transitions: Transitions,
+    ) -> None:
+        # per attempt: a retried chunk is stored later than it first failed
+        stamp = {INGESTED_AT: datetime.now(timezone.utc).strftime(INGESTED_FORMAT)}
+        writes = {
+            alert_id: {**transitions.writes[alert_id], **stamp}
+            for alert_id in chunk
+            if alert_id in transitions.writes
+        }
+        updates = {
+            alert_id: {**transitions.updates[alert_id], **stamp}
+            for alert_id in chunk
+            if alert_id in transitions.updates
+        }
+        active = {
+            alert_id: transitions.active[alert_id]
+            for alert_id in chunk
+            if alert_id in transitions.active
+        }
+        if self._counters is None:
+            self._store.write_alerts(writes, creates, updates, active)
+            return
+        overwrites = [alert_id for alert_id in chunk if alert_id not in creates]
+
+        @transactional
+        def write(transaction: Transaction) -> None:
+            # read in the transaction: a concurrent overwrite of the same alert
+            # makes one of them retry against the other's version instead of
+            # both subtracting the same stored contribution
+            with span("counters_lookup"):
+                previous = self._counters.previous(
+                    self._db, self._collection, overwrites, transaction
                 )
-                ref.set(alert)
-                logger.debug(f"added alert: {alert['alert_id']} with ref: {ref.id}")
-                refs.append(ref.id)
-            except Exception as e:
-                logger.debug(f"error writing alert {alert['alert_id']}: {e}")
-                raise e
-        return refs
+            self._store.stage_alerts(transaction, writes, creates, updates, active)
+            delta = CounterDelta()
+            for alert_id in chunk:
+                if alert_id in updates:
+                    # merged into the stored alert, which `previous` holds
+                    delta.add({**previous.get(alert_id, {}), **updates[alert_id]})
+                else:
+                    delta.add(writes[alert_id])
+                if alert_id in previous:
+                    delta.remove(previous[alert_id])
+            # same commit: the counters move if and only if the alerts land
+            self._counters.stage(self._db, transaction, delta)
+
+        write(self._db.transaction())
 
 
-def _decode_message(event) -> Dict[str, List[Dict[str, str]]] | None:
+def unwrap_alerts(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """the alert list out of a decoded message"""
+    try:
+        alerts_container = data["alerts"]["alerts"]  # pyright: ignore
+    except Exception as e:
+        logger.error(f"error trying to make container. got : {data}. Error: {e}")
+        raise e
     try:
-        logger.debug("started message decoding")
-        data = base64.b64decode(event["data"]).decode("utf-8")
-        logger.info("decoded message with success")
-        alerts = json.loads(data)
+        alerts_list = alerts_container["alerts"]  # pyright: ignore
+    except Exception as e:
+        logger.error(
+            f"error trying to make alerts_list. got: {alerts_container} Error: {e}"
+        )
+        raise e
+    return alerts_list
+
+
+def decode_payload(
+    payload: bytes, attributes: Optional[Dict[str, str]] = None
+) -> List[Dict[str, Any]] | None:
+    """
+    alerts of a message body as published, before any push-delivery base64.
+    the encoding comes from the message attributes, see wire.py
+    """
+    try:
+        with span("decode"):
+            alerts = decode(payload, attributes)
+        logger.debug("decoded message with success")
         return alerts
     except Exception as e:
         logger.error(f"error decoding data: {e}")
         return None
 
 
+def _decode_message(event) -> List[Dict[str, Any]] | None:
+    logger.debug("started message decoding")
+    try:
+        payload = base64.b64decode(event["data"])
+    except Exception as e:
+        logger.error(f"error decoding data: {e}")
+        return None
+    return decode_payload(payload, event.get("attributes"))
+
+
+# built once per instance, like the firestore clients in clients.py
+local_store = store_from_env()
+notifier = notifier_from_env()
+
+
+def writer_from_env() -> FSWriter:
+    return FSWriter(
+        batch_size=int(os.environ.get("WRITE_BATCH_SIZE", 100)),
+        concurrency=int(os.environ.get("WRITE_CONCURRENCY", 4)),
+        max_retries=int(os.environ.get("WRITE_MAX_RETRIES", 3)),
+        counters=counters_from_env(),
+        store=local_store,
+        lifecycle=lifecycle_from_env(),
+    )
+
+
+def notify_written(
+    alerts: List[Dict[str, Any]],
+    report: WriteReport,
+    wait: bool = True,
+    hold: bool = False,
+) -> None:
+    """
+    hands the alerts that were just written to the notifier. duplicates and
+    failed alerts are left out, and a notification error never fails a write.
+    digests are only held for later (`hold`) by callers that come back for
+    them, see NotificationDispatcher
+    """
+    if notifier is None:
+        return
+    written = set(report.written)
+    try:
+        notifier.dispatch(
+            (
+                alert
+                for alert in alerts
+                if isinstance(alert, dict) and alert.get("alert_id") in written
+            ),
+            wait=wait,
+            hold=hold,
+        )
+    except Exception as e:
+        logger.error(f"error dispatching notifications: {e}")
+
+
 def process_alerts(event, context):
-    fm = FSWriter()
-    data = _decode_message(event)
-    logger.info(f"got data: {data}")
-    if data is None:
+    fm = writer_from_env()
+    alerts = _decode_message(event)
+    # lazy: the payload is only formatted when debug logging is on
+    logger.debug("got data: %s", alerts)
+    if alerts is None:
         logger.error("got empty decoded data")
         return {"status": "failed"}
     try:
-        refs = fm.write(data)  # pyright: ignore
-        return {"status": "success", "refs": refs}
+        report = fm.write_alerts(alerts)
+        notify_written(alerts, report)
+        # totals since the instance started, not this invocation's: a warm
+        # instance serves many invocations
+        logger.debug("instrumentation since instance start: %s", registry)
+        if not report.ok:
+            return {
+                "status": "partial",
+                "refs": report.written,
+                "failed": report.failed,
+                "rejected": report.rejected,
+                "skipped": report.skipped,
+            }
+        return {
+            "status": "success",
+            "refs": report.written,
+            "rejected": report.rejected,
+            "skipped": report.skipped,
+        }
     except Exception as e:
         logger.error(f"error in process_alerts: {e}")
+        firestore_pool.report(e, fm.database)
         return {"status": "failed", "error": str(e)}
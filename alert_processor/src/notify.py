@@ -0,0 +1,399 @@
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from instrumentation import count, span
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+try:
+    import httpx
+except ImportError:  # only the sendgrid transport needs it
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ("critical", "high")
+# lower sends first when the rate limit only lets some through
+SEVERITY_RANK = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+# the digest the ones over the rate limit are folded into, see due()
+SUMMARY = "*"
+
+
+class Notification:
+    """
+    one digest: every selected alert of a service since its last send, or
+    of several services for a summary
+    """
+
+    __slots__ = ("service", "services", "severity", "count", "alerts", "first_seen")
+
+    def __init__(self, service: str, first_seen: float) -> None:
+        self.service = service
+        self.services = set() if service == SUMMARY else {service}
+        self.severity = "low"
+        # alerts coalesced, `alerts` only keeps the first few of them
+        self.count = 0
+        self.alerts: List[Dict[str, Any]] = []
+        self.first_seen = first_seen
+
+    def add(self, alert: Dict[str, Any], max_alerts: int) -> None:
+        self.count += 1
+        if len(self.alerts) < max_alerts:
+            self.alerts.append(alert)
+        severity = str(alert.get("severity", "")).lower()
+        if SEVERITY_RANK.get(severity, 9) < SEVERITY_RANK[self.severity]:
+            self.severity = severity
+
+    def merge(self, other: "Notification", max_alerts: int) -> None:
+        self.count += other.count
+        self.alerts.extend(other.alerts[: max(0, max_alerts - len(self.alerts))])
+        if SEVERITY_RANK[other.severity] < SEVERITY_RANK[self.severity]:
+            self.severity = other.severity
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.services |= other.services
+
+    @property
+    def subject(self) -> str:
+        plural = "" if self.count == 1 else "s"
+        where = self.service
+        if self.service == SUMMARY:
+            where = f"{len(self.services)} services"
+        return f"[{self.severity}] {self.count} alert{plural} on {where}"
+
+    @property
+    def body(self) -> str:
+        lines = [
+            f"{alert.get('timestamp')} {alert.get('severity')} {alert.get('alert_id')}"
+            f" {alert.get('service')}"
+            f" response_time_ms={alert.get('response_time_ms')}"
+            f" errors={alert.get('error_count')}/{alert.get('total_requests')}"
+            for alert in self.alerts
+        ]
+        if self.count > len(self.alerts):
+            lines.append(f"... and {self.count - len(self.alerts)} more")
+        return "\n".join(lines)
+
+
+class Transport(Protocol):
+    async def send(self, notification: Notification) -> None: ...
+
+    async def aclose(self) -> None: ...
+
+
+class StubTransport:
+    """keeps what would have been sent, for tests and local runs"""
+
+    def __init__(self, latency: float = 0.0, fail: bool = False) -> None:
+        self.sent: List[Notification] = []
+        self._latency = latency
+        self._fail = fail
+
+    async def send(self, notification: Notification) -> None:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        if self._fail:
+            raise RuntimeError("stub transport set to fail")
+        self.sent.append(notification)
+        logger.info("notification: %s", notification.subject)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SendGridTransport:
+    """
+    one email per digest over a pooled httpx client, built on the
+    dispatcher's event loop and kept for the life of the instance
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        sender: str,
+        recipients: List[str],
+        max_connections: int = 10,
+        timeout: float = 5.0,
+    ) -> None:
+        if httpx is None:
+            raise RuntimeError("the sendgrid transport needs httpx installed")
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._sender = sender
+        self._recipients = recipients
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._timeout = timeout
+        self._client: Optional[Any] = None
+
+    async def send(self, notification: Notification) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self._headers, limits=self._limits, timeout=self._timeout
+            )
+        response = await self._client.post(
+            SENDGRID_URL,
+            json={
+                "personalizations": [
+                    {"to": [{"email": email} for email in self._recipients]}
+                ],
+                "from": {"email": self._sender},
+                "subject": notification.subject,
+                "content": [{"type": "text/plain", "value": notification.body}],
+            },
+        )
+        response.raise_for_status()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved up. not thread-safe"""
+
+    __slots__ = ("_rate", "_burst", "_tokens", "_updated", "_clock")
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic) -> None:
+        self._rate = rate
+        self._burst = max(1.0, burst)
+        self._tokens = self._burst
+        self._clock = clock
+        self._updated = clock()
+
+    def take(self, wanted: int) -> int:
+        """takes up to `wanted` whole tokens, returns how many it got"""
+        now = self._clock()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+        granted = min(wanted, int(self._tokens))
+        self._tokens -= granted
+        return granted
+
+
+class NotificationDispatcher:
+    """
+    Turns written alerts into a bounded number of outbound notifications.
+
+    Active alerts of the selected severities are coalesced per service:
+    a service gets at most one notification per `window` seconds, measured
+    from its last send. The first alert of a quiet service goes out right
+    away, later ones are held and go out together once the window has
+    passed. On top of that, a token bucket caps sends at `per_minute`
+    across services, most severe first; digests over the budget stay held
+    and keep coalescing. A digest keeps its first `max_alerts` alerts and
+    a count of the rest, so memory stays flat during a storm.
+
+    Holding digests needs someone to come back for them: the pull consumer
+    does, from its timer. A Cloud Function has no timer and may never be
+    invoked again, so process_alerts dispatches with `hold=False`: windows
+    are ignored, and the digests over the rate limit are folded into one
+    summary that takes the last send the limit allows. With no send left
+    at all, they stay pending for the instance's next invocation. Either
+    way sends stay within `per_minute` per instance.
+
+    Sends run concurrently on one event loop thread shared by the whole
+    instance, so the transport can keep its connection pool across Cloud
+    Function invocations and pull batches. A failed send is merged back and
+    retried after the next window.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        window: float = 60.0,
+        per_minute: float = 30.0,
+        burst: int = 10,
+        max_alerts: int = 20,
+        concurrency: int = 10,
+        severities: Tuple[str, ...] = SEVERITIES,
+        clock=time.monotonic,
+    ) -> None:
+        self._transport = transport
+        self._window = window
+        self._bucket = TokenBucket(per_minute / 60, burst, clock)
+        self._max_alerts = max(1, max_alerts)
+        self._concurrency = max(1, concurrency)
+        self._severities = frozenset(severities)
+        self._clock = clock
+        self._pending: Dict[str, Notification] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def offer(self, alerts: Iterable[Dict[str, Any]]) -> int:
+        """coalesces the alerts worth notifying about, returns how many"""
+        selected = 0
+        now = self._clock()
+        with self._lock:
+            for alert in alerts:
+                if alert.get("status") != "active":
+                    continue
+                if str(alert.get("severity", "")).lower() not in self._severities:
+                    continue
+                service = str(alert.get("service"))
+                notification = self._pending.get(service)
+                if notification is None:
+                    notification = self._pending[service] = Notification(service, now)
+                notification.add(alert, self._max_alerts)
+                selected += 1
+        if selected:
+            count("notifications_coalesced", selected)
+        return selected
+
+    def due(self, hold: bool = True) -> List[Notification]:
+        """
+        pops the digests that may go out now, most severe first, within the
+        rate limit. without `hold`, windows are ignored and the digests over
+        the limit are folded into a summary
+        """
+        now = self._clock()
+        with self._lock:
+            ready = [
+                notification
+                for service, notification in self._pending.items()
+                if not hold
+                or now - self._last_sent.get(service, float("-inf")) >= self._window
+            ]
+            if not ready:
+                return []
+            ready.sort(key=lambda n: (SEVERITY_RANK[n.severity], n.first_seen))
+            granted = self._bucket.take(len(ready))
+            popped = ready[:granted]
+            if not hold and 0 < granted < len(ready):
+                summary = Notification(SUMMARY, now)
+                for notification in ready[granted - 1 :]:
+                    summary.merge(notification, self._max_alerts)
+                popped = ready
+                ready = ready[: granted - 1] + [summary]
+                count("notifications_summarized", len(popped) - granted + 1)
+            else:
+                ready = popped
+            for notification in popped:
+                del self._pending[notification.service]
+                self._last_sent[notification.service] = now
+        held = len(self._pending)
+        if held:
+            logger.debug("%d services held back by window or rate limit", held)
+        return ready
+
+    def dispatch(
+        self,
+        alerts: Iterable[Dict[str, Any]] = (),
+        wait: bool = True,
+        timeout: Optional[float] = 10.0,
+        hold: bool = True,
+    ) -> int:
+        """
+        offers the alerts and sends whatever is due, see due(). with `wait`,
+        blocks until the sends are done (or `timeout`), returns how many
+        went out
+        """
+        self.offer(alerts)
+        notifications = self.due(hold)
+        if not notifications:
+            return 0
+        future = asyncio.run_coroutine_threadsafe(
+            self._send_all(notifications), self._running_loop()
+        )
+        if not wait:
+            return 0
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            # still running on the loop, failures are merged back from there
+            logger.error(f"error waiting for {len(notifications)} notifications: {e}")
+            return 0
+
+    def _running_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="notify-loop", daemon=True
+                ).start()
+            return self._loop
+
+    async def _send_all(self, notifications: List[Notification]) -> int:
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def send(notification: Notification) -> bool:
+            async with semaphore:
+                try:
+                    with span("notify_send"):
+                        await self._transport.send(notification)
+                    return True
+                except Exception as e:
+                    logger.error(
+                        f"error notifying {notification.service}, retrying later: {e}"
+                    )
+                    self._requeue(notification)
+                    return False
+
+        results = await asyncio.gather(*(send(n) for n in notifications))
+        sent = sum(results)
+        count("notifications_sent", sent)
+        count("notifications_failed", len(results) - sent)
+        return sent
+
+    def _requeue(self, notification: Notification) -> None:
+        with self._lock:
+            pending = self._pending.get(notification.service)
+            if pending is not None:
+                notification.merge(pending, self._max_alerts)
+            self._pending[notification.service] = notification
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        sends what is left regardless of windows, within the rate limit,
+        then closes the transport
+        """
+        self.dispatch(timeout=timeout, hold=False)
+        with self._lock:
+            held = len(self._pending)
+        if held:
+            logger.warning(f"dropping {held} digests held by the rate limit")
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._transport.aclose(), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.error(f"error closing notification transport: {e}")
+        with self._lock:
+            loop, self._loop = self._loop, None
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def notifier_from_env() -> Optional[NotificationDispatcher]:
+    """
+    NOTIFY_TRANSPORT=sendgrid (SENDGRID_API_KEY, NOTIFY_FROM, NOTIFY_TO as a
+    comma-separated list) or stub, unset for no notifications.
+    NOTIFY_WINDOW_SECONDS, NOTIFY_PER_MINUTE, NOTIFY_BURST tune the limits
+    """
+    name = os.environ.get("NOTIFY_TRANSPORT", "").lower()
+    if not name:
+        return None
+    if name == "stub":
+        transport: Transport = StubTransport()
+    elif name == "sendgrid":
+        transport = SendGridTransport(
+            os.environ["SENDGRID_API_KEY"],
+            os.environ["NOTIFY_FROM"],
+            [email.strip() for email in os.environ["NOTIFY_TO"].split(",")],
+        )
+    else:
+        raise ValueError(f"unknown NOTIFY_TRANSPORT: {name}")
+    return NotificationDispatcher(
+        transport,
+        window=float(os.environ.get("NOTIFY_WINDOW_SECONDS", 60)),
+        per_minute=float(os.environ.get("NOTIFY_PER_MINUTE", 30)),
+        burst=int(os.environ.get("NOTIFY_BURST", 10)),
+    )
@@ -1,29 +1,224 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from google.cloud.pubsub_v1 import SubscriberClient
+from google.cloud.pubsub_v1.subscriber.futures import StreamingPullFuture
 from google.cloud.pubsub_v1.subscriber.message import Message
+from google.cloud.pubsub_v1.types import FlowControl
+from typing import Any, Callable, Dict, List, Optional, Set
 
+from instrumentation import count, registry, span
+from main import FSWriter, decode_payload, notifier, notify_written, writer_from_env
+
+import logging
 import os
+import signal
+import threading
+import time
 
+logger = logging.getLogger(__name__)
 
-def subscribe():
+
+class PullConsumer:
+    """
+    Long-running alternative to the process_alerts Cloud Function.
+
+    Messages arrive over a streaming pull, bounded by flow control
+    (`max_messages` / `max_bytes` outstanding, buffered ones included), and
+    are grouped into micro-batches of `batch_messages` or whatever arrived
+    within `batch_seconds`. Each batch is decoded and written with a single
+    FSWriter.write_alerts call on a pool of `workers` threads. A message is
+    acked once all of its alerts are committed (or quarantined, or skipped
+    as duplicates), and nacked for redelivery if any of them failed.
+    Undecodable messages are acked and dropped, as process_alerts does.
+    """
+
+    def __init__(
+        self,
+        subscription_path: str,
+        subscriber: Optional[SubscriberClient] = None,
+        writer_factory: Callable[[], FSWriter] = writer_from_env,
+        max_messages: int = 1000,
+        max_bytes: int = 100 * 1024 * 1024,
+        batch_messages: int = 100,
+        batch_seconds: float = 0.5,
+        workers: int = 4,
+    ) -> None:
+        self._subscription_path = subscription_path
+        self._subscriber = subscriber or SubscriberClient()
+        self._writer_factory = writer_factory
+        self._flow_control = FlowControl(
+            max_messages=max(1, max_messages), max_bytes=max(1, max_bytes)
+        )
+        # a batch larger than the flow control window would only ever time out
+        self._batch_messages = max(1, min(batch_messages, max_messages))
+        self._batch_seconds = batch_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="pull-batch"
+        )
+        self._buffer: List[Message] = []
+        self._oldest = 0.0
+        self._in_flight: Set[Future] = set()
+        # reentrant: a batch that is already done runs _done on submit
+        self._lock = threading.RLock()
+        self._draining = threading.Event()
+        self._stopped = threading.Event()
+        self._future: Optional[StreamingPullFuture] = None
+        self._timer: Optional[threading.Thread] = None
+
+    def start(self) -> StreamingPullFuture:
+        self._future = self._subscriber.subscribe(
+            self._subscription_path,
+            callback=self._on_message,
+            flow_control=self._flow_control,
+            await_callbacks_on_shutdown=True,
+        )
+        # a dead stream (permissions, deleted subscription..) stops the worker
+        self._future.add_done_callback(lambda _: self._stopped.set())
+        self._timer = threading.Thread(
+            target=self._flush_on_timer, name="pull-timer", daemon=True
+        )
+        self._timer.start()
+        logger.info("pulling from %s", self._subscription_path)
+        return self._future
+
+    def _on_message(self, message: Message) -> None:
+        if self._draining.is_set():
+            # shutting down: hand it back for another instance to pick up
+            message.nack()
+            return
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(message)
+            if len(self._buffer) >= self._batch_messages:
+                self._submit_locked()
+
+    def _flush_on_timer(self) -> None:
+        tick = max(self._batch_seconds / 4, 0.01)
+        while not self._draining.wait(tick):
+            with self._lock:
+                if (
+                    self._buffer
+                    and time.monotonic() - self._oldest >= self._batch_seconds
+                ):
+                    self._submit_locked()
+            if notifier is not None:
+                # held digests go out once their window has passed
+                notifier.dispatch(wait=False)
+
+    def _submit_locked(self) -> None:
+        batch, self._buffer = self._buffer, []
+        future = self._executor.submit(self._process, batch)
+        self._in_flight.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._in_flight.discard(future)
+
+    def _process(self, messages: List[Message]) -> None:
+        alerts: List[Dict[str, Any]] = []
+        # alert_id -> indexes of the messages that carried it
+        owners: Dict[str, List[int]] = {}
+        for index, message in enumerate(messages):
+            batch = decode_payload(message.data, dict(message.attributes))
+            if batch is None:
+                logger.error("dropping undecodable message %s", message.message_id)
+                continue
+            for alert in batch:
+                alert_id = alert.get("alert_id") if isinstance(alert, dict) else None
+                if isinstance(alert_id, str):
+                    owners.setdefault(alert_id, []).append(index)
+            alerts.extend(batch)
+
+        try:
+            with span("pull_batch"):
+                report = self._writer_factory().write_alerts(alerts)
+        except Exception as e:
+            logger.error(f"error writing batch of {len(messages)} messages: {e}")
+            for message in messages:
+                message.nack()
+            count("messages_nacked", len(messages))
+            return
+
+        failed = {
+            index for alert_id in report.failed for index in owners.get(alert_id, ())
+        }
+        for index, message in enumerate(messages):
+            if index in failed:
+                message.nack()
+            else:
+                message.ack()
+        count("messages_acked", len(messages) - len(failed))
+        count("messages_nacked", len(failed))
+        # after the acks: sends never hold up the stream
+        notify_written(alerts, report, wait=False, hold=True)
+        logger.debug(
+            "batch of %d messages: %d alerts, %d messages nacked",
+            len(messages),
+            len(alerts),
+            len(failed),
+        )
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        drains in-flight work while the stream is still open, so the acks
+        get through, then closes it. messages arriving meanwhile are nacked
+        """
+        logger.info("draining pull consumer..")
+        self._draining.set()
+        if self._timer is not None:
+            self._timer.join()
+        with self._lock:
+            if self._buffer:
+                self._submit_locked()
+            in_flight = list(self._in_flight)
+        _, pending = wait(in_flight, timeout=timeout)
+        if pending:
+            # their messages are redelivered once the leases run out
+            logger.error(f"{len(pending)} batches still running after {timeout}s")
+        if self._future is not None:
+            self._future.cancel()
+            try:
+                self._future.result()
+            except Exception as e:
+                logger.debug("streaming pull closed: %s", e)
+        self._executor.shutdown(wait=False)
+        if notifier is not None:
+            notifier.close()
+        self._stopped.set()
+        logger.info("instrumentation since start: %s", registry)
+
+    def run(self, drain_timeout: Optional[float] = None) -> None:
+        """blocks until SIGTERM / SIGINT or a dead stream, then drains"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self._stopped.set())
+        with self._subscriber:
+            self.start()
+            self._stopped.wait()
+            self.stop(timeout=drain_timeout)
+
+
+def consumer_from_env() -> PullConsumer:
     subscriber = SubscriberClient()
     subscription_path = subscriber.subscription_path(
         os.environ["PROJECT_ID"], os.environ["SUBSCRIPTION"]
     )
-    with subscriber:
-        try:
-            streaming_pull_future = subscriber.subscribe(
-                subscription_path, callback=callback
-            )
-            streaming_pull_future.result()
-
-        except KeyboardInterrupt:
-            streaming_pull_future.cancel()  # pyright: ignore
-            print("exiting..\n")
+    return PullConsumer(
+        subscription_path,
+        subscriber=subscriber,
+        max_messages=int(os.environ.get("PULL_MAX_MESSAGES", 1000)),
+        max_bytes=int(os.environ.get("PULL_MAX_BYTES", 100 * 1024 * 1024)),
+        batch_messages=int(os.environ.get("PULL_BATCH_MESSAGES", 100)),
+        batch_seconds=float(os.environ.get("PULL_BATCH_SECONDS", 0.5)),
+        workers=int(os.environ.get("PULL_WORKERS", 4)),
+    )
 
 
-def callback(message: Message) -> None:
-    print(message.data)
-    message.ack()
+def subscribe():
+    # cloud run gives 10s between SIGTERM and SIGKILL by default
+    consumer_from_env().run(
+        drain_timeout=float(os.environ.get("PULL_DRAIN_TIMEOUT", 8))
+    )
 
 
 if __name__ == "__main__":
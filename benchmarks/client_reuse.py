@@ -0,0 +1,96 @@
+"""
+Per-invocation latency of building a Firestore client on every call versus
+reusing the pooled one from clients.py.
+
+    # fake client, setup cost simulated with --setup-ms
+    python benchmarks/client_reuse.py --invocations 200
+
+    # real clients against the emulator
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/client_reuse.py --emulator
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "alert_processor", "src")
+)
+
+from clients import FirestorePool, _default_factory  # noqa: E402
+
+
+class FakeDocument:
+    def set(self, data):
+        return None
+
+
+class FakeCollection:
+    def document(self, document_id=None):
+        return FakeDocument()
+
+
+class FakeClient:
+    """stands in for the grpc channel + auth handshake of a real client"""
+
+    def __init__(self, setup_seconds: float) -> None:
+        time.sleep(setup_seconds)
+
+    def collection(self, name):
+        return FakeCollection()
+
+    def close(self):
+        return None
+
+
+def _invoke(client) -> None:
+    client.collection("bench_alerts").document(document_id="bench").set({"ok": True})
+
+
+def _run(get_client, invocations: int):
+    timings = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        _invoke(get_client())
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _summary(name: str, timings) -> str:
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return (
+        f"{name:<8} mean={statistics.mean(ordered):8.3f}ms "
+        f"p50={statistics.median(ordered):8.3f}ms p99={p99:8.3f}ms "
+        f"first={timings[0]:8.3f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invocations", type=int, default=100)
+    parser.add_argument("--setup-ms", type=float, default=50.0)
+    parser.add_argument("--emulator", action="store_true")
+    args = parser.parse_args()
+
+    if args.emulator:
+        if "FIRESTORE_EMULATOR_HOST" not in os.environ:
+            parser.error("--emulator needs FIRESTORE_EMULATOR_HOST")
+        factory = _default_factory
+    else:
+
+        def factory(database):
+            return FakeClient(args.setup_ms / 1000)
+
+    before = _run(lambda: factory("alerts-store"), args.invocations)
+    pool = FirestorePool(factory=factory)
+    after = _run(lambda: pool.get("alerts-store"), args.invocations)
+
+    print(_summary("before", before))
+    print(_summary("after", after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Throughput, latency, store round trips and peak memory of every pipeline
+stage, driven with synthetic alerts at growing volumes:
+
+    generate  SyntheticAlertGenerator.run (stands in for AlertGenerator.run,
+              the LLM itself is not benchmarked)
+    decode    _decode_message on the Pub/Sub push event, in --encoding
+    write     FSWriter.write, validation and dedup included
+    metrics   FireStoreMetricsAggregator.write_to_db, full single pass
+
+Stores are the local SQLite one from storage.py, or the Firestore emulator.
+
+    python benchmarks/pipeline.py --sizes 10,100,1000,10000,100000,1000000
+    python benchmarks/pipeline.py --output results.json --baseline baseline.json
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/pipeline.py --emulator
+
+Results are written as JSON. With --baseline, every stage/size is compared
+to the stored run and the exit code is 1 when one got slower than
+--tolerance allows. There is no committed baseline: record one on the
+machine the comparisons will run on, with --output baseline.json.
+"""
+
+import argparse
+import base64
+import gc
+import importlib
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+from datetime import datetime, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def _load(service: str, *names: str):
+    """
+    imports modules from one service's flat src/ tree. the services share
+    module names (main, storage, counters..), so whatever got imported is
+    dropped from sys.modules again before the next service is loaded
+    """
+    path = os.path.join(ROOT, service, "src")
+    before = set(sys.modules)
+    sys.path.insert(0, path)
+    try:
+        modules = [importlib.import_module(name) for name in names]
+    finally:
+        sys.path.remove(path)
+        for name in set(sys.modules) - before:
+            module = sys.modules[name]
+            if os.path.dirname(getattr(module, "__file__", "") or "") == path:
+                del sys.modules[name]
+    return modules
+
+
+synthetic, wire = _load("alert_generator", "synthetic_generator", "wire")
+processor, processor_dedup = _load("alert_processor", "main", "dedup")
+calculator, calculator_storage = _load("alert_metrics_calculator", "main", "storage")
+# keep per-batch INFO logging out of the timings, whatever LOG_LEVEL says
+logging.getLogger().setLevel(logging.WARNING)
+
+STAGES = ("generate", "decode", "write", "metrics")
+DEFAULT_SIZES = "10,100,1000,10000,100000,1000000"
+
+
+class CountingStore:
+    """
+    proxies an AlertStore and counts calls, one per round trip to the
+    database (write_documents may take more than one past 400 documents)
+    """
+
+    def __init__(self, store) -> None:
+        self._store = store
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+
+def _new_store(emulator: bool, collection: str):
+    if emulator:
+        client = calculator.firestore_pool.get()
+        return calculator_storage.FirestoreAlertStore(client, collection)
+    return calculator_storage.SQLiteAlertStore(":memory:")
+
+
+def _alerts(size: int, seed: int):
+    generator = synthetic.SyntheticAlertGenerator(seed=seed)
+    return generator.run(size)
+
+
+def _event(result, encoding: str) -> dict:
+    # same wire format as _encode in alert_generator/src/main.py
+    payload, attributes = wire.encode(result["alerts"]["alerts"], encoding)
+    return {"data": base64.b64encode(payload), "attributes": attributes}
+
+
+def _prepare(stage: str, size: int, seed: int, emulator: bool, encoding: str):
+    """returns (run, store) with everything but the measured call set up"""
+    collection = f"bench_{uuid.uuid4().hex[:12]}"
+    if stage == "generate":
+        generator = synthetic.SyntheticAlertGenerator(seed=seed)
+        return (lambda: generator.run(size)), None
+
+    result = _alerts(size, seed)
+    if stage == "decode":
+        event = _event(result, encoding)
+        return (lambda: processor._decode_message(event)), None
+
+    store = CountingStore(_new_store(emulator, collection))
+    if stage == "write":
+        writer = processor.FSWriter(
+            collection=collection,
+            store=store,
+            dedup=processor_dedup.Deduplicator(capacity=max(size, 1)),
+        )
+        message = {"alerts": result}
+        return (lambda: writer.write(message)), store
+
+    alerts = result["alerts"]["alerts"]
+    for start in range(0, len(alerts), 400):
+        chunk = alerts[start : start + 400]
+        store.write_alerts({alert["alert_id"]: alert for alert in chunk})
+    store.calls = 0
+    aggregator = calculator.FireStoreMetricsAggregator(
+        from_collection=collection,
+        to_collection=f"{collection}_metrics",
+        rollup_collection=f"{collection}_rollups",
+        store=store,
+    )
+    return aggregator.write_to_db, store
+
+
+def _percentile(ordered, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def measure(
+    stage: str, size: int, repeats: int, seed: int, emulator: bool, encoding: str
+) -> dict:
+    timings = []
+    rpcs = 0
+    for repeat in range(repeats):
+        run, store = _prepare(stage, size, seed + repeat, emulator, encoding)
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+        if store is not None:
+            rpcs = store.calls
+
+    # separate pass: tracemalloc slows everything down too much to time
+    run, _ = _prepare(stage, size, seed, emulator, encoding)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(timings)
+    median = statistics.median(ordered)
+    return {
+        "stage": stage,
+        "size": size,
+        "repeats": repeats,
+        "throughput_per_s": round(size / median, 1) if median else None,
+        "p50_ms": round(median * 1000, 3),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+        "rpcs": rpcs,
+        "peak_memory_bytes": peak,
+    }
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """stage/size pairs whose p50 grew more than `tolerance` over the baseline"""
+    reference = {(row["stage"], row["size"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        before = reference.get((row["stage"], row["size"]))
+        if before is None or not before["p50_ms"]:
+            continue
+        ratio = row["p50_ms"] / before["p50_ms"]
+        flag = " REGRESSION" if ratio > 1 + tolerance else ""
+        print(
+            f"{row['stage']:<9}{row['size']:>9}  p50 {before['p50_ms']:10.3f}ms"
+            f" -> {row['p50_ms']:10.3f}ms  x{ratio:5.2f}"
+            f"  rpcs {before['rpcs']} -> {row['rpcs']}{flag}"
+        )
+        if flag:
+            regressions.append(row)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="runs per stage and size, capped to keep size * repeats <= 10^6",
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--emulator", action="store_true")
+    parser.add_argument("--encoding", choices=wire.ENCODINGS, default=wire.JSON)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if not wire.available(args.encoding):
+        parser.error(f"--encoding {args.encoding} is not installed")
+    if args.emulator and "FIRESTORE_EMULATOR_HOST" not in os.environ:
+        parser.error("--emulator needs FIRESTORE_EMULATOR_HOST")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    results = []
+    for stage in stages:
+        for size in sizes:
+            repeats = max(1, min(args.repeats, 1_000_000 // max(size, 1)))
+            row = measure(stage, size, repeats, args.seed, args.emulator, args.encoding)
+            results.append(row)
+            print(
+                f"{stage:<9}{size:>9}  {row['throughput_per_s'] or 0:>14,.0f}/s"
+                f"  p50 {row['p50_ms']:10.3f}ms  p99 {row['p99_ms']:10.3f}ms"
+                f"  rpcs {row['rpcs']:>5}"
+                f"  peak {row['peak_memory_bytes'] / 2**20:8.1f}MiB"
+            )
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "store": "firestore-emulator" if args.emulator else "sqlite",
+        "encoding": args.encoding,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
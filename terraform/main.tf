@@ -140,6 +140,49 @@ resource "google_cloud_scheduler_job" "metrics_job" {
 
 
 
+resource "google_cloudfunctions_function" "apply_retention" {
+  name = "apply_retention"
+  runtime = "python310"
+  region = var.location
+
+  source_archive_bucket = google_storage_bucket.function_bucket.name
+  source_archive_object = google_storage_bucket_object.metrics_function_source.name
+
+
+  trigger_http = true
+
+
+  entry_point = "apply_retention"
+  service_account_email = google_service_account.metrics_function_sa.email
+  timeout = 540
+  available_memory_mb = 256
+}
+
+resource "google_cloudfunctions_function_iam_member" "retention_scheduler_invoker" {
+  project        = google_cloudfunctions_function.apply_retention.project
+  region         = google_cloudfunctions_function.apply_retention.region
+  cloud_function = google_cloudfunctions_function.apply_retention.name
+  role           = "roles/cloudfunctions.invoker"
+  member         = "serviceAccount:${google_service_account.scheduler_sa.email}"
+}
+
+resource "google_cloud_scheduler_job" "retention_job" {
+  name       = "retention-job"
+  schedule   = "17 * * * *"
+  region     = "europe-west6"
+  time_zone  = "UTC"
+  depends_on = [google_cloudfunctions_function.apply_retention, google_cloudfunctions_function_iam_member.retention_scheduler_invoker]
+
+  http_target {
+    http_method = "POST"
+    uri         = google_cloudfunctions_function.apply_retention.https_trigger_url
+    oidc_token {
+      service_account_email = google_service_account.scheduler_sa.email
+      audience = google_cloudfunctions_function.apply_retention.https_trigger_url
+    }
+  }
+}
+
 resource "google_cloud_scheduler_job" "job" {
   name       = "test-job"
   schedule   = "*/1 * * * *"